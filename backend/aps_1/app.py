@@ -1,29 +1,85 @@
+import time
+_import_started = time.perf_counter()
+
+import os
 from flask import Flask
 from flask_cors import CORS
 from routes.air_quality import air_quality_bp
-from routes.alerts import alerts_bp, init_alerts
+from routes.alerts import alerts_bp, init_alerts, start_alerts_scheduler, start_outbox_workers, startup_lock
 from routes.usuarios import usuarios_bp
-from models import db
+from models import db, init_spatial_index, init_data_versions, upgrade_schema
 from routes.enderecos import enderecos_bp
+from routes.metrics import metrics_bp, init_metrics
+from services.metrics import STARTUP_DURATION
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+DEFAULT_CONFIG = {
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///site.db',
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    # scheduler de alerts só sob demanda (servidor de produção/dev); testes,
+    # benchmarks e CLI criam o app sem threads em segundo plano
+    'START_SCHEDULER': os.environ.get('START_SCHEDULER', '').lower() in ('1', 'true', 'yes'),
+    # workers do outbox (checagem imediata de POST /alerts e envios), também
+    # sob demanda e independentes do scheduler; sem eles os jobs só acumulam
+    'START_OUTBOX_WORKERS': os.environ.get('START_OUTBOX_WORKERS', '').lower() in ('1', 'true', 'yes'),
+}
+
+
+def create_app(config=None):
+    """
+    Monta o app. Nada pesado acontece no import: Firebase e as sessões HTTP
+    são criados no primeiro uso e o scheduler só inicia com START_SCHEDULER.
+    Os workers do outbox, da mesma forma, só com START_OUTBOX_WORKERS.
+    O tempo de cada etapa fica em app.config['STARTUP_TIMINGS'] e na métrica
+    aps_startup_seconds.
+    """
+    started = time.perf_counter()
+    timings = {'import': IMPORT_SECONDS}
+
+    app = Flask(__name__)
+    CORS(app)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
 
-app = Flask(__name__)
-CORS(app)
+    db.init_app(app)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.register_blueprint(enderecos_bp)
+    app.register_blueprint(air_quality_bp)
+    app.register_blueprint(alerts_bp)
+    app.register_blueprint(usuarios_bp)
+    app.register_blueprint(metrics_bp)
+    init_metrics(app)
+    timings['config'] = time.perf_counter() - started
 
-db.init_app(app)
+    mark = time.perf_counter()
+    # um processo por vez: create_all, ALTER TABLE e a migração do alerts.sqlite
+    # não podem correr em paralelo entre workers que sobem juntos
+    with startup_lock(app):
+        with app.app_context():
+            db.create_all()
+            upgrade_schema()
+            init_spatial_index()
+            init_data_versions()
+        # DB e (opcionalmente) scheduler relacionados a alerts (após registrar blueprint)
+        init_alerts(app, start_scheduler=False)
+    timings['db'] = time.perf_counter() - mark
 
-app.register_blueprint(enderecos_bp)
-app.register_blueprint(air_quality_bp)
-app.register_blueprint(alerts_bp)
-app.register_blueprint(usuarios_bp)
+    mark = time.perf_counter()
+    if app.config['START_SCHEDULER']:
+        start_alerts_scheduler(app)
+    if app.config['START_OUTBOX_WORKERS']:
+        start_outbox_workers(app)
+    timings['scheduler'] = time.perf_counter() - mark
 
-# inicializa DB e scheduler relacionados a alerts (após registrar blueprint)
-init_alerts(app)
+    timings['total'] = IMPORT_SECONDS + time.perf_counter() - started
+    for phase, seconds in timings.items():
+        STARTUP_DURATION.set(round(seconds, 6), phase=phase)
+    app.config['STARTUP_TIMINGS'] = {phase: round(seconds, 4) for phase, seconds in timings.items()}
+    app.logger.info(f"App criado em {timings['total']:.3f}s ({app.config['STARTUP_TIMINGS']})")
+    return app
 
-with app.app_context():
-    db.create_all()
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # servidor de desenvolvimento; em produção use wsgi.py (gunicorn, ver dockerfile)
+    create_app({'START_SCHEDULER': True, 'START_OUTBOX_WORKERS': True}).run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,139 @@
+# bench/bench_adaptive.py
+# Benchmark: agendamento fixo (toda célula a cada INTERVAL_MINUTES) contra o
+# adaptativo (services/adaptive_schedule.py) num relógio simulado de 24 h.
+# Cada célula tem uma série de AQI sintética que muda de hora em hora (como as
+# estações do WAQI, cada uma num minuto diferente); mede buscas ao upstream,
+# notificações e o atraso entre a leitura passar do limite e a notificação sair.
+#
+# Uso (a partir de backend/aps_1):
+#   python bench/bench_adaptive.py [--cells 2000] [--alerts 20000] [--hours 24]
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.adaptive_schedule import (AdaptiveSchedule, DEFAULT_MIN_INTERVAL_SECONDS,  # noqa: E402
+                                        DEFAULT_MAX_INTERVAL_SECONDS, DEFAULT_TICK_SECONDS)
+from services.threshold_index import ThresholdIndex  # noqa: E402
+
+INTERVAL_SECONDS = 15 * 60
+COOLDOWN_SECONDS = 60 * 60
+LIMITS = (50, 100, 150, 200)
+
+
+def synthetic_series(cells, hours, rnd):
+    """AQI por célula e hora: passeio aleatório em torno de um nível, com picos ocasionais."""
+    series = {}
+    for cell in cells:
+        level = rnd.uniform(10, 160)
+        values = []
+        for _ in range(hours + 2):
+            level = min(400.0, max(5.0, level + rnd.gauss(0, 12)))
+            spike = rnd.uniform(40, 120) if rnd.random() < 0.03 else 0.0
+            values.append(round(level + spike))
+        # cada estação publica num minuto diferente da hora
+        series[cell] = (rnd.uniform(0, 3600), values)
+    return series
+
+
+def build_index(cells, n_alerts, rnd):
+    index = ThresholdIndex(COOLDOWN_SECONDS, precision=2)
+    for i in range(n_alerts):
+        lat, lon = rnd.choice(cells)
+        index.add({'id': i + 1, 'lat': lat, 'lon': lon, 'aqi_limit': rnd.choice(LIMITS)})
+    return index
+
+
+def simulate(mode, cells, series, n_alerts, hours, seed, tick, min_interval, max_interval):
+    index = build_index(cells, n_alerts, random.Random(seed))
+    schedule = AdaptiveSchedule(INTERVAL_SECONDS, min_interval, max_interval)
+    start = 1_700_000_000.0 - 1_700_000_000.0 % 3600
+    fetches = notified = 0
+    delays = []
+    next_fixed = start
+    cpu_started = time.perf_counter()
+
+    def reading(cell, now):
+        offset, values = series[cell]
+        hour = int((now - start + offset) // 3600)
+        return values[hour], start - offset + hour * 3600
+
+    def check(cell, now):
+        nonlocal notified
+        aqi, since = reading(cell, now)
+        fired, _ = index.matches(cell, aqi, now)
+        for alert in fired:
+            # desde quando o alerta já deveria ter disparado: início da leitura
+            # atual ou fim do cooldown, o que vier depois
+            ready_at = max(start, since, index._cooldown_until[alert['id']])
+            delays.append(round(now - ready_at))
+        index.mark_notified([a['id'] for a in fired], when=now)
+        notified += len(fired)
+        return aqi
+
+    now = start
+    end = start + hours * 3600
+    while now < end:
+        if mode == 'fixed':
+            if now >= next_fixed:
+                for cell in index.cells():
+                    check(cell, now)
+                    fetches += 1
+                next_fixed += INTERVAL_SECONDS
+        else:
+            schedule.sync(index.cells(), now)
+            for cell in schedule.due(now):
+                aqi = check(cell, now)
+                fetches += 1
+                schedule.reschedule(cell, aqi, *index.outlook(cell, now), now)
+        now += tick
+
+    delays.sort()
+    result = {
+        'schedule': mode,
+        'fetches': fetches,
+        'notified': notified,
+        'delay_p50_s': delays[len(delays) // 2] if delays else None,
+        'delay_p95_s': delays[int(len(delays) * 0.95)] if delays else None,
+        'delay_max_s': delays[-1] if delays else None,
+        'cpu_seconds': round(time.perf_counter() - cpu_started, 3),
+    }
+    if mode == 'adaptive':
+        result['schedule_stats'] = schedule.stats(end)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Checagem periódica: intervalo fixo x agendamento adaptativo')
+    parser.add_argument('--cells', type=int, default=2000)
+    parser.add_argument('--alerts', type=int, default=20_000)
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--tick', type=int, default=DEFAULT_TICK_SECONDS)
+    parser.add_argument('--min-interval', type=int, default=DEFAULT_MIN_INTERVAL_SECONDS)
+    parser.add_argument('--max-interval', type=int, default=DEFAULT_MAX_INTERVAL_SECONDS)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    cells = sorted({(round(rnd.uniform(-33, 5), 2), round(rnd.uniform(-73, -35), 2)) for _ in range(args.cells)})
+    series = synthetic_series(cells, args.hours, rnd)
+    results = [
+        simulate(mode, cells, series, args.alerts, args.hours, args.seed, args.tick,
+                 args.min_interval, args.max_interval)
+        for mode in ('fixed', 'adaptive')
+    ]
+    fixed, adaptive = results
+    print(json.dumps({
+        'benchmark': 'adaptive_schedule',
+        'params': vars(args),
+        'results': results,
+        'fetch_reduction': round(1 - adaptive['fetches'] / fixed['fetches'], 3) if fixed['fetches'] else None,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# bench/bench_alerts_store.py
+# Microbenchmark: throughput misto leitura/escrita dos helpers antigos do
+# alerts.sqlite (conexão nova + lock global por chamada) contra o AlertStore
+# (conexão por thread + WAL).
+#
+# Uso (a partir de backend/aps_1):
+#   python bench/bench_alerts_store.py --rows 2000 --threads 8 --seconds 5
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.alerts_store import AlertStore  # noqa: E402
+
+
+class LegacyHelpers:
+    """Cópia do comportamento original de routes/alerts.py (antes do AlertStore)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def insert(self, alert):
+        with self._lock, sqlite3.connect(self.path) as conn:
+            cur = conn.cursor()
+            cur.execute('''
+                INSERT INTO alerts (user_id, location, lat, lon, aqi_limit, device_token, created_at, last_notified_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (alert['user_id'], alert['location'], float(alert['lat']), float(alert['lon']),
+                  float(alert['aqi_limit']), alert['device_token'], datetime.utcnow().isoformat(), None))
+            conn.commit()
+            return cur.lastrowid
+
+    def fetch_all(self, active_only=False):
+        with self._lock, sqlite3.connect(self.path) as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT id, user_id, location, lat, lon, aqi_limit, device_token, created_at, last_notified_at FROM alerts')
+            return [dict(zip(('id', 'user_id', 'location', 'lat', 'lon', 'aqi_limit', 'device_token',
+                              'created_at', 'last_notified_at'), r)) for r in cur.fetchall()]
+
+    def update_last_notified_many(self, alert_ids):
+        for alert_id in alert_ids:
+            with self._lock, sqlite3.connect(self.path) as conn:
+                cur = conn.cursor()
+                cur.execute('UPDATE alerts SET last_notified_at = ? WHERE id = ?',
+                            (datetime.utcnow().isoformat(), alert_id))
+                conn.commit()
+
+
+def _alert(i):
+    return {'user_id': i % 500, 'location': f'local {i}', 'lat': -23.5 + random.random(),
+            'lon': -46.6 + random.random(), 'aqi_limit': 100, 'device_token': f'token-{i}'}
+
+
+def run_workload(impl, rows, threads, seconds, write_ratio):
+    stop = time.monotonic() + seconds
+    counts = []
+
+    def worker():
+        ops = 0
+        rnd = random.Random()
+        while time.monotonic() < stop:
+            r = rnd.random()
+            if r < write_ratio / 2:
+                impl.insert(_alert(rnd.randrange(rows)))
+            elif r < write_ratio:
+                impl.update_last_notified_many([rnd.randint(1, rows) for _ in range(10)])
+            else:
+                impl.fetch_all()
+            ops += 1
+        counts.append(ops)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput misto do alerts.sqlite: helpers antigos x AlertStore')
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, default=0.3)
+    args = parser.parse_args()
+
+    results = {}
+    for name in ('legacy', 'store'):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'alerts.sqlite')
+            store = AlertStore(path)
+            store.init_schema()
+            for i in range(args.rows):
+                store.insert(_alert(i))
+            store.close()
+            if name == 'legacy':
+                # o arquivo original não usava WAL
+                with sqlite3.connect(path) as conn:
+                    conn.execute('PRAGMA journal_mode=DELETE')
+                impl = LegacyHelpers(path)
+            else:
+                impl = AlertStore(path)
+            results[name] = round(run_workload(impl, args.rows, args.threads, args.seconds, args.write_ratio), 1)
+
+    results['speedup'] = round(results['store'] / results['legacy'], 2) if results['legacy'] else None
+    print(json.dumps({'benchmark': 'alerts_store_mixed_ops_per_second', 'params': vars(args), 'results': results}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# bench/bench_startup.py
+# Mede o tempo de inicialização em processos novos (import frio): import do
+# app.py e create_app() por etapa, além do tempo total do processo.
+# Roda sem credenciais do Firebase e sem scheduler.
+#
+# Uso (a partir de backend/aps_1):
+#   python bench/bench_startup.py [--runs 10] [--scheduler]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, sys, time
+sys.path.insert(0, {app_dir!r})
+from app import create_app
+app = create_app({{'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + {db!r}, 'ALERTS_DB_PATH': {alerts_db!r},
+                  'ALERTS_COORDINATION_DB': {coord_db!r}, 'START_SCHEDULER': {scheduler!r}}})
+print(json.dumps(app.config['STARTUP_TIMINGS']))
+'''
+
+
+def median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2] if ordered else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tempo de inicialização do app (processo novo)')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--scheduler', action='store_true', help='inclui START_SCHEDULER=True')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='aps_startup_')
+    code = CHILD.format(app_dir=APP_DIR, db=os.path.join(workdir, 'site.db'),
+                        alerts_db=os.path.join(workdir, 'alerts.sqlite'),
+                        coord_db=os.path.join(workdir, 'coordination.sqlite'), scheduler=args.scheduler)
+    phases, process = {}, []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', code], cwd=workdir, capture_output=True, text=True, check=True)
+        process.append(time.perf_counter() - started)
+        for phase, seconds in json.loads(out.stdout.strip().splitlines()[-1]).items():
+            phases.setdefault(phase, []).append(seconds)
+
+    print(json.dumps({
+        'benchmark': 'startup',
+        'params': vars(args),
+        'median_seconds': {phase: round(median(values), 4) for phase, values in phases.items()},
+        'process_median_seconds': round(median(process), 4),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
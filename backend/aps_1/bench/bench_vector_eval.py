@@ -0,0 +1,94 @@
+# bench/bench_vector_eval.py
+# Benchmark: avaliação de limite + cooldown em Python puro (evaluate_reference,
+# linha a linha com float()/fromisoformat) contra a máscara NumPy
+# (evaluate_mask), para 10k, 100k e 1M alertas.
+#
+# Uso (a partir de backend/aps_1):
+#   python bench/bench_vector_eval.py [--sizes 10000 100000 1000000]
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.vector_eval import AlertColumns, evaluate_mask, evaluate_reference  # noqa: E402
+
+COOLDOWN_SECONDS = 60 * 60
+
+
+def synthetic_alerts(n, cells, now, rnd):
+    alerts = []
+    for i in range(n):
+        lat, lon = cells[rnd.randrange(len(cells))]
+        last = None
+        if rnd.random() < 0.3:
+            last = (now - timedelta(seconds=rnd.randint(0, 3 * COOLDOWN_SECONDS))).isoformat()
+        alerts.append({
+            'id': i + 1,
+            'lat': lat,
+            'lon': lon,
+            'aqi_limit': float(rnd.choice((50, 100, 150, 200))),
+            'last_notified_at': last,
+        })
+    return alerts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Avaliação de alertas: Python puro x NumPy')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--cells', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    now_epoch = now.replace(tzinfo=timezone.utc).timestamp()
+    cells = [(round(-24 + rnd.random() * 2, 2), round(-47 + rnd.random() * 2, 2)) for _ in range(args.cells)]
+    readings = {cell: float(rnd.randint(20, 250)) for cell in cells}
+
+    results = []
+    for n in args.sizes:
+        alerts = synthetic_alerts(n, cells, now, rnd)
+
+        t0 = time.perf_counter()
+        fired_ref = evaluate_reference(alerts, lambda a: readings[(a['lat'], a['lon'])], now, COOLDOWN_SECONDS)
+        ref_seconds = time.perf_counter() - t0
+
+        # no app as colunas chegam prontas do SQLite (fetch_numeric_rows); aqui
+        # são montadas fora da medição
+        rows = np.array([
+            (a['id'], a['lat'], a['lon'], a['aqi_limit'],
+             datetime.fromisoformat(a['last_notified_at']).replace(tzinfo=timezone.utc).timestamp()
+             if a['last_notified_at'] else np.nan)
+            for a in alerts
+        ], dtype=np.float64)
+        t0 = time.perf_counter()
+        columns = AlertColumns.from_arrays(rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3], rows[:, 4])
+        build_seconds = time.perf_counter() - t0
+        cell_aqi = np.array([readings[cell] for cell in columns.cells])
+
+        t0 = time.perf_counter()
+        mask = evaluate_mask(columns, cell_aqi, now_epoch, COOLDOWN_SECONDS)
+        vec_seconds = time.perf_counter() - t0
+
+        assert sorted(columns.ids[mask].tolist()) == sorted(fired_ref), 'resultado diferente da referência'
+        results.append({
+            'alerts': n,
+            'fired': len(fired_ref),
+            'reference_seconds': round(ref_seconds, 4),
+            'vectorized_seconds': round(vec_seconds, 5),
+            'column_build_seconds': round(build_seconds, 4),
+            'speedup': round(ref_seconds / vec_seconds, 1) if vec_seconds else None,
+        })
+
+    print(json.dumps({'benchmark': 'vector_eval', 'params': vars(args), 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
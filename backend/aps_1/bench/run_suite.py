@@ -0,0 +1,305 @@
+# bench/run_suite.py
+# Suíte de benchmark offline: sobe servidores locais no lugar de WAQI, OpenAQ,
+# Nominatim e FCM (bench/stubs.py), serve o app num servidor WSGI com threads
+# e mede vazão e latências (p50/p95/p99) de /air-quality, /alerts e
+# /enderecos, além de ciclos de run_periodic_check sobre uma população
+# sintética de alertas. O resultado sai em JSON para comparar execuções.
+#
+# Uso (a partir de backend/aps_1):
+#   python bench/run_suite.py [--duration 10] [--concurrency 16] [--latency-ms 50]
+#                             [--error-rate 0.02] [--alerts 20000] [--out resultado.json]
+#                             [--snapshot]
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from stubs import StubConfig, start_stubs  # noqa: E402
+
+ENGINES = ('threads', 'asyncio', 'reading', 'adaptive', 'vectorized')
+SNAPSHOT_REGION = '-24.5,-47.5,-21.5,-44.5'
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def pct(p):
+        if not ordered:
+            return None
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+    return {'p50_ms': pct(0.50), 'p95_ms': pct(0.95), 'p99_ms': pct(0.99), 'max_ms': pct(1.0)}
+
+
+def configure_env(stubs, workdir, args):
+    """Aponta os módulos do app para os stubs; precisa rodar antes dos imports do app."""
+    os.environ['WAQI_BASE_URL'] = stubs['waqi'].base_url
+    os.environ['OPENAQ_BASE_URL'] = stubs['openaq'].base_url
+    os.environ['NOMINATIM_URL'] = stubs['nominatim'].base_url + '/search'
+    os.environ['NOMINATIM_MIN_INTERVAL'] = str(args.nominatim_interval)
+    os.environ['FCM_ENDPOINT'] = stubs['fcm'].base_url + '/v1/projects/bench/messages:send'
+    os.environ['GEOCODE_DB_PATH'] = os.path.join(workdir, 'geocode_cache.sqlite')
+    os.environ['AQI_HISTORY_DB_PATH'] = os.path.join(workdir, 'aqi_history.sqlite')
+    os.environ['UPSTREAM_BACKOFF_BASE'] = str(args.backoff_base)
+    os.environ['WAQI_TOKEN'] = 'bench'
+    # os stubs não têm cota: o orçamento por provedor não deve limitar a medição
+    os.environ['WAQI_REQUESTS_PER_MINUTE'] = str(args.upstream_budget)
+    os.environ['OPENAQ_REQUESTS_PER_MINUTE'] = str(args.upstream_budget)
+    if args.snapshot:
+        # uma região cobrindo as células e endereços sintéticos
+        os.environ['WAQI_SNAPSHOT_REGIONS'] = SNAPSHOT_REGION
+
+
+def build_app(workdir):
+    """App de produção (create_app) sem scheduler: os ciclos são disparados aqui."""
+    from app import create_app
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'site.db'),
+        'WAQI_TOKEN': 'bench',
+        'START_SCHEDULER': False,
+    })
+
+
+def serve(app):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def drive(name, make_request, duration, concurrency):
+    """Dispara make_request(session, rnd) em `concurrency` threads por `duration` segundos."""
+    latencies, errors, lock = [], [0], threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        session = requests.Session()
+        local, failed = [], 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                resp = make_request(session, rnd)
+                if resp.status_code >= 500:
+                    failed += 1
+            except requests.RequestException:
+                failed += 1
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.monotonic() - started
+    return dict({
+        'scenario': name,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+    }, **percentiles(latencies))
+
+
+def http_scenarios(base, cells, addresses):
+    def rand_cell(rnd):
+        lat, lon = rnd.choice(cells)
+        # ruído dentro da célula para exercitar o cache por célula
+        return lat + rnd.uniform(-0.004, 0.004), lon + rnd.uniform(-0.004, 0.004)
+
+    def air_quality_coords(session, rnd):
+        lat, lon = rand_cell(rnd)
+        return session.get(f'{base}/air-quality', params={'lat': lat, 'lon': lon})
+
+    def air_quality_address(session, rnd):
+        return session.get(f'{base}/air-quality', params={'address': rnd.choice(addresses)})
+
+    def air_quality_batch(session, rnd):
+        # painel com as localizações de um usuário: 10 pontos, alguns repetidos
+        return session.post(f'{base}/air-quality/batch', json=[
+            dict(zip(('lat', 'lon'), rand_cell(rnd))) for _ in range(10)])
+
+    def alerts_post(session, rnd):
+        lat, lon = rand_cell(rnd)
+        return session.post(f'{base}/alerts', json={
+            'user_id': rnd.randint(1, 500), 'location': 'bench', 'lat': lat, 'lon': lon,
+            'aqi_limit': rnd.choice((50, 100, 150, 200)), 'device_token': f'tok-{rnd.getrandbits(32)}',
+        })
+
+    def alerts_get(session, rnd):
+        return session.get(f'{base}/alerts', params={'user_id': rnd.randint(1, 500), 'limit': 100})
+
+    def enderecos_post(session, rnd):
+        lat, lon = rand_cell(rnd)
+        return session.post(f'{base}/enderecos', json={
+            'nome_local': 'bench', 'id_usuario': rnd.randint(1, 500), 'latitude': lat, 'longitude': lon,
+        })
+
+    def enderecos_get(session, rnd):
+        return session.get(f'{base}/enderecos', params={'user_id': rnd.randint(1, 500), 'limit': 100})
+
+    return [
+        ('air_quality_coords', air_quality_coords),
+        ('air_quality_address', air_quality_address),
+        ('air_quality_batch', air_quality_batch),
+        ('alerts_post', alerts_post),
+        ('alerts_get', alerts_get),
+        ('enderecos_post', enderecos_post),
+        ('enderecos_get', enderecos_get),
+    ]
+
+
+def populate_users(store, n):
+    """Usuários 1..n com token, para que as localizações de /enderecos sejam monitoradas."""
+    conn = store.connection()
+    with conn:
+        conn.executemany('INSERT OR IGNORE INTO usuarios (id_usuario, nome, device_token, token_invalid) '
+                         'VALUES (?, ?, ?, 0)', [(i, f'bench {i}', f'user-tok-{i}') for i in range(1, n + 1)])
+
+
+def populate_alerts(store, n, cells, invalid_rate, rnd):
+    """Insere n alertas sintéticos direto no SQLite (um único commit)."""
+    created_at = datetime.utcnow().isoformat()
+    rows = []
+    for i in range(n):
+        lat, lon = rnd.choice(cells)
+        token = f'invalid-{i}' if rnd.random() < invalid_rate else f'tok-{i}'
+        rows.append((rnd.randint(1, 500), 'bench', lat, lon, float(rnd.choice((50, 100, 150, 200))), token,
+                     created_at))
+    conn = store.connection()
+    with conn:
+        conn.executemany(
+            'INSERT INTO alerts (user_id, location, lat, lon, aqi_limit, device_token, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            rows)
+
+
+def run_cycles(app, engines, cycles):
+    import routes.alerts as alerts
+    from services.external_api import reading_cache
+
+    results = []
+    for engine in engines:
+        app.config['ALERTS_ENGINE'] = engine
+        # mesmo ponto de partida para cada motor: cache frio e nenhum cooldown
+        reading_cache.invalidate()
+        with alerts.store.connection() as conn:
+            conn.execute('UPDATE alerts SET last_notified_at = NULL, token_invalid = 0')
+            if alerts.store.unified:
+                conn.execute('UPDATE localizacoes SET last_notified_at = NULL')
+                conn.execute('UPDATE usuarios SET token_invalid = 0')
+        alerts._threshold_index = None
+        alerts._adaptive_schedule = None
+        for cycle in range(cycles):
+            started = time.perf_counter()
+            stats = alerts.run_periodic_check(app)
+            results.append({
+                'scenario': f'periodic_check_{engine}',
+                'cycle': cycle + 1,
+                'wall_seconds': round(time.perf_counter() - started, 3),
+                'stats': stats,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline do backend com APIs externas simuladas')
+    parser.add_argument('--duration', type=float, default=10, help='segundos por cenário HTTP')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=50, help='latência dos stubs')
+    parser.add_argument('--jitter-ms', type=float, default=10)
+    parser.add_argument('--error-rate', type=float, default=0.02, help='fração de respostas 503 dos stubs')
+    parser.add_argument('--fcm-latency-ms', type=float, default=None, help='latência do FCM (padrão: --latency-ms)')
+    parser.add_argument('--nominatim-interval', type=float, default=0.0,
+                        help='intervalo mínimo entre chamadas ao Nominatim (produção: 1.0)')
+    parser.add_argument('--backoff-base', type=float, default=0.05)
+    parser.add_argument('--cells', type=int, default=500)
+    parser.add_argument('--addresses', type=int, default=200)
+    parser.add_argument('--alerts', type=int, default=20000, help='população sintética para run_periodic_check')
+    parser.add_argument('--invalid-token-rate', type=float, default=0.01)
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=ENGINES)
+    parser.add_argument('--cycles', type=int, default=2, help='ciclos por motor (o 2º já encontra cache e cooldown)')
+    parser.add_argument('--skip-http', action='store_true')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--upstream-budget', type=float, default=1e6,
+                        help='requisições/min permitidas ao WAQI e ao OpenAQ (padrão: sem limite prático)')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='responde as coordenadas pelo snapshot regional do WAQI (map/bounds)')
+    parser.add_argument('--metrics', action='store_true', help='inclui o texto de /metrics no resultado')
+    parser.add_argument('--out', help='grava o JSON também neste arquivo')
+    args = parser.parse_args()
+
+    if args.out:
+        args.out = os.path.abspath(args.out)
+
+    rnd = random.Random(args.seed)
+    stub_config = StubConfig(args.latency_ms, args.jitter_ms, args.error_rate)
+    fcm_config = StubConfig(args.fcm_latency_ms if args.fcm_latency_ms is not None else args.latency_ms,
+                            args.jitter_ms, args.error_rate)
+    stubs = start_stubs({'waqi': stub_config, 'openaq': stub_config, 'nominatim': stub_config, 'fcm': fcm_config})
+
+    workdir = tempfile.mkdtemp(prefix='aps_bench_')
+    configure_env(stubs, workdir, args)
+    # credenciais e bancos com caminho relativo ficam no diretório temporário
+    os.chdir(workdir)
+
+    import routes.alerts as alerts
+    from services.external_api import upstream, reading_cache, region_snapshot, refresh_region_snapshot
+
+    app = build_app(workdir)
+    server, base = serve(app)
+    cells = [(round(-24 + rnd.random() * 2, 2), round(-47 + rnd.random() * 2, 2)) for _ in range(args.cells)]
+    addresses = [f'Rua Bench {i}, São Paulo' for i in range(args.addresses)]
+
+    populate_users(alerts.store, 500)
+    if args.snapshot:
+        refresh_region_snapshot('bench')
+    results = []
+    try:
+        if not args.skip_http:
+            for name, make_request in http_scenarios(base, cells, addresses):
+                results.append(drive(name, make_request, args.duration, args.concurrency))
+        if args.alerts:
+            populate_alerts(alerts.store, args.alerts, cells, args.invalid_token_rate, rnd)
+            results.extend(run_cycles(app, args.engines, args.cycles))
+    except BaseException:
+        server.shutdown()
+        raise
+
+    metrics_text = requests.get(f'{base}/metrics').text if args.metrics else None
+    report = {
+        'benchmark': 'suite',
+        'params': vars(args),
+        'startup': app.config['STARTUP_TIMINGS'],
+        'results': results,
+        'upstream': upstream.stats(),
+        'reading_cache': reading_cache.stats(),
+        'snapshot': region_snapshot.stats() if args.snapshot else None,
+        'stubs': {name: {'requests': s.requests, 'errors': s.errors} for name, s in stubs.items()},
+    }
+    server.shutdown()
+    if metrics_text is not None:
+        report['metrics'] = metrics_text
+    text = json.dumps(report, indent=2, default=str)
+    print(text)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+# bench/stubs.py
+# Servidores locais que imitam WAQI, OpenAQ, Nominatim e FCM para medir o
+# backend sem depender das APIs reais. Cada serviço tem latência (ms) e taxa
+# de erro (0..1, responde 503) configuráveis.
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+
+def _unit(text):
+    """Número determinístico em [0, 1) derivado do texto."""
+    return int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:8], 16) / 0xFFFFFFFF
+
+
+class StubConfig:
+    def __init__(self, latency_ms=50.0, jitter_ms=10.0, error_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'aps-bench-stub/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self):
+        """Aplica latência e erro configurados; retorna False se respondeu com erro."""
+        cfg = self.server.config
+        self.server.count()
+        delay = max(0.0, cfg.latency_ms + random.uniform(-cfg.jitter_ms, cfg.jitter_ms)) / 1000
+        if delay:
+            time.sleep(delay)
+        if cfg.error_rate and random.random() < cfg.error_rate:
+            self.server.count(error=True)
+            self._reply(503, {'error': 'stub: erro simulado'})
+            return False
+        return True
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+
+class WaqiHandler(_Handler):
+    BOUNDS_STEP = 0.05   # uma estação a cada 0,05° (~5,5 km) no map/bounds
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if not self._simulate():
+            return
+        if url.path.rstrip('/') == '/map/bounds':
+            return self._bounds(parse_qs(url.query).get('latlng', [''])[0])
+        if not url.path.startswith('/feed/geo:'):
+            return self._reply(404, {'status': 'error', 'data': 'Unknown endpoint'})
+        coords = unquote(url.path[len('/feed/geo:'):]).strip('/')
+        lat, _, lon = coords.partition(';')
+        u = _unit(coords)
+        # a observação muda de hora em hora, como nas estações reais
+        obs = int(time.time()) // 3600 * 3600
+        self._reply(200, {'status': 'ok', 'data': {
+            'aqi': int(20 + u * 230),
+            'idx': int(u * 100000),
+            'city': {'name': f'Estação {coords}', 'geo': [float(lat), float(lon)]},
+            'dominentpol': 'pm25',
+            'iaqi': {'pm25': {'v': round(10 + u * 150, 1)}, 'pm10': {'v': round(5 + u * 80, 1)},
+                     't': {'v': 22.0}, 'h': {'v': 60.0}},
+            'time': {'v': obs, 'iso': datetime.fromtimestamp(obs, timezone.utc).isoformat()},
+        }})
+
+
+    def _bounds(self, latlng):
+        try:
+            lat1, lon1, lat2, lon2 = (float(v) for v in latlng.split(','))
+        except ValueError:
+            return self._reply(200, {'status': 'error', 'data': 'Invalid bounds'})
+        step = self.BOUNDS_STEP
+        obs = datetime.fromtimestamp(int(time.time()) // 3600 * 3600, timezone.utc).isoformat()
+        stations = []
+        i = int(min(lat1, lat2) // step) + 1
+        while i * step <= max(lat1, lat2):
+            j = int(min(lon1, lon2) // step) + 1
+            while j * step <= max(lon1, lon2):
+                key = f'{i},{j}'
+                u = _unit(key)
+                stations.append({'lat': round(i * step, 4), 'lon': round(j * step, 4), 'uid': int(u * 10**9),
+                                 # algumas estações sem leitura, como no WAQI
+                                 'aqi': '-' if u < 0.05 else str(int(20 + u * 230)),
+                                 'station': {'name': f'Estação {key}', 'time': obs}})
+                j += 1
+            i += 1
+        self._reply(200, {'status': 'ok', 'data': stations})
+
+
+class OpenAqHandler(_Handler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if not self._simulate():
+            return
+        if url.path != '/v2/latest':
+            return self._reply(404, {'message': 'not found'})
+        coords = parse_qs(url.query).get('coordinates', [''])[0]
+        self._reply(200, {'results': [{'measurements': [
+            {'parameter': 'pm25', 'value': round(5 + _unit(coords) * 120, 1), 'unit': 'µg/m³'}
+        ]}]})
+
+
+class NominatimHandler(_Handler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if not self._simulate():
+            return
+        q = parse_qs(url.query).get('q', [''])[0]
+        if not q or 'inexistente' in q.lower():
+            return self._reply(200, [])
+        u = _unit(q.lower())
+        self._reply(200, [{'lat': f'{-24 + u * 2:.6f}', 'lon': f'{-47 + (1 - u) * 2:.6f}',
+                           'display_name': q}])
+
+
+class FcmHandler(_Handler):
+    def do_POST(self):
+        body = self._read_body()
+        if not self._simulate():
+            return
+        token = (body.get('message') or {}).get('token', '')
+        if token.startswith('invalid'):
+            return self._reply(404, {'error': {'code': 404, 'status': 'NOT_FOUND', 'details': [
+                {'@type': 'type.googleapis.com/google.firebase.fcm.v1.FcmError', 'errorCode': 'UNREGISTERED'}]}})
+        self._reply(200, {'name': f'projects/bench/messages/{random.getrandbits(48)}'})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, config):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.config = config
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def count(self, error=False):
+        with self._lock:
+            if error:
+                self.errors += 1
+            else:
+                self.requests += 1
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name=f'stub-{self.server_address[1]}', daemon=True).start()
+        return self
+
+
+HANDLERS = {
+    'waqi': WaqiHandler,
+    'openaq': OpenAqHandler,
+    'nominatim': NominatimHandler,
+    'fcm': FcmHandler,
+}
+
+
+def start_stubs(configs):
+    """configs: {nome: StubConfig}. Retorna {nome: StubServer} já rodando."""
+    return {name: StubServer(HANDLERS[name], configs[name]).start() for name in HANDLERS}
@@ -1,23 +1,58 @@
+import time
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import table, column, select, event
+from sqlalchemy.engine import Engine
 from datetime import datetime
+from services.geo import bounding_box, haversine_km
+from services.metrics import DB_QUERY_DURATION
+from services.http_cache import version_counter_ddl
 
 db = SQLAlchemy()
 
+
+# --- Tempo das consultas (aps_db_query_seconds, store="sqlalchemy") -----------
+_QUERY_VERBS = ('select', 'insert', 'update', 'delete')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    verb = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ''
+    DB_QUERY_DURATION.observe(time.perf_counter() - started, store='sqlalchemy',
+                              operation=verb if verb in _QUERY_VERBS else 'other')
+
+
+@event.listens_for(Engine, 'handle_error')
+def _query_failed(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_started'):
+        conn.info['query_started'].pop()
+
+
 class Usuario(db.Model):
     __tablename__ = 'usuarios'
     id_usuario = db.Column(db.Integer, primary_key=True)
-    device_token = db.Column(db.String(255), nullable=True)
+    device_token = db.Column(db.String(255), nullable=True, index=True)
     nome = db.Column(db.String(100), nullable=True)
+    # token rejeitado de forma permanente pelo FCM (não entra no scheduler)
+    token_invalid = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
 
 class Localizacao(db.Model):
     __tablename__ = 'localizacoes'
     id_localizacao = db.Column(db.Integer, primary_key=True)
-    id_usuario = db.Column(db.Integer, db.ForeignKey('usuarios.id_usuario'), nullable=False)
+    id_usuario = db.Column(db.Integer, db.ForeignKey('usuarios.id_usuario'), nullable=False, index=True)
     nome_local = db.Column(db.String(100), nullable=False)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
 
     aqi_limite = db.Column(db.Integer, nullable=False)
+    # ISO UTC da última notificação (cooldown do scheduler, via alert_sources)
+    last_notified_at = db.Column(db.String(32), nullable=True, index=True)
 
 class Alerta(db.Model):
     __tablename__ = 'alertas'
@@ -26,3 +61,102 @@ class Alerta(db.Model):
     data_hora = db.Column(db.DateTime, default=datetime.utcnow)
     aqi_registrado = db.Column(db.Integer, nullable=False)
     mensagem = db.Column(db.String(255), nullable=False)
+
+
+# --- Migração de bancos criados antes das colunas do scheduler ----------------
+_UPGRADE_COLUMNS = [
+    ('usuarios', 'token_invalid', 'ALTER TABLE usuarios ADD COLUMN token_invalid BOOLEAN NOT NULL DEFAULT 0'),
+    ('localizacoes', 'last_notified_at', 'ALTER TABLE localizacoes ADD COLUMN last_notified_at VARCHAR(32)'),
+]
+_UPGRADE_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_usuarios_device_token ON usuarios (device_token)',
+    'CREATE INDEX IF NOT EXISTS ix_localizacoes_id_usuario ON localizacoes (id_usuario)',
+    'CREATE INDEX IF NOT EXISTS ix_localizacoes_last_notified_at ON localizacoes (last_notified_at)',
+]
+
+
+def upgrade_schema():
+    """Adiciona colunas/índices novos em tabelas já existentes (create_all não altera tabelas)."""
+    for table_name, column_name, ddl in _UPGRADE_COLUMNS:
+        columns = {row[1] for row in db.session.execute(db.text(f'PRAGMA table_info({table_name})'))}
+        if column_name not in columns:
+            db.session.execute(db.text(ddl))
+    for ddl in _UPGRADE_INDEXES:
+        db.session.execute(db.text(ddl))
+    db.session.commit()
+
+
+# --- Índice espacial (R*Tree) das localizações --------------------------------
+_SPATIAL_INDEX_DDL = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS localizacoes_rtree
+       USING rtree(id, min_lat, max_lat, min_lon, max_lon)''',
+    '''CREATE TRIGGER IF NOT EXISTS localizacoes_rtree_insert AFTER INSERT ON localizacoes BEGIN
+           INSERT INTO localizacoes_rtree
+           VALUES (NEW.id_localizacao, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS localizacoes_rtree_update AFTER UPDATE OF latitude, longitude ON localizacoes BEGIN
+           UPDATE localizacoes_rtree SET min_lat = NEW.latitude, max_lat = NEW.latitude,
+                                         min_lon = NEW.longitude, max_lon = NEW.longitude
+           WHERE id = NEW.id_localizacao;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS localizacoes_rtree_delete AFTER DELETE ON localizacoes BEGIN
+           DELETE FROM localizacoes_rtree WHERE id = OLD.id_localizacao;
+       END''',
+]
+
+
+# tabela virtual fora do metadata (create_all não deve tentar criá-la)
+_localizacoes_rtree = table(
+    'localizacoes_rtree', column('id'), column('min_lat'), column('max_lat'), column('min_lon'), column('max_lon')
+)
+
+
+def init_spatial_index():
+    """Cria o R*Tree de localizacoes e indexa linhas antigas (chamar após create_all)."""
+    for ddl in _SPATIAL_INDEX_DDL:
+        db.session.execute(db.text(ddl))
+    total = db.session.execute(db.text('SELECT COUNT(*) FROM localizacoes')).scalar()
+    indexed = db.session.execute(db.text('SELECT COUNT(*) FROM localizacoes_rtree')).scalar()
+    if total != indexed:
+        db.session.execute(db.text('DELETE FROM localizacoes_rtree'))
+        db.session.execute(db.text(
+            'INSERT INTO localizacoes_rtree '
+            'SELECT id_localizacao, latitude, latitude, longitude, longitude FROM localizacoes'
+        ))
+    db.session.commit()
+
+
+# --- Contador de versão das localizações (ETag de GET /enderecos) ------------
+# só as colunas expostas pela API: o cooldown (last_notified_at) não invalida
+_VERSIONED_COLUMNS = ('id_usuario', 'nome_local', 'latitude', 'longitude', 'aqi_limite')
+
+
+def init_data_versions():
+    """Cria o contador de mudanças de localizacoes em data_versions (chamar após create_all)."""
+    for ddl in version_counter_ddl('localizacoes', columns=_VERSIONED_COLUMNS):
+        db.session.execute(db.text(ddl))
+    db.session.commit()
+
+
+def data_version(name):
+    """Valor atual de um contador de data_versions (0 se ainda não existe)."""
+    return db.session.execute(
+        db.text('SELECT version FROM data_versions WHERE name = :name'), {'name': name}).scalar() or 0
+
+
+def localizacoes_near(lat, lon, radius_km, limit=None):
+    """Lista de (Localizacao, distância em km) a até `radius_km` do ponto, mais próximas primeiro."""
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    candidates = select(_localizacoes_rtree.c.id).where(
+        _localizacoes_rtree.c.max_lat >= min_lat,
+        _localizacoes_rtree.c.min_lat <= max_lat,
+        _localizacoes_rtree.c.max_lon >= min_lon,
+        _localizacoes_rtree.c.min_lon <= max_lon,
+    )
+    found = []
+    for loc in Localizacao.query.filter(Localizacao.id_localizacao.in_(candidates)):
+        distance = haversine_km(lat, lon, loc.latitude, loc.longitude)
+        if distance <= radius_km:
+            found.append((loc, round(distance, 3)))
+    found.sort(key=lambda item: item[1])
+    return found[:limit] if limit is not None else found
@@ -1,26 +1,34 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import os
+import time
+from models import Localizacao
+from services.check_engine import DEFAULT_MAX_WORKERS
+from services.external_api import (get_waqi_feed, reading_cache, reading_version, region_snapshot, upstream,
+                                   READING_CACHE_PRECISION)
+from services.http_cache import cached_json_response, response_cache
+from services.aqi_history import history, history_key, parse_time_arg
+from services.geo import cell_key
+from services.geocoding import geocode, cache_stats as geocode_cache_stats
 
 air_quality_bp = Blueprint('air_quality', __name__)
 
 WAQI_TOKEN = os.environ.get('WAQI_TOKEN', 'b0ede179c7f377076245b3840a175c93ebef527d')
-USER_AGENT = 'air-quality-app/1.0 (+https://example.com)'
+AIR_QUALITY_BATCH_MAX_ITEMS = int(os.environ.get('AIR_QUALITY_BATCH_MAX_ITEMS', 200))
 
 def geocode_address(address):
-    url = 'https://nominatim.openstreetmap.org/search'
-    headers = {'User-Agent': USER_AGENT}
-    params = {'q': address, 'format': 'json', 'limit': 1}
+    # cache persistente + limite de 1 req/s ao Nominatim (services/geocoding.py)
     try:
-        resp = requests.get(url, headers=headers, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        if data:
-            return data[0].get('lat'), data[0].get('lon')
+        return geocode(address)
     except requests.RequestException as e:
-        print(f"Erro no geocode (Nominatim): {e}")
+        current_app.logger.warning(f"Erro no geocode (Nominatim): {e}")
     return None, None
 
+def wants_detailed(args):
+    """?detailed=1: poluentes (iaqi) do feed do WAQI em vez da leitura do snapshot regional."""
+    return args.get('detailed', '').lower() in ('1', 'true', 'yes')
+
 @air_quality_bp.route('/air-quality', methods=['GET'])
 def get_air_quality():
     # aceita address (texto) OU lat & lon (coordenadas)
@@ -44,53 +52,204 @@ def get_air_quality():
     except (TypeError, ValueError):
         return jsonify({'error': 'Latitude/longitude inválidas'}), 400
 
-    # chama WAQI usando a coordenada
-    waqi_url = f'https://api.waqi.info/feed/geo:{lat_f};{lon_f}/'
-    params = {'token': WAQI_TOKEN}
-    headers = {'User-Agent': USER_AGENT}
-
+    # chama WAQI usando a coordenada (via snapshot regional ou cache
+    # compartilhado de leituras); com ?detailed=1 vai ao feed pelos poluentes
+    detailed = wants_detailed(request.args)
     try:
-        r = requests.get(waqi_url, headers=headers, params=params, timeout=10)
-        r.raise_for_status()
-        payload = r.json()
+        payload = get_waqi_feed(lat_f, lon_f, WAQI_TOKEN, detailed=detailed)
+    except requests.RequestException as e:
+        current_app.logger.warning(f"Erro ao acessar WAQI: {e}")
+        return jsonify({'error': 'Erro ao acessar WAQI'}), 500
 
-        if payload.get('status') != 'ok':
-            return jsonify({'error': 'Dados de qualidade do ar não disponíveis'}), 404
+    if payload.get('status') != 'ok':
+        return jsonify({'error': 'Dados de qualidade do ar não disponíveis'}), 404
+    # corpo serializado (e ETag) reaproveitado enquanto a leitura for a mesma
+    return cached_json_response(('air-quality', lat_f, lon_f, detailed), reading_version(payload),
+                                lambda: waqi_reading(payload, lat_f, lon_f))
 
-        data = payload.get('data', {})
+def waqi_reading(payload, lat_f, lon_f):
+    """Resposta de /air-quality a partir do feed do WAQI (None se status != ok)."""
+    if payload.get('status') != 'ok':
+        return None
 
-        # extrair AQI com tratamento caso não seja número
-        raw_aqi = data.get('aqi')
+    data = payload.get('data', {})
+
+    # extrair AQI com tratamento caso não seja número
+    raw_aqi = data.get('aqi')
+    try:
+        aqi = int(raw_aqi)
+    except (TypeError, ValueError):
+        # WAQI às vezes retorna '-' ou null; tratar como None
+        aqi = None
+
+    city = None
+    if isinstance(data.get('city'), dict):
+        city = data['city'].get('name')
+
+    dominentpol = data.get('dominentpol')
+    iaqi = data.get('iaqi', {})
+
+    measurements = []
+    for param, value in iaqi.items():
+        measurements.append({
+            'parameter': param,
+            'value': value.get('v') if isinstance(value, dict) else value,
+            'unit': 'N/A'
+        })
+
+    reading = {
+        'location': city,
+        'aqi': aqi,
+        'dominentpol': dominentpol,
+        'measurements': measurements,
+        'lat': lat_f,
+        'lon': lon_f
+    }
+    # leitura do snapshot regional: estação usada, distância e idade
+    if 'snapshot' in data:
+        reading['snapshot'] = data['snapshot']
+    return reading
+
+def _parse_batch_items(items):
+    """Retorna [(índice, item)] com lat/lon resolvidos e {índice: (status, erro)} dos demais."""
+    parsed, errors = [], {}
+    ids = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[index] = 400, 'cada item deve ser um objeto com lat/lon ou id_localizacao'
+            continue
+        if item.get('id_localizacao') is not None:
+            try:
+                ids.setdefault(int(item['id_localizacao']), []).append(index)
+            except (TypeError, ValueError):
+                errors[index] = 400, 'id_localizacao deve ser inteiro'
+            continue
         try:
-            aqi = int(raw_aqi)
+            parsed.append((index, {'lat': float(item['lat']), 'lon': float(item['lon'])}))
+        except KeyError:
+            errors[index] = 400, 'Parâmetro obrigatório: lat + lon ou id_localizacao'
         except (TypeError, ValueError):
-            # WAQI às vezes retorna '-' ou null; tratar como None
-            aqi = None
-
-        city = None
-        if isinstance(data.get('city'), dict):
-            city = data['city'].get('name')
-
-        dominentpol = data.get('dominentpol')
-        iaqi = data.get('iaqi', {})
-
-        measurements = []
-        for param, value in iaqi.items():
-            measurements.append({
-                'parameter': param,
-                'value': value.get('v') if isinstance(value, dict) else value,
-                'unit': 'N/A'
-            })
-
-        return jsonify({
-            'location': city,
-            'aqi': aqi,
-            'dominentpol': dominentpol,
-            'measurements': measurements,
-            'lat': lat_f,
-            'lon': lon_f
-        }), 200
-
+            errors[index] = 400, 'Latitude/longitude inválidas'
+
+    # todos os id_localizacao numa consulta só
+    found = {}
+    if ids:
+        for loc in Localizacao.query.filter(Localizacao.id_localizacao.in_(list(ids))):
+            found[loc.id_localizacao] = loc
+    for loc_id, indexes in ids.items():
+        loc = found.get(loc_id)
+        for index in indexes:
+            if loc is None:
+                errors[index] = 404, 'Localização não encontrada'
+            else:
+                parsed.append((index, {'id_localizacao': loc.id_localizacao, 'nome_local': loc.nome_local,
+                                       'lat': loc.latitude, 'lon': loc.longitude}))
+    return parsed, errors
+
+def _fetch_cell(lat, lon, detailed=False):
+    try:
+        return get_waqi_feed(lat, lon, WAQI_TOKEN, detailed=detailed), None
     except requests.RequestException as e:
-        print(f"Erro ao acessar WAQI: {e}")
-        return jsonify({'error': 'Erro ao acessar WAQI'}), 500
+        return None, e
+
+@air_quality_bp.route('/air-quality/batch', methods=['POST'])
+def get_air_quality_batch():
+    # corpo: lista (ou {"items": [...]}) de {lat, lon} ou {id_localizacao};
+    # coordenadas na mesma célula do cache de leituras viram uma única busca
+    # e as células são buscadas em paralelo, então a resposta demora o tempo
+    # da chamada mais lenta ao WAQI e não a soma delas; ?detailed=1 como em /air-quality
+    detailed = wants_detailed(request.args)
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('items')
+    if not isinstance(data, list) or not data:
+        return jsonify({'error': 'Envie uma lista de itens com lat/lon ou id_localizacao'}), 400
+    if len(data) > AIR_QUALITY_BATCH_MAX_ITEMS:
+        return jsonify({'error': f'No máximo {AIR_QUALITY_BATCH_MAX_ITEMS} itens por requisição'}), 400
+
+    parsed, errors = _parse_batch_items(data)
+    cells = {}
+    for index, item in parsed:
+        key = cell_key(item['lat'], item['lon'], READING_CACHE_PRECISION)
+        cells.setdefault(key, []).append((index, item))
+
+    fetched = {}
+    if cells:
+        workers = min(current_app.config.get('AIR_QUALITY_BATCH_WORKERS', DEFAULT_MAX_WORKERS), len(cells))
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='aqi-batch') as pool:
+            futures = {key: pool.submit(_fetch_cell, group[0][1]['lat'], group[0][1]['lon'], detailed)
+                       for key, group in cells.items()}
+            fetched = {key: fut.result() for key, fut in futures.items()}
+
+    results = {index: {'index': index, 'status': status, 'error': message}
+               for index, (status, message) in errors.items()}
+    for key, group in cells.items():
+        payload, exc = fetched[key]
+        if exc is not None:
+            current_app.logger.warning(f"Erro ao acessar WAQI: {exc}")
+        for index, item in group:
+            extra = {k: v for k, v in item.items() if k not in ('lat', 'lon')}
+            if exc is not None:
+                results[index] = {'index': index, 'status': 500, 'error': 'Erro ao acessar WAQI', **extra}
+                continue
+            reading = waqi_reading(payload, item['lat'], item['lon'])
+            if reading is None:
+                results[index] = {'index': index, 'status': 404,
+                                  'error': 'Dados de qualidade do ar não disponíveis', **extra}
+            else:
+                results[index] = {'index': index, 'status': 200, **extra, **reading}
+
+    return jsonify({
+        'total': len(data),
+        'upstream_fetches': len(cells),
+        'results': [results[i] for i in sorted(results)]
+    }), 200
+
+@air_quality_bp.route('/air-quality/cache-stats', methods=['GET'])
+def get_cache_stats():
+    # contadores dos caches de leituras, de geocodificação e de respostas
+    # serializadas e estado do snapshot regional do WAQI, para monitoramento
+    return jsonify({
+        'readings': reading_cache.stats(),
+        'geocode': geocode_cache_stats(),
+        'responses': response_cache.stats(),
+        'snapshot': region_snapshot.stats()
+    }), 200
+
+@air_quality_bp.route('/air-quality/upstream-stats', methods=['GET'])
+def get_upstream_stats():
+    # latência e erros por host das APIs externas (WAQI, OpenAQ, Nominatim)
+    return jsonify(upstream.stats()), 200
+
+@air_quality_bp.route('/air-quality/history', methods=['GET'])
+def get_air_quality_history():
+    # série histórica local: ?lat=&lon=&from=&to=&resolution=raw|hour|day|auto
+    # from/to em epoch (segundos) ou ISO 8601; padrão: últimas 24 h
+    try:
+        lat_f = float(request.args['lat'])
+        lon_f = float(request.args['lon'])
+    except KeyError:
+        return jsonify({'error': 'Parâmetros obrigatórios: lat e lon'}), 400
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Latitude/longitude inválidas'}), 400
+    try:
+        to_ts = parse_time_arg(request.args.get('to'), int(time.time()))
+        from_ts = parse_time_arg(request.args.get('from'), to_ts - 24 * 3600)
+    except ValueError:
+        return jsonify({'error': 'from/to devem ser epoch em segundos ou data ISO 8601'}), 400
+    if from_ts > to_ts:
+        return jsonify({'error': 'from deve ser anterior a to'}), 400
+
+    key = history_key(cell_key(lat_f, lon_f, READING_CACHE_PRECISION))
+    try:
+        resolution, points = history.query(key, from_ts, to_ts, request.args.get('resolution', 'auto'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'lat': lat_f,
+        'lon': lon_f,
+        'from': from_ts,
+        'to': to_ts,
+        'resolution': resolution,
+        'points': points
+    }), 200
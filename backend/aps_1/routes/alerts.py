@@ -1,125 +1,242 @@
 # alerts.py
-import sqlite3
-import threading
+import os
+import time
+import atexit
+from contextlib import nullcontext
+from functools import partial
 from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify, current_app
+import sqlite3
 import requests
 from apscheduler.schedulers.background import BackgroundScheduler
-from services.notifications import send_push_notification, get_health_recommendations
+from services.notifications import (send_push_notification, send_push_or_raise, get_health_recommendations,
+                                    NotificationBatch, PERMANENT_TOKEN_ERRORS)
+from services.alerts_store import AlertStore
+from services.aqi_history import history, observation_epoch
+from services.external_api import (get_waqi_feed, fetch_openaq_latest, upstream, region_snapshot,
+                                   refresh_region_snapshot, WAQI_SNAPSHOT_INTERVAL)
+from services.pagination import parse_page_args, PaginationError, wants_ndjson, ndjson_response, page_headers
+from services.http_cache import cached_json_response
+from services.bulk import parse_bulk_records, BulkError, BulkResult, BULK_CHUNK_SIZE, BULK_CHUNK_ERROR
+from services.threshold_index import ThresholdIndex, ReadingEngine
+from services.check_engine import CheckEngine, DEFAULT_MAX_WORKERS
+from services.async_engine import AsyncCheckEngine, DEFAULT_CONCURRENCY, DEFAULT_DEADLINE_SECONDS
+from services.geo import DEFAULT_CELL_PRECISION, DEFAULT_CELL_MODE, parse_nearby_args
+from services.metrics import CHECK_CYCLE_DURATION, CHECK_CYCLE_ALERTS, NOTIFICATIONS, ADAPTIVE_FETCHES
+from services.adaptive_schedule import (AdaptiveSchedule, DEFAULT_MIN_INTERVAL_SECONDS,
+                                        DEFAULT_MAX_INTERVAL_SECONDS, DEFAULT_TICK_SECONDS)
+from services.coordination import (Coordinator, exclusive_lock, COORDINATION_DB_PATH, DEFAULT_SHARDS,
+                                  DEFAULT_LEASE_TTL_SECONDS)
+from services.outbox import Outbox, OutboxWorkers, DEFAULT_WORKERS as DEFAULT_OUTBOX_WORKERS
+from services.geo import cell_key
+from models import db
 
 alerts_bp = Blueprint('alerts', __name__)
 
-DB_PATH = "alerts.sqlite"
+DB_PATH = "alerts.sqlite"    # banco separado antigo; migrado para o site.db em init_alerts
 INTERVAL_MINUTES = 15        # periodicidade da checagem global
 COOLDOWN_SECONDS = 60 * 60   # evitar spam: 1 hora entre notificações por alerta
 
-_lock = threading.Lock()
+store = AlertStore(DB_PATH)
+# checagens imediatas e envios em segundo plano, no mesmo banco dos alerts
+outbox = Outbox(DB_PATH)
+_outbox_workers = None
+_warned_no_outbox_consumer = False
 _scheduler = None
+_app = None
+_threshold_index = None
+_adaptive_schedule = None
+_coordinator = None
 
 # --- DB helpers --------------------------------------------------------------
-def init_db():
-    with _lock, sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS alerts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                location TEXT NOT NULL,
-                lat REAL NOT NULL,
-                lon REAL NOT NULL,
-                aqi_limit REAL NOT NULL,
-                device_token TEXT NOT NULL,
-                created_at TEXT NOT NULL,
-                last_notified_at TEXT
-            )
-        ''')
-        conn.commit()
-
-def insert_alert(alert):
-    with _lock, sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute('''
-            INSERT INTO alerts (user_id, location, lat, lon, aqi_limit, device_token, created_at, last_notified_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            alert['user_id'],
-            alert['location'],
-            float(alert['lat']),
-            float(alert['lon']),
-            float(alert['aqi_limit']),
-            alert['device_token'],
-            datetime.utcnow().isoformat(),
-            None
-        ))
-        conn.commit()
-        return cur.lastrowid
-
-def fetch_all_alerts():
-    with _lock, sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute('SELECT id, user_id, location, lat, lon, aqi_limit, device_token, created_at, last_notified_at FROM alerts')
-        rows = cur.fetchall()
-        alerts = []
-        for r in rows:
-            alerts.append({
-                'id': r[0],
-                'user_id': r[1],
-                'location': r[2],
-                'lat': r[3],
-                'lon': r[4],
-                'aqi_limit': r[5],
-                'device_token': r[6],
-                'created_at': r[7],
-                'last_notified_at': r[8]
-            })
-        return alerts
+# (conexão por thread + WAL em services/alerts_store.py)
+def init_db(path=DB_PATH):
+    store.reset(path)
+    store.init_schema()
+    outbox.reset(path)
+    outbox.init_schema()
+
+def insert_alert(alert, in_transaction=None):
+    # o índice em memória recebe o alerta novo pelo log de mudanças (alert_changes)
+    alert_id = store.insert(alert, in_transaction=in_transaction)
+    index = _threshold_index
+    if index is not None and _adaptive_schedule is not None:
+        # a agenda da célula foi calculada sem o limite do alerta novo
+        _adaptive_schedule.expedite(cell_key(alert['lat'], alert['lon'], index.precision, index.mode), time.time())
+    return alert_id
+
+def delete_alert_row(alert_id):
+    return store.delete(alert_id)
+
+def fetch_all_alerts(active_only=False):
+    # active_only: ignora alerts cujo token foi invalidado pelo FCM (usado pelo scheduler)
+    return store.fetch_all(active_only=active_only)
 
 def update_last_notified(alert_id):
-    with _lock, sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute('UPDATE alerts SET last_notified_at = ? WHERE id = ?', (datetime.utcnow().isoformat(), alert_id))
-        conn.commit()
+    store.update_last_notified_many([alert_id])
+
+def update_last_notified_many(alert_ids):
+    store.update_last_notified_many(alert_ids)
+
+def mark_tokens_invalid(tokens):
+    store.mark_tokens_invalid(tokens)
+
+def alerts_affected_by_reading(lat, lon, radius_km):
+    """Alerts e localizações monitoradas na área de uma estação/leitura (via índices espaciais)."""
+    return store.alerts_near(lat, lon, radius_km, active_only=True, include_locations=True)
+
+# --- Coordenação entre workers (services/coordination.py) ---------------------
+def _owned_shards():
+    """Shards deste worker; None quando não há coordenação (processo único)."""
+    coordinator = _coordinator
+    if coordinator is None or coordinator.mode == 'off':
+        return None
+    return coordinator.owned_shards()
+
+def _cell_filter(owned):
+    """Predicado "a célula é deste worker" para os shards `owned` (None = todas)."""
+    coordinator = _coordinator
+    if owned is None or coordinator is None:
+        return None
+    return lambda cell: coordinator.owns(cell, owned)
+
+def coordination_heartbeat():
+    try:
+        _coordinator.heartbeat()
+    except Exception as e:
+        # sem renovar, as leases expiram e outro worker assume os shards
+        _app.logger.error(f"Falha no heartbeat de coordenação: {e}")
+
+def run_history_downsample():
+    # o histórico é compartilhado: só o líder (dono do shard 0) agrega
+    if _coordinator is None or _coordinator.is_leader():
+        history.downsample()
+
+def run_change_log_prune():
+    # o log de mudanças é compartilhado: só o líder poda
+    if _coordinator is None or _coordinator.is_leader():
+        store.prune_changes()
+
+def run_region_snapshot_refresh(app):
+    # o snapshot fica na memória de cada processo: todos atualizam, sem lease
+    waqi_token = app.config.get('WAQI_TOKEN') or os.environ.get('WAQI_TOKEN')
+    if not waqi_token:
+        app.logger.warning("Snapshot regional do WAQI configurado, mas sem WAQI_TOKEN; ignorando.")
+        return
+    stats = refresh_region_snapshot(waqi_token)
+    app.logger.info(f"Snapshot regional do WAQI: {stats['refreshed']}/{stats['regions']} região(ões), "
+                    f"{stats['stations']} estação(ões)")
 
 # --- AQI helpers -------------------------------------------------------------
-def fetch_aqi_for_coords(lat, lon, waqi_token=None):
+def _log_fetch_error(message):
+    # current_app may not be available in some contexts; guard logging
+    try:
+        current_app.logger.debug(message)
+    except Exception:
+        pass
+
+def fetch_aqi_for_coords(lat, lon, waqi_token=None, background=False):
     """
-    Tenta consultar WAQI; se falhar, tenta OpenAQ.
+    Tenta consultar WAQI; se falhar (inclusive com o circuito do WAQI aberto,
+    que falha na hora), tenta OpenAQ.
     Retorna número (int/float) ou None.
+    `background=True` nas chamadas do scheduler (cedem o orçamento às rotas).
     """
-    try:
-        if waqi_token:
-            url = f'https://api.waqi.info/feed/geo:{lat};{lon}/'
-            r = requests.get(url, params={'token': waqi_token}, timeout=10)
-            r.raise_for_status()
-            payload = r.json()
+    return fetch_reading_for_coords(lat, lon, waqi_token=waqi_token, background=background)[0]
+
+def fetch_reading_for_coords(lat, lon, waqi_token=None, background=False):
+    """
+    Como fetch_aqi_for_coords, mas retorna (aqi, instante da observação em
+    epoch); o instante vem do data.time do WAQI e é None no OpenAQ.
+    Alertas nunca são avaliados com leitura vencida do cache (fresh=True).
+    """
+    if waqi_token:
+        try:
+            payload = get_waqi_feed(lat, lon, waqi_token, background=background, fresh=True)
             if payload.get('status') == 'ok':
-                aqi = payload.get('data', {}).get('aqi')
+                data = payload.get('data', {})
+                aqi = data.get('aqi')
                 try:
-                    return int(aqi) if aqi is not None else None
+                    return (int(aqi) if aqi is not None else None), observation_epoch(data)
                 except (ValueError, TypeError):
-                    return None
+                    return None, None
+        except requests.RequestException as e:
+            _log_fetch_error(f"Erro ao buscar AQI no WAQI, tentando OpenAQ: {e}")
 
+    try:
         # Fallback: OpenAQ latest (pega primeiro measurement.value)
-        url2 = f'https://api.openaq.org/v2/latest?coordinates={lat},{lon}'
-        r2 = requests.get(url2, timeout=10)
-        r2.raise_for_status()
-        results = r2.json().get('results', [])
+        results = fetch_openaq_latest(lat, lon, background=background)
         if results and 'measurements' in results[0] and results[0]['measurements']:
             value = results[0]['measurements'][0].get('value')
             try:
-                return float(value)
+                return float(value), None
             except (ValueError, TypeError):
-                return None
+                return None, None
     except requests.RequestException as e:
-        # current_app may not be available in some contexts; guard logging
+        _log_fetch_error(f"Erro ao buscar AQI: {e}")
+        return None, None
+    return None, None
+
+# --- Notification logic ------------------------------------------------------
+def _in_cooldown(alert):
+    last = alert.get('last_notified_at')
+    if not last:
+        return False
+    try:
+        return datetime.utcnow() - datetime.fromisoformat(last) < timedelta(seconds=COOLDOWN_SECONDS)
+    except (TypeError, ValueError):
+        # formato inválido, continua normalmente
+        return False
+
+def apply_aqi_to_alert(alert, aqi, batch=None):
+    """
+    Compara um AQI já obtido com o limite do alerta e envia notificação se
+    ultrapassar, respeitando cooldown para evitar spam.
+    Com `batch` (NotificationBatch), a notificação só é enfileirada; o envio e
+    o update_last_notified acontecem no flush do lote.
+    """
+    try:
+        limit = float(alert['aqi_limit'])
+    except (TypeError, ValueError):
+        return False
+
+    # checar cooldown
+    if _in_cooldown(alert):
+        if aqi > limit:
+            NOTIFICATIONS.inc(outcome='suppressed_cooldown')
         try:
-            current_app.logger.debug(f"Erro ao buscar AQI: {e}")
+            current_app.logger.debug(f"Alert id={alert['id']} em cooldown; pulando.")
         except Exception:
             pass
-        return None
-    return None
+        return False
+
+    if aqi > limit:
+        return notify_alert(alert, aqi, batch=batch)
+    return False
+
+def notify_alert(alert, aqi, batch=None):
+    """Envia (ou enfileira em `batch`) a notificação de um alerta já disparado."""
+    recommendations = get_health_recommendations(aqi)
+    body = f"AQI atual: {aqi}. Recomendações: {'; '.join(recommendations)}"
+    if batch is not None:
+        batch.add(alert['id'], alert['device_token'], "Alerta de qualidade do ar", body)
+        return True
+    try:
+        if not send_push_notification(alert['device_token'], "Alerta de qualidade do ar", body):
+            return False
+        update_last_notified(alert['id'])
+        try:
+            current_app.logger.info(f"Notificação enviada para alert id={alert['id']}")
+        except Exception:
+            pass
+        return True
+    except Exception as e:
+        try:
+            current_app.logger.error(f"Falha ao enviar notificação para alert id={alert['id']}: {e}")
+        except Exception:
+            pass
+        return False
 
-# --- Notification logic ------------------------------------------------------
 def check_alert_and_maybe_notify(alert, waqi_token=None):
     """
     Verifica o AQI para o alerta e envia notificação se ultrapassar o limite,
@@ -132,162 +249,568 @@ def check_alert_and_maybe_notify(alert, waqi_token=None):
         except Exception:
             pass
         return False
+    return apply_aqi_to_alert(alert, aqi)
+
+# --- Outbox: checagem imediata e envio fora da requisição ---------------------
+class _OutboxPushes:
+    """Mesma interface de NotificationBatch.add, mas cada envio vira um job 'push'."""
+
+    def add(self, key, token, title, body):
+        outbox.enqueue('push', {'alert_id': key, 'token': token, 'title': title, 'body': body})
 
+def run_alert_check_job(payload):
+    """Job 'alert_check': a checagem imediata de um alerta recém-criado."""
+    alerts = store.fetch_by_ids([payload['alert_id']])
+    if not alerts:
+        return  # removido antes da checagem
+    waqi_token = _app.config.get('WAQI_TOKEN') if _app is not None else None
+    aqi = fetch_aqi_for_coords(alerts[0]['lat'], alerts[0]['lon'], waqi_token=waqi_token)
+    if aqi is None:
+        raise RuntimeError('AQI indisponível no WAQI e no OpenAQ')
+    apply_aqi_to_alert(alerts[0], aqi, batch=_OutboxPushes())
+
+def run_push_job(payload):
+    """Job 'push': envia a notificação e inicia o cooldown; repetido até o FCM aceitar."""
+    alert_id, token = payload['alert_id'], payload['token']
+    alerts = store.fetch_by_ids([alert_id])
+    # alerta removido, ou já notificado numa tentativa anterior que caiu
+    # antes de concluir o job (entrega ao menos uma vez)
+    if not alerts or _in_cooldown(alerts[0]):
+        return
     try:
-        limit = float(alert['aqi_limit'])
-    except (TypeError, ValueError):
-        return False
+        send_push_or_raise(token, payload['title'], payload['body'])
+    except PERMANENT_TOKEN_ERRORS:
+        mark_tokens_invalid([token])
+        return
+    update_last_notified(alert_id)
+    if _threshold_index is not None:
+        _threshold_index.mark_notified([alert_id])
 
-    # checar cooldown
-    last = alert.get('last_notified_at')
-    if last:
-        try:
-            last_dt = datetime.fromisoformat(last)
-            if datetime.utcnow() - last_dt < timedelta(seconds=COOLDOWN_SECONDS):
-                try:
-                    current_app.logger.debug(f"Alert id={alert['id']} em cooldown; pulando.")
-                except Exception:
-                    pass
-                return False
-        except Exception:
-            # formato inválido, continua normalmente
-            pass
+def start_outbox_workers(app):
+    """
+    Inicia (uma vez por processo) as threads que atendem o outbox. Todos os
+    processos consomem a mesma fila; a reserva de cada job é atômica.
+    Independe do scheduler: create_app chama com START_OUTBOX_WORKERS.
+      OUTBOX_WORKERS  threads por processo (padrão 2)
+    """
+    global _outbox_workers
+    if _outbox_workers is None:
+        _outbox_workers = OutboxWorkers(
+            outbox,
+            {'alert_check': run_alert_check_job, 'push': run_push_job},
+            workers=app.config.get('OUTBOX_WORKERS', DEFAULT_OUTBOX_WORKERS),
+        )
+        _outbox_workers.start()
+        atexit.register(_outbox_workers.stop)
+    return _outbox_workers
 
-    if aqi > limit:
-        recommendations = get_health_recommendations(aqi)
-        body = f"AQI atual: {aqi}. Recomendações: {'; '.join(recommendations)}"
-        try:
-            send_push_notification(alert['device_token'], "Alerta de qualidade do ar", body)
-            update_last_notified(alert['id'])
-            try:
-                current_app.logger.info(f"Notificação enviada para alert id={alert['id']}")
-            except Exception:
-                pass
-            return True
-        except Exception as e:
-            try:
-                current_app.logger.error(f"Falha ao enviar notificação para alert id={alert['id']}: {e}")
-            except Exception:
-                pass
-            return False
-    return False
+def _warn_if_no_outbox_consumer():
+    """Avisa (uma vez por processo) que há jobs sendo enfileirados sem workers locais."""
+    global _warned_no_outbox_consumer
+    if _outbox_workers is None and not _warned_no_outbox_consumer:
+        _warned_no_outbox_consumer = True
+        current_app.logger.warning("Job enfileirado no outbox sem workers neste processo "
+                                   "(START_OUTBOX_WORKERS desligado): só outro processo vai processá-lo")
+
+def build_check_engine(app, batch=None):
+    """
+    Monta o motor de checagem agrupada a partir das configs do app
+    (com `batch`, as notificações do ciclo são enfileiradas nele):
+      ALERTS_ENGINE          'threads' (padrão), 'asyncio', 'reading' (ver run_reading_cycle),
+                             'adaptive' (ver run_adaptive_cycle) ou 'vectorized'
+                             (ver run_vectorized_cycle)
+      ALERTS_CELL_MODE       'round' (lat/lon arredondados) ou 'geohash'
+      ALERTS_CELL_PRECISION  casas decimais (round) ou caracteres (geohash)
+      ALERTS_FETCH_WORKERS   tamanho do pool de buscas concorrentes (threads)
+      ALERTS_ASYNC_CONCURRENCY       teto de buscas/envios simultâneos (asyncio)
+      ALERTS_CYCLE_DEADLINE_SECONDS  prazo máximo de um ciclo (asyncio)
+    """
+    waqi_token = app.config.get('WAQI_TOKEN')  # opcional
+    fetch = lambda lat, lon: fetch_aqi_for_coords(lat, lon, waqi_token=waqi_token, background=True)
+    precision = app.config.get('ALERTS_CELL_PRECISION', DEFAULT_CELL_PRECISION)
+    mode = app.config.get('ALERTS_CELL_MODE', DEFAULT_CELL_MODE)
+    apply = partial(apply_aqi_to_alert, batch=batch)
+
+    if app.config.get('ALERTS_ENGINE', 'threads') == 'asyncio':
+        return AsyncCheckEngine(
+            fetch=fetch,
+            apply=apply,
+            precision=precision,
+            mode=mode,
+            concurrency=app.config.get('ALERTS_ASYNC_CONCURRENCY', DEFAULT_CONCURRENCY),
+            deadline_seconds=app.config.get('ALERTS_CYCLE_DEADLINE_SECONDS', DEFAULT_DEADLINE_SECONDS),
+        )
+    return CheckEngine(
+        fetch=fetch,
+        apply=apply,
+        precision=precision,
+        mode=mode,
+        max_workers=app.config.get('ALERTS_FETCH_WORKERS', DEFAULT_MAX_WORKERS),
+    )
+
+def get_threshold_index(app):
+    """
+    Índice por célula/limite dos modos 'reading' e 'adaptive'. A cada ciclo
+    aplica só os alvos alterados desde o anterior (alert_changes, preenchido
+    por triggers, inclusive por outros processos); a carga completa fica para
+    a primeira vez, troca de shards ou log podado além do ponto aplicado.
+    index.version = (posição no log, shards deste worker).
+    """
+    global _threshold_index
+    precision = app.config.get('ALERTS_CELL_PRECISION', DEFAULT_CELL_PRECISION)
+    mode = app.config.get('ALERTS_CELL_MODE', DEFAULT_CELL_MODE)
+    index = _threshold_index
+    if index is None or (index.precision, index.mode) != (precision, mode):
+        index = _threshold_index = ThresholdIndex(COOLDOWN_SECONDS, precision, mode)
+    owned = _owned_shards()
+    cell_ok = _cell_filter(owned)
+    changes = None
+    if index.version is not None and index.version[1] == owned:
+        changes = store.changes_since(index.version[0])
+    if changes is None:
+        seq = store.last_change_seq()
+        alerts = store.fetch_all(active_only=True)
+        if cell_ok is not None:
+            alerts = [a for a in alerts if cell_ok(cell_key(a['lat'], a['lon'], precision, mode))]
+        index.rebuild(alerts, version=(seq, owned))
+        return index
+    seq, changed_ids = changes
+    if changed_ids:
+        found = {a['id']: a for a in store.fetch_active_by_ids(changed_ids)}
+        for alert_id in changed_ids:
+            alert = found.get(alert_id)
+            if alert is not None and (cell_ok is None or cell_ok(cell_key(alert['lat'], alert['lon'], precision, mode))):
+                index.add(alert)
+            else:
+                # removido, token invalidado ou em célula de outro worker
+                index.remove(alert_id)
+    index.version = (seq, owned)
+    return index
+
+def _build_reading_engine(app, index, batch=None):
+    waqi_token = app.config.get('WAQI_TOKEN')
+
+    def notify(alert, aqi):
+        sent = notify_alert(alert, aqi, batch=batch)
+        if sent and batch is None:
+            index.mark_notified([alert['id']])
+        return sent
+
+    return ReadingEngine(
+        index,
+        fetch=lambda lat, lon: fetch_reading_for_coords(lat, lon, waqi_token=waqi_token, background=True),
+        notify=notify,
+        max_workers=app.config.get('ALERTS_FETCH_WORKERS', DEFAULT_MAX_WORKERS),
+    )
+
+def run_reading_cycle(app, batch=None):
+    """
+    Modo 'reading': busca uma leitura por célula e, com o índice ordenado por
+    limite, notifica só os alertas com aqi_limit abaixo da leitura e fora do
+    cooldown, sem percorrer (nem reinterpretar) cada linha da tabela.
+    Se a estação devolve a mesma observação do ciclo anterior (data.time e
+    AQI iguais), só os alertas alterados desde então são avaliados: novos,
+    editados, com cooldown vencido ou com envio que falhou.
+    """
+    index = get_threshold_index(app)
+    return _build_reading_engine(app, index, batch=batch).run()
 
-def run_periodic_check():
+def get_adaptive_schedule(app):
     """
-    Função executada pelo scheduler: varre todos os alerts e checa cada um.
+    Agenda por célula do modo 'adaptive', configurada por:
+      ALERTS_ADAPTIVE_MIN_SECONDS  intervalo mínimo (leitura perto do limite/subindo)
+      ALERTS_ADAPTIVE_MAX_SECONDS  intervalo máximo (muita folga ou tudo em cooldown)
+    O intervalo base (falhas de busca e comparação de economia) é INTERVAL_MINUTES.
     """
-    # garante contexto da app para usar current_app e configs
+    global _adaptive_schedule
+    min_interval = app.config.get('ALERTS_ADAPTIVE_MIN_SECONDS', DEFAULT_MIN_INTERVAL_SECONDS)
+    max_interval = app.config.get('ALERTS_ADAPTIVE_MAX_SECONDS', DEFAULT_MAX_INTERVAL_SECONDS)
+    schedule = _adaptive_schedule
+    if schedule is None or (schedule.min_interval, schedule.max_interval) != (min_interval, max_interval):
+        schedule = _adaptive_schedule = AdaptiveSchedule(INTERVAL_MINUTES * 60, min_interval, max_interval)
+    return schedule
+
+def run_adaptive_cycle(app, batch=None):
+    """
+    Modo 'adaptive': mesmo índice do modo 'reading', mas cada célula tem o seu
+    próximo horário de checagem e o job (a cada ALERTS_ADAPTIVE_TICK_SECONDS)
+    só busca as células vencidas. Retorna (stats, leituras por célula); as
+    leituras vão para reschedule_adaptive_cells depois do flush do lote, para
+    que os cooldowns recém-iniciados entrem no cálculo do próximo horário.
+    """
+    index = get_threshold_index(app)
+    schedule = get_adaptive_schedule(app)
+    now = time.time()
+    schedule.sync(index.cells(), now)
+    due = schedule.due(now)
+    engine = _build_reading_engine(app, index, batch=batch)
     try:
-        with current_app.app_context():
-            waqi_token = current_app.config.get('WAQI_TOKEN')  # opcional
-            alerts = fetch_all_alerts()
-            current_app.logger.info(f"Iniciando checagem de {len(alerts)} alert(s)")
-            for alert in alerts:
-                try:
-                    check_alert_and_maybe_notify(alert, waqi_token=waqi_token)
-                except Exception as e:
-                    current_app.logger.exception(f"Erro checando alert id={alert.get('id')}: {e}")
-    except RuntimeError:
-        # se não houver app context disponível, tenta usar current_app directly
-        try:
-            waqi_token = current_app.config.get('WAQI_TOKEN')
-            alerts = fetch_all_alerts()
-            for alert in alerts:
-                check_alert_and_maybe_notify(alert, waqi_token=waqi_token)
-        except Exception:
-            pass
+        stats = engine.run(cells=due)
+    except Exception:
+        # sem isso as células vencidas sairiam do heap sem voltar
+        reschedule_adaptive_cells({cell: None for cell in due})
+        raise
+    stats['tracked_cells'] = len(schedule)
+    return stats, engine.last_readings
+
+def reschedule_adaptive_cells(readings):
+    """Agenda a próxima checagem de cada célula buscada; retorna as estatísticas da agenda."""
+    index, schedule = _threshold_index, _adaptive_schedule
+    now = time.time()
+    for cell, aqi in readings.items():
+        lowest_limit, next_cooldown_end = index.outlook(cell, now)
+        schedule.reschedule(cell, aqi, lowest_limit, next_cooldown_end, now)
+    stats = schedule.stats(now)
+    ADAPTIVE_FETCHES.set(stats['fetches'], schedule='adaptive')
+    ADAPTIVE_FETCHES.set(stats['fixed_interval_fetches'], schedule='fixed_interval')
+    return stats
+
+def run_vectorized_cycle(app, batch=None):
+    """
+    Modo 'vectorized': carrega os alerts como colunas NumPy e calcula numa
+    única passada a máscara "acima do limite e fora do cooldown"; só os
+    alerts disparados são lidos por completo para notificar.
+    """
+    import numpy as np
+    from services.vector_eval import AlertColumns, VectorEngine
+
+    precision = app.config.get('ALERTS_CELL_PRECISION', DEFAULT_CELL_PRECISION)
+    mode = app.config.get('ALERTS_CELL_MODE', DEFAULT_CELL_MODE)
+    waqi_token = app.config.get('WAQI_TOKEN')
+
+    cell_ok = _cell_filter(_owned_shards())
+
+    def load_columns():
+        rows = np.array(store.fetch_numeric_rows(active_only=True), dtype=np.float64).reshape(-1, 5)
+        columns = AlertColumns.from_arrays(rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3], rows[:, 4],
+                                           precision=precision, mode=mode)
+        if cell_ok is not None:
+            columns = columns.select_cells([cell_ok(cell) for cell in columns.cells])
+        return columns
+
+    engine = VectorEngine(
+        load_columns=load_columns,
+        load_alerts=store.fetch_by_ids,
+        fetch=lambda lat, lon: fetch_aqi_for_coords(lat, lon, waqi_token=waqi_token, background=True),
+        notify=partial(notify_alert, batch=batch),
+        cooldown_seconds=COOLDOWN_SECONDS,
+        max_workers=app.config.get('ALERTS_FETCH_WORKERS', DEFAULT_MAX_WORKERS),
+    )
+    return engine.run()
+
+def run_periodic_check(app=None):
+    """
+    Função executada pelo scheduler: agrupa os alerts por célula, busca o AQI
+    uma vez por célula e aplica a leitura a todos os alerts da célula.
+    As notificações do ciclo são enviadas em lote (ALERTS_BATCH_NOTIFICATIONS,
+    padrão True); só os envios aceitos pelo FCM atualizam last_notified_at e os
+    tokens rejeitados de forma permanente deixam de ser checados.
+    Com coordenação (ALERTS_COORDINATION), só as células dos shards deste
+    worker são checadas; sem nenhum shard o ciclo é ignorado (retorna None).
+    Retorna as estatísticas do ciclo (tempo, buscas economizadas etc.).
+    """
+    app = app or _app or current_app._get_current_object()
+    started = time.monotonic()
+    owned = _owned_shards()
+    if owned is not None and not owned:
+        app.logger.debug(f"Worker {_coordinator.worker_id} sem shards: ciclo ignorado")
+        return None
+    with app.app_context():
+        batch = NotificationBatch() if app.config.get('ALERTS_BATCH_NOTIFICATIONS', True) else None
+        engine_mode = app.config.get('ALERTS_ENGINE', 'threads')
+        if engine_mode == 'reading':
+            app.logger.info("Iniciando checagem dirigida por leituras")
+            stats = run_reading_cycle(app, batch=batch)
+        elif engine_mode == 'vectorized':
+            app.logger.info("Iniciando checagem vetorizada")
+            stats = run_vectorized_cycle(app, batch=batch)
+        elif engine_mode == 'adaptive':
+            stats, readings = run_adaptive_cycle(app, batch=batch)
+        else:
+            alerts = fetch_all_alerts(active_only=True)
+            cell_ok = _cell_filter(owned)
+            if cell_ok is not None:
+                precision = app.config.get('ALERTS_CELL_PRECISION', DEFAULT_CELL_PRECISION)
+                mode = app.config.get('ALERTS_CELL_MODE', DEFAULT_CELL_MODE)
+                alerts = [a for a in alerts if cell_ok(cell_key(a['lat'], a['lon'], precision, mode))]
+            app.logger.info(f"Iniciando checagem de {len(alerts)} alert(s)")
+            stats = build_check_engine(app, batch=batch).run(alerts)
+        if batch is not None:
+            result = batch.flush()
+            update_last_notified_many(result.sent)
+            if _threshold_index is not None:
+                _threshold_index.mark_notified(result.sent)
+                # envios que falharam voltam a ser avaliados mesmo sem leitura nova
+                _threshold_index.mark_dirty(result.failed)
+            mark_tokens_invalid(result.invalid_tokens)
+            stats['notified'] = len(result.sent)
+            stats['notifications'] = result.stats()
+        if engine_mode == 'adaptive':
+            stats['schedule'] = reschedule_adaptive_cells(readings)
+        if owned is not None:
+            stats['shards'] = sorted(owned)
+        CHECK_CYCLE_DURATION.observe(time.monotonic() - started, engine=engine_mode)
+        CHECK_CYCLE_ALERTS.observe(stats.get('evaluated', stats['alerts']), engine=engine_mode)
+        # no modo 'adaptive' a maioria dos ticks não tem célula vencida
+        log = app.logger.info if stats['cells'] else app.logger.debug
+        log(
+            f"Checagem concluída em {stats['duration_seconds']}s: "
+            f"{stats['alerts']} alert(s), {stats['cells']} célula(s), "
+            f"{stats['fetches_saved']} busca(s) economizada(s), {stats['notified']} notificação(ões)"
+        )
+        for host, host_stats in upstream.stats().items():
+            log(
+                f"Upstream {host}: {host_stats['requests']} req, {host_stats['errors']} erro(s), "
+                f"p95={host_stats['p95_seconds']}s"
+            )
+        return stats
 
 # --- Scheduler init function (call this from app.py after registering blueprint) ----
-def init_alerts(app):
+def _sqlalchemy_db_path(app):
+    """Arquivo SQLite do SQLAlchemy (site.db); None se o banco não for um arquivo SQLite."""
+    with app.app_context():
+        url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return None
+    return url.database
+
+def startup_lock(app):
     """
-    Inicializa o DB local e inicia o scheduler de checagem periódica.
-    Deve ser chamado a partir do app principal APÓS registrar o blueprint.
-    Exemplo em app.py:
-        from routes.alerts import alerts_bp, init_alerts
-        app.register_blueprint(alerts_bp)
-        init_alerts(app)
+    Trava entre processos para a criação/migração dos bancos no boot (workers
+    do gunicorn sobem juntos): arquivo '<banco>.lock' ao lado do site.db (ou
+    STARTUP_LOCK_PATH). Sem banco em arquivo não há o que serializar.
     """
-    global _scheduler
-    # Proteção contra reloader do Flask: só inicializa no processo principal
-    # Werkzeug define WERKZEUG_RUN_MAIN no processo filho; queremos só o processo "real".
-    is_reloader = bool(__import__('os').environ.get('WERKZEUG_RUN_MAIN'))
-    if is_reloader:
-        # se estivermos no processo do reloader secundário, continuar (evita duplicação)
-        pass
+    path = app.config.get('STARTUP_LOCK_PATH')
+    if path is None:
+        db_path = app.config.get('ALERTS_DB_PATH') or _sqlalchemy_db_path(app)
+        if db_path is None:
+            return nullcontext()
+        path = db_path + '.lock'
+    return exclusive_lock(path)
+
+def init_alerts(app, start_scheduler=True):
+    """
+    Inicializa o DB local e (com start_scheduler) inicia o scheduler de
+    checagem periódica. Deve ser chamado APÓS registrar o blueprint e criar
+    as tabelas do SQLAlchemy; o create_app de app.py decide pelo scheduler
+    com a config START_SCHEDULER.
+
+    A tabela alerts fica no mesmo arquivo do SQLAlchemy (site.db), o que
+    habilita a view alert_sources: o scheduler passa a cobrir também as
+    localizações de /enderecos, sem consultas extras. Um alerts.sqlite
+    antigo (DB_PATH) é copiado para lá uma única vez e renomeado para
+    alerts.sqlite.migrated. ALERTS_DB_PATH força um arquivo próprio.
+    Com vários processos, chamar dentro de startup_lock (create_app já faz).
+    """
+    global _app
+    _app = app
+    path = app.config.get('ALERTS_DB_PATH') or _sqlalchemy_db_path(app) or DB_PATH
+    with app.app_context():
+        init_db(path)
+        if os.path.exists(DB_PATH) and os.path.abspath(DB_PATH) != os.path.abspath(path):
+            merged, remapped = store.merge_from(DB_PATH)
+            for old_id, new_id in remapped.items():
+                app.logger.warning(f"Alert id={old_id} de {DB_PATH} já existia em {path}: migrado como id={new_id}")
+            backup = DB_PATH + '.migrated'
+            if os.path.exists(backup):
+                # não sobrescreve o backup de uma migração anterior
+                backup += '.' + datetime.utcnow().strftime('%Y%m%d%H%M%S')
+            os.replace(DB_PATH, backup)
+            app.logger.info(f"{merged} alert(s) migrados de {DB_PATH} para {path} (original em {backup})")
+        app.logger.info(f"Alerts em {path} (" + (
+            "alerts + localizações via alert_sources" if store.unified else "só a tabela alerts") + ")")
+    if start_scheduler:
+        start_alerts_scheduler(app)
+
+def start_alerts_scheduler(app):
+    """
+    Inicia (uma vez por processo) o scheduler da checagem periódica.
 
+    Todo processo (worker do gunicorn, container, reloader do Flask) tem o
+    seu scheduler; quem faz o trabalho é decidido por leases em SQLite:
+      ALERTS_COORDINATION       'leader' (padrão: um único worker checa tudo),
+                                'shards' (células divididas entre os workers)
+                                ou 'off' (sem coordenação)
+      ALERTS_SHARDS             número de shards no modo 'shards'
+      ALERTS_LEASE_TTL_SECONDS  validade da lease; worker que não renova
+                                (morreu/travou) perde os shards após esse prazo
+      ALERTS_COORDINATION_DB    arquivo SQLite compartilhado entre os workers
+    Com ALERTS_ENGINE='adaptive' a checagem roda a cada
+    ALERTS_ADAPTIVE_TICK_SECONDS (só as células vencidas) em vez de a cada
+    INTERVAL_MINUTES.
+    """
+    global _scheduler, _coordinator
     with app.app_context():
-        init_db()
         if _scheduler is None:
+            lease_ttl = app.config.get('ALERTS_LEASE_TTL_SECONDS', DEFAULT_LEASE_TTL_SECONDS)
+            _coordinator = Coordinator(
+                path=app.config.get('ALERTS_COORDINATION_DB', COORDINATION_DB_PATH),
+                mode=app.config.get('ALERTS_COORDINATION', 'leader'),
+                shards=app.config.get('ALERTS_SHARDS', DEFAULT_SHARDS),
+                lease_ttl=lease_ttl,
+            )
+            coordination_heartbeat()
+            # encerramento limpo devolve as leases sem esperar o TTL
+            atexit.register(_coordinator.release)
+
             _scheduler = BackgroundScheduler()
-            _scheduler.add_job(run_periodic_check, 'interval', minutes=INTERVAL_MINUTES, next_run_time=datetime.utcnow())
+            _scheduler.add_job(coordination_heartbeat, 'interval', seconds=max(1, lease_ttl / 3))
+            if app.config.get('ALERTS_ENGINE', 'threads') == 'adaptive':
+                check_every = {'seconds': app.config.get('ALERTS_ADAPTIVE_TICK_SECONDS', DEFAULT_TICK_SECONDS)}
+            else:
+                check_every = {'minutes': INTERVAL_MINUTES}
+            _scheduler.add_job(run_periodic_check, 'interval', args=[app], next_run_time=datetime.utcnow(), **check_every)
+            # agrega o histórico de AQI antigo em médias horárias/diárias
+            _scheduler.add_job(run_history_downsample, 'interval', hours=1)
+            _scheduler.add_job(run_change_log_prune, 'interval', hours=1)
+            if region_snapshot.regions:
+                # map/bounds por região (WAQI_SNAPSHOT_REGIONS): as consultas por
+                # coordenada dentro delas não chamam mais o feed/geo:
+                _scheduler.add_job(run_region_snapshot_refresh, 'interval', args=[app],
+                                   seconds=WAQI_SNAPSHOT_INTERVAL, next_run_time=datetime.utcnow())
             _scheduler.start()
-            app.logger.info("Scheduler de alerts iniciado")
+            app.logger.info(f"Scheduler de alerts iniciado (worker {_coordinator.worker_id}: {_coordinator.describe()})")
 
 # --- Blueprint endpoints -----------------------------------------------------
-@alerts_bp.route('/alerts', methods=['POST'])
-def create_alert():
-    data = request.get_json(silent=True)
-    if not data:
-        return jsonify({'error': 'JSON inválido'}), 400
-
-    required_fields = ['user_id', 'location', 'lat', 'lon', 'aqi_limit', 'device_token']
-    if not all(field in data for field in required_fields):
-        return jsonify({'error': 'Campos obrigatórios ausentes'}), 400
+ALERT_REQUIRED_FIELDS = ['user_id', 'location', 'lat', 'lon', 'aqi_limit', 'device_token']
 
+def parse_alert_payload(data):
+    """Valida um alerta recebido (POST /alerts e /alerts/bulk); ValueError com a mensagem."""
+    if not all(field in data for field in ALERT_REQUIRED_FIELDS):
+        raise ValueError('Campos obrigatórios ausentes')
     # validar tipos básicos
     try:
         lat = float(data['lat'])
         lon = float(data['lon'])
         aqi_limit = float(data['aqi_limit'])
     except (TypeError, ValueError):
-        return jsonify({'error': 'lat, lon e aqi_limit devem ser numéricos'}), 400
-
-    # salvar no banco
-    alert_id = insert_alert({
-        'user_id': int(data['user_id']),
+        raise ValueError('lat, lon e aqi_limit devem ser numéricos')
+    try:
+        user_id = int(data['user_id'])
+    except (TypeError, ValueError):
+        raise ValueError('user_id deve ser inteiro')
+    return {
+        'user_id': user_id,
         'location': str(data['location']),
         'lat': lat,
         'lon': lon,
         'aqi_limit': aqi_limit,
         'device_token': str(data['device_token'])
-    })
+    }
+
+@alerts_bp.route('/alerts', methods=['POST'])
+def create_alert():
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'JSON inválido'}), 400
+    try:
+        alert = parse_alert_payload(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # salvar no banco; a checagem imediata (e o envio, se passar do limite)
+    # vai para o outbox na mesma transação e roda nos workers em segundo plano
+    alert_id = insert_alert(alert, in_transaction=lambda conn, new_id: outbox.enqueue(
+        'alert_check', {'alert_id': new_id}, conn=conn))
+    outbox.wakeup()
+    _warn_if_no_outbox_consumer()
 
     # responder com o registro salvo (inclui id)
-    saved = {
-        'id': alert_id,
-        'user_id': int(data['user_id']),
-        'location': data['location'],
-        'lat': lat,
-        'lon': lon,
-        'aqi_limit': aqi_limit,
-        'device_token': data['device_token']
-    }
+    saved = dict(alert, id=alert_id)
 
-    # Checagem imediata: se passar do limite, envia notificação
+    return jsonify({'message': 'Alerta salvo com sucesso', 'alert': saved}), 201
+
+@alerts_bp.route('/alerts/bulk', methods=['POST'])
+def create_alerts_bulk():
+    # lista JSON, {"records": [...]} ou NDJSON; sem a checagem imediata de
+    # create_alert (o próximo ciclo do scheduler cobre os alertas novos)
     try:
-        waqi_token = current_app.config.get('WAQI_TOKEN')
-        saved_db = dict(saved)
-        saved_db['last_notified_at'] = None
-        check_alert_and_maybe_notify(saved_db, waqi_token=waqi_token)
-    except Exception as e:
+        records, errors = parse_bulk_records(request)
+    except BulkError as e:
+        return jsonify({'error': str(e)}), 400
+
+    result = BulkResult(len(records))
+    valid = []
+    for index, data in enumerate(records):
+        if data is None:
+            result.error(index, errors[index])
+            continue
         try:
-            current_app.logger.exception(f"Erro na checagem imediata do alerta id={alert_id}: {e}")
-        except Exception:
-            pass
+            valid.append((index, parse_alert_payload(data)))
+        except ValueError as e:
+            result.error(index, str(e))
 
-    return jsonify({'message': 'Alerta salvo com sucesso', 'alert': saved}), 201
+    # uma transação por bloco: se um bloco falhar, os anteriores continuam
+    # gravados e só os registros dele voltam como erro (sem 500 no meio)
+    for start in range(0, len(valid), BULK_CHUNK_SIZE):
+        chunk = valid[start:start + BULK_CHUNK_SIZE]
+        try:
+            ids = store.insert_many([alert for _, alert in chunk], chunk_size=len(chunk))
+        except sqlite3.Error as e:
+            current_app.logger.warning(f"Falha ao gravar bloco de {len(chunk)} alert(s) do /alerts/bulk: {e}")
+            for index, _ in chunk:
+                result.error(index, BULK_CHUNK_ERROR)
+            continue
+        for (index, _), alert_id in zip(chunk, ids):
+            result.created(index, alert_id)
+    return jsonify(result.to_dict()), 200
 
 @alerts_bp.route('/alerts', methods=['GET'])
 def list_alerts():
-    alerts = fetch_all_alerts()
-    return jsonify(alerts), 200
+    # paginação opcional por cursor: ?limit=&after_id=&user_id=
+    # ?format=ndjson (ou Accept: application/x-ndjson) faz streaming linha a linha
+    try:
+        limit, after_id = parse_page_args(request.args)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    user_id = request.args.get('user_id')
+    if user_id is not None:
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            return jsonify({'error': 'user_id deve ser inteiro'}), 400
+
+    if wants_ndjson(request):
+        return ndjson_response(store.iter_alerts(user_id=user_id, after_id=after_id, limit=limit))
+    # página serializada reaproveitada até a próxima mudança em alerts
+    return cached_json_response(
+        ('alerts', user_id, after_id, limit), store.data_version(),
+        lambda: list(store.iter_alerts(user_id=user_id, after_id=after_id, limit=limit)),
+        headers=lambda alerts: page_headers(alerts, limit, 'id'))
+
+@alerts_bp.route('/alerts/nearby', methods=['GET'])
+def list_alerts_nearby():
+    # ?lat=&lon=&radius_km= (padrão 5 km); usa o índice R*Tree do alerts.sqlite
+    try:
+        lat, lon, radius_km = parse_nearby_args(request.args)
+        limit, _ = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(store.alerts_near(lat, lon, radius_km, limit=limit)), 200
+
+@alerts_bp.route('/alerts/coordination', methods=['GET'])
+def get_coordination_status():
+    # qual worker atendeu, quais shards ele detém e o estado das leases
+    if _coordinator is None:
+        return jsonify({'mode': None, 'description': 'scheduler não iniciado neste processo'}), 200
+    return jsonify(_coordinator.status()), 200
+
+@alerts_bp.route('/alerts/outbox', methods=['GET'])
+def get_outbox_stats():
+    # profundidade e idade da fila de checagens/envios em segundo plano
+    stats = outbox.stats()
+    stats['workers'] = _outbox_workers.workers if _outbox_workers is not None else 0
+    return jsonify(stats), 200
+
+@alerts_bp.route('/alerts/schedule', methods=['GET'])
+def get_schedule_stats():
+    # agenda adaptativa (ALERTS_ENGINE='adaptive'): buscas feitas x intervalo fixo
+    if _adaptive_schedule is None:
+        return jsonify({'adaptive': False, 'interval_minutes': INTERVAL_MINUTES}), 200
+    return jsonify(dict(_adaptive_schedule.stats(time.time()), adaptive=True)), 200
 
 @alerts_bp.route('/alerts/<int:alert_id>', methods=['DELETE'])
 def delete_alert(alert_id):
-    with _lock, sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute('DELETE FROM alerts WHERE id = ?', (alert_id,))
-        conn.commit()
-        if cur.rowcount == 0:
-            return jsonify({'error': 'Alerta não encontrado'}), 404
+    if not delete_alert_row(alert_id):
+        return jsonify({'error': 'Alerta não encontrado'}), 404
     return jsonify({'message': 'Alerta removido'}), 200
@@ -1,12 +1,30 @@
 # routes/enderecos.py
-from flask import Blueprint, request, jsonify
-from models import db, Localizacao
-from routes.air_quality import geocode_address
+from flask import Blueprint, request, jsonify, current_app
+from models import db, Localizacao, localizacoes_near, data_version
+from routes.air_quality import geocode_address, WAQI_TOKEN
+from services.external_api import get_waqi_feed, reading_version
+from services.http_cache import cached_json_response
+from services.geo import parse_nearby_args
+from services.pagination import parse_page_args, PaginationError, wants_ndjson, ndjson_response, page_headers
 from services.notifications import get_health_recommendations
+from services.geocoding import geocode_many
+from services.bulk import (parse_bulk_records, BulkError, BulkResult, BULK_CHUNK_SIZE, BULK_CHUNK_ERROR,
+                           BULK_MAX_GEOCODE_LOOKUPS)
 import requests
+from sqlalchemy.exc import SQLAlchemyError
 
 enderecos_bp = Blueprint('enderecos', __name__)
 
+def _localizacao_to_dict(l):
+    return {
+        'id_localizacao': l.id_localizacao,
+        'id_usuario': l.id_usuario,
+        'nome_local': l.nome_local,
+        'latitude': l.latitude,
+        'longitude': l.longitude,
+        'aqi_limite': l.aqi_limite
+    }
+
 @enderecos_bp.route('/enderecos', methods=['POST'])
 def salvar_endereco():
     data = request.get_json()
@@ -48,21 +66,131 @@ def salvar_endereco():
         'aqi_limite': novo.aqi_limite
     }), 201
 
+def _parse_endereco_bulk(data):
+    """Mesma validação de salvar_endereco; retorna (campos, endereço a geocodificar ou None)."""
+    nome_local = data.get('nome_local')
+    id_usuario = data.get('id_usuario')
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
+    endereco_texto = data.get('endereco')
+    if not nome_local or not id_usuario:
+        raise ValueError('nome_local e id_usuario são obrigatórios')
+    try:
+        fields = {
+            'id_usuario': int(id_usuario),
+            'nome_local': str(nome_local),
+            'aqi_limite': int(data.get('aqi_limite', 150)),
+        }
+        if latitude is not None and longitude is not None:
+            fields['latitude'], fields['longitude'] = float(latitude), float(longitude)
+            return fields, None
+    except (TypeError, ValueError):
+        raise ValueError('id_usuario, aqi_limite, latitude e longitude devem ser numéricos')
+    if not endereco_texto:
+        raise ValueError('Forneça latitude/longitude ou endereco')
+    return fields, str(endereco_texto)
+
+@enderecos_bp.route('/enderecos/bulk', methods=['POST'])
+def salvar_enderecos_bulk():
+    # lista JSON, {"records": [...]} ou NDJSON; endereços repetidos são
+    # geocodificados uma vez e só os fora do cache vão ao Nominatim (até
+    # BULK_MAX_GEOCODE_LOOKUPS por requisição, os demais voltam como erro)
+    try:
+        records, errors = parse_bulk_records(request)
+    except BulkError as e:
+        return jsonify({'error': str(e)}), 400
+
+    result = BulkResult(len(records))
+    parsed = []
+    for index, data in enumerate(records):
+        if data is None:
+            result.error(index, errors[index])
+            continue
+        try:
+            parsed.append((index, *_parse_endereco_bulk(data)))
+        except ValueError as e:
+            result.error(index, str(e))
+
+    addresses = [endereco for _, _, endereco in parsed if endereco]
+    coords, pending = {}, {}
+    if addresses:
+        max_lookups = current_app.config.get('BULK_MAX_GEOCODE_LOOKUPS', BULK_MAX_GEOCODE_LOOKUPS)
+        coords, pending = geocode_many(addresses, max_lookups=max_lookups)
+
+    valid = []
+    for index, fields, endereco in parsed:
+        if endereco:
+            if endereco in pending:
+                result.error(index, pending[endereco])
+                continue
+            lat, lon = coords.get(endereco, (None, None))
+            if lat is None or lon is None:
+                result.error(index, 'Endereço inválido ou não encontrado')
+                continue
+            fields['latitude'], fields['longitude'] = float(lat), float(lon)
+        valid.append((index, Localizacao(**fields)))
+
+    # um commit por bloco; os ids são lidos após o flush, antes do commit
+    # expirar os objetos (evita um SELECT por registro). Um bloco que falha
+    # volta como erro, sem desfazer os anteriores
+    for start in range(0, len(valid), BULK_CHUNK_SIZE):
+        chunk = valid[start:start + BULK_CHUNK_SIZE]
+        try:
+            db.session.add_all([novo for _, novo in chunk])
+            db.session.flush()
+            ids = [(index, novo.id_localizacao) for index, novo in chunk]
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.warning(f"Falha ao gravar bloco de {len(chunk)} endereço(s) do /enderecos/bulk: {e}")
+            for index, _ in chunk:
+                result.error(index, BULK_CHUNK_ERROR)
+            continue
+        for index, novo_id in ids:
+            result.created(index, novo_id)
+    return jsonify(result.to_dict()), 200
+
 @enderecos_bp.route('/enderecos', methods=['GET'])
 def listar_enderecos():
+    # paginação opcional por cursor: ?limit=&after_id=
+    # ?format=ndjson (ou Accept: application/x-ndjson) faz streaming linha a linha
     user_id = request.args.get('user_id')
     if not user_id:
         return jsonify({'error': 'user_id é obrigatório'}), 400
+    try:
+        limit, after_id = parse_page_args(request.args)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
 
-    locais = Localizacao.query.filter_by(id_usuario=int(user_id)).all()
-    result = [{
-        'id_localizacao': l.id_localizacao,
-        'id_usuario': l.id_usuario,
-        'nome_local': l.nome_local,
-        'latitude': l.latitude,
-        'longitude': l.longitude,
-        'aqi_limite': l.aqi_limite
-    } for l in locais]
+    user_id = int(user_id)
+    query = Localizacao.query.filter_by(id_usuario=user_id)
+    if after_id is not None:
+        query = query.filter(Localizacao.id_localizacao > after_id)
+    query = query.order_by(Localizacao.id_localizacao)
+    if limit is not None:
+        query = query.limit(limit)
+
+    if wants_ndjson(request):
+        return ndjson_response(_localizacao_to_dict(l) for l in query.yield_per(500))
+    # página serializada reaproveitada até a próxima mudança em localizacoes
+    return cached_json_response(
+        ('enderecos', user_id, after_id, limit), data_version('localizacoes'),
+        lambda: [_localizacao_to_dict(l) for l in query],
+        headers=lambda result: page_headers(result, limit, 'id_localizacao'))
+
+@enderecos_bp.route('/enderecos/nearby', methods=['GET'])
+def listar_enderecos_proximos():
+    # ?lat=&lon=&radius_km= (padrão 5 km); usa o índice R*Tree de localizacoes
+    try:
+        lat, lon, radius_km = parse_nearby_args(request.args)
+        limit, _ = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    result = []
+    for loc, distance in localizacoes_near(lat, lon, radius_km, limit=limit):
+        item = _localizacao_to_dict(loc)
+        item['distance_km'] = distance
+        result.append(item)
     return jsonify(result), 200
 
 @enderecos_bp.route('/enderecos/<int:id>/aqi', methods=['GET'])
@@ -70,26 +198,23 @@ def get_local_aqi(id):
     loc = Localizacao.query.get_or_404(id)
     lat, lon = loc.latitude, loc.longitude
 
-    # chama WAQI
-    token = 'b0ede179c7f377076245b3840a175c93ebef527d'  # pode mover p/ env var depois
-    url = f'https://api.waqi.info/feed/geo:{lat};{lon}/?token={token}'
+    # chama WAQI (via cache compartilhado de leituras)
     try:
-        r = requests.get(url)
-        r.raise_for_status()
-        data = r.json()
+        data = get_waqi_feed(lat, lon, WAQI_TOKEN)
         if data.get('status') != 'ok':
             return jsonify({'error': 'Dados WAQI não disponíveis'}), 404
 
         aqi = data['data'].get('aqi')
-        recommendations = get_health_recommendations(aqi if isinstance(aqi, int) else 0)
-        return jsonify({
+        # mesma leitura e mesma localização -> mesmos bytes e ETag
+        version = (reading_version(data), loc.nome_local, loc.latitude, loc.longitude, loc.aqi_limite)
+        return cached_json_response(('enderecos-aqi', loc.id_localizacao), version, lambda: {
             'id_localizacao': loc.id_localizacao,
             'nome_local': loc.nome_local,
             'latitude': loc.latitude,
             'longitude': loc.longitude,
             'aqi': aqi,
             'aqi_limite': loc.aqi_limite,
-            'recomendacoes': recommendations
-        }), 200
+            'recomendacoes': get_health_recommendations(aqi if isinstance(aqi, int) else 0)
+        })
     except requests.RequestException as e:
         return jsonify({'error': 'Erro ao acessar WAQI'}), 500
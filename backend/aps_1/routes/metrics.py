@@ -0,0 +1,37 @@
+# routes/metrics.py
+import time
+from flask import Blueprint, Response, request, g
+from services.metrics import registry, HTTP_REQUEST_DURATION
+
+metrics_bp = Blueprint('metrics', __name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def init_metrics(app):
+    """
+    Mede a latência de todas as requisições do app, por rota do blueprint
+    (request.endpoint, ex.: 'alerts.list_alerts'), método e status.
+    Chamar a partir do app principal, como init_alerts.
+    """
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop('metrics_started', None)
+        # /metrics não entra na própria métrica
+        if started is not None and request.endpoint != 'metrics.get_metrics':
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - started,
+                endpoint=request.endpoint or 'not_found',
+                method=request.method,
+                status=response.status_code,
+            )
+        return response
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
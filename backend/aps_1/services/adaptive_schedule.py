@@ -0,0 +1,157 @@
+# services/adaptive_schedule.py
+# Agendamento adaptativo da checagem por célula: em vez de buscar o AQI de
+# todas as células a cada INTERVAL_MINUTES, cada célula tem o seu próximo
+# horário de checagem, guardado num heap. Células com leitura perto do menor
+# limite ativo (ou subindo) voltam logo; com folga grande, ou com todos os
+# alertas em cooldown, o intervalo cresce até o máximo.
+import heapq
+import math
+import threading
+
+DEFAULT_MIN_INTERVAL_SECONDS = 5 * 60
+DEFAULT_MAX_INTERVAL_SECONDS = 60 * 60     # o WAQI atualiza as estações de hora em hora
+DEFAULT_TICK_SECONDS = 60
+FULL_HEADROOM_RATIO = 0.5                  # folga >= 50% do limite -> intervalo máximo
+
+
+class _CellState:
+    __slots__ = ('due_at', 'interval', 'aqi', 'checked_at')
+
+    def __init__(self, due_at):
+        self.due_at = due_at
+        self.interval = None
+        self.aqi = self.checked_at = None   # última leitura válida (para a tendência)
+
+
+class AdaptiveSchedule:
+    """
+    sync(cells, now)  acompanha o conjunto atual de células (novas vencem já)
+    due(now)          retira do heap as células vencidas
+    reschedule(...)   agenda a próxima checagem a partir da leitura obtida
+    stats(now)        buscas feitas x buscas que o intervalo fixo teria feito
+    """
+
+    def __init__(self, base_interval, min_interval=DEFAULT_MIN_INTERVAL_SECONDS,
+                 max_interval=DEFAULT_MAX_INTERVAL_SECONDS):
+        if not 0 < min_interval <= max_interval:
+            raise ValueError('intervalos inválidos: é preciso 0 < min_interval <= max_interval')
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._cells = {}      # cell -> _CellState
+        self._heap = []       # (due_at, cell); entradas antigas são ignoradas no due()
+        self._lock = threading.Lock()
+        self._since = None
+        self._fetches = 0
+        self._fixed_fetches = 0.0
+
+    def __len__(self):
+        return len(self._cells)
+
+    def sync(self, cells, now):
+        """
+        Adiciona as células novas (vencidas em `now`) e esquece as que não
+        têm mais alertas. Também acumula quantas buscas o intervalo fixo
+        teria feito desde o último sync, base da estatística de economia.
+        """
+        cells = set(cells)
+        with self._lock:
+            if self._since is not None:
+                self._fixed_fetches += len(self._cells) * max(0.0, now - self._since) / self.base_interval
+            self._since = now
+            for cell in list(self._cells):
+                if cell not in cells:
+                    del self._cells[cell]
+            for cell in cells:
+                if cell not in self._cells:
+                    self._cells[cell] = _CellState(now)
+                    heapq.heappush(self._heap, (now, cell))
+                    # o agendamento fixo também busca a célula nova no ciclo seguinte
+                    self._fixed_fetches += 1
+            # o heap acumula entradas obsoletas; recompacta quando passam do dobro
+            if len(self._heap) > 2 * len(self._cells) + 64:
+                self._heap = [(s.due_at, c) for c, s in self._cells.items()]
+                heapq.heapify(self._heap)
+
+    def due(self, now):
+        """Células com checagem vencida (cada uma sai do heap até ser reagendada)."""
+        cells = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due_at, cell = heapq.heappop(self._heap)
+                state = self._cells.get(cell)
+                if state is not None and state.due_at == due_at:
+                    cells.append(cell)
+        return cells
+
+    def expedite(self, cell, now):
+        """Antecipa a checagem de uma célula já acompanhada (ex.: alerta novo com limite menor)."""
+        with self._lock:
+            state = self._cells.get(cell)
+            if state is not None and state.due_at > now:
+                state.due_at = now
+                heapq.heappush(self._heap, (now, cell))
+
+    def next_interval(self, state, aqi, lowest_limit, next_cooldown_end, now):
+        """
+        Segundos até a próxima checagem da célula:
+          - sem leitura (falha no upstream): intervalo base;
+          - todos os alertas em cooldown: até o primeiro cooldown acabar;
+          - caso geral: proporcional à folga (menor limite ativo - AQI),
+            encurtado se a tendência projetar o limite antes disso.
+        Sempre entre min_interval e max_interval.
+        """
+        if aqi is None:
+            interval = self.base_interval
+        elif lowest_limit is None:
+            interval = next_cooldown_end - now if next_cooldown_end is not None else self.max_interval
+        else:
+            headroom = lowest_limit - aqi
+            if headroom <= 0:
+                interval = self.min_interval
+            else:
+                ratio = min(1.0, headroom / max(lowest_limit, 1.0) / FULL_HEADROOM_RATIO)
+                interval = self.min_interval + (self.max_interval - self.min_interval) * ratio
+                if state.aqi is not None and aqi > state.aqi and now > state.checked_at:
+                    rising_per_second = (aqi - state.aqi) / (now - state.checked_at)
+                    # checa na metade do tempo previsto para cruzar o limite
+                    interval = min(interval, headroom / rising_per_second / 2)
+            if next_cooldown_end is not None:
+                interval = min(interval, next_cooldown_end - now)
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def reschedule(self, cell, aqi, lowest_limit, next_cooldown_end, now):
+        """Registra a busca feita para `cell` e agenda a próxima; retorna o intervalo."""
+        with self._lock:
+            state = self._cells.get(cell)
+            if state is None:
+                return None
+            self._fetches += 1
+            interval = self.next_interval(state, aqi, lowest_limit, next_cooldown_end, now)
+            if aqi is not None:
+                state.aqi, state.checked_at = aqi, now
+            state.interval = interval
+            state.due_at = now + interval
+            heapq.heappush(self._heap, (state.due_at, cell))
+        return interval
+
+    def stats(self, now):
+        with self._lock:
+            intervals = sorted(s.interval for s in self._cells.values() if s.interval is not None)
+            next_due = min((s.due_at for s in self._cells.values()), default=None)
+            fixed = self._fixed_fetches
+            if self._since is not None:
+                fixed += len(self._cells) * max(0.0, now - self._since) / self.base_interval
+            return {
+                'cells': len(self._cells),
+                'fetches': self._fetches,
+                'fixed_interval_fetches': math.floor(fixed),
+                'fetches_saved': max(0, math.floor(fixed) - self._fetches),
+                'next_due_in_seconds': round(max(0.0, next_due - now), 1) if next_due is not None else None,
+                'interval_seconds': {
+                    'min': round(intervals[0], 1) if intervals else None,
+                    'median': round(intervals[len(intervals) // 2], 1) if intervals else None,
+                    'max': round(intervals[-1], 1) if intervals else None,
+                },
+                'base_interval_seconds': self.base_interval,
+            }
@@ -0,0 +1,489 @@
+# services/alerts_store.py
+# Camada de armazenamento da tabela alerts: uma conexão reutilizável por thread,
+# journal WAL (leituras não bloqueiam escritas) e índices para as consultas do
+# scheduler e da API.
+# Quando a tabela mora no mesmo banco do SQLAlchemy (site.db), a view
+# alert_sources une os alerts e as localizações salvas (/enderecos) com o
+# device_token do usuário numa única consulta; o scheduler lê só dela.
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from services.geo import bounding_box, haversine_km
+from services.metrics import db_timed, DB_QUERY_DURATION
+from services.http_cache import version_counter_ddl
+
+ALERT_COLUMNS = 'id, user_id, location, lat, lon, aqi_limit, device_token, created_at, last_notified_at'
+
+# Localizações entram na view com id negativo (-id_localizacao): o sinal diz
+# qual tabela atualizar e os ids nunca colidem com os de alerts.
+LOCATION_SOURCES_SELECT = '''
+    SELECT -l.id_localizacao, l.id_usuario, l.nome_local, l.latitude, l.longitude, l.aqi_limite,
+           u.device_token, NULL, l.last_notified_at, u.token_invalid
+    FROM localizacoes l JOIN usuarios u ON u.id_usuario = l.id_usuario
+    WHERE u.device_token IS NOT NULL AND u.device_token != ''
+'''
+ALERT_SOURCES_VIEW = '''
+    CREATE VIEW alert_sources AS
+    SELECT id, user_id, location, lat, lon, aqi_limit, device_token, created_at, last_notified_at,
+           token_invalid
+    FROM alerts
+    UNION ALL
+''' + LOCATION_SOURCES_SELECT
+
+# Log de mudanças dos alvos do scheduler (id do alert ou -id_localizacao),
+# preenchido por triggers: o índice em memória aplica só o que mudou.
+CHANGE_LOG_KEEP = 100_000   # linhas mantidas pela poda (prune_changes)
+_ALERT_CHANGE_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS alert_changes_alerts_insert AFTER INSERT ON alerts BEGIN
+           INSERT INTO alert_changes (alert_id) VALUES (NEW.id);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS alert_changes_alerts_update
+       AFTER UPDATE OF lat, lon, aqi_limit, device_token, token_invalid, last_notified_at ON alerts BEGIN
+           INSERT INTO alert_changes (alert_id) VALUES (NEW.id);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS alert_changes_alerts_delete AFTER DELETE ON alerts BEGIN
+           INSERT INTO alert_changes (alert_id) VALUES (OLD.id);
+       END''',
+]
+_LOCATION_CHANGE_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS alert_changes_localizacoes_insert AFTER INSERT ON localizacoes BEGIN
+           INSERT INTO alert_changes (alert_id) VALUES (-NEW.id_localizacao);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS alert_changes_localizacoes_update
+       AFTER UPDATE OF id_usuario, latitude, longitude, aqi_limite, last_notified_at ON localizacoes BEGIN
+           INSERT INTO alert_changes (alert_id) VALUES (-NEW.id_localizacao);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS alert_changes_localizacoes_delete AFTER DELETE ON localizacoes BEGIN
+           INSERT INTO alert_changes (alert_id) VALUES (-OLD.id_localizacao);
+       END''',
+    # token do usuário vale para todas as localizações dele
+    '''CREATE TRIGGER IF NOT EXISTS alert_changes_usuarios_update
+       AFTER UPDATE OF device_token, token_invalid ON usuarios BEGIN
+           INSERT INTO alert_changes (alert_id)
+           SELECT -id_localizacao FROM localizacoes WHERE id_usuario = NEW.id_usuario;
+       END''',
+]
+
+
+def row_to_alert(r):
+    return {
+        'id': r[0],
+        'user_id': r[1],
+        'location': r[2],
+        'lat': r[3],
+        'lon': r[4],
+        'aqi_limit': r[5],
+        'device_token': r[6],
+        'created_at': r[7],
+        'last_notified_at': r[8]
+    }
+
+
+class AlertStore:
+    def __init__(self, path, busy_timeout=30):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._generation = 0
+        self.unified = False        # alert_sources disponível (ver init_schema)
+        self.source = 'alerts'      # tabela/view lida pelo scheduler
+
+    def reset(self, path=None):
+        """Troca o arquivo (opcional) e força novas conexões em todas as threads."""
+        if path is not None:
+            self.path = path
+        self._generation += 1
+
+    def connection(self):
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is None or local.generation != self._generation:
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            local.conn = conn
+            local.generation = self._generation
+        return conn
+
+    def close(self):
+        """Fecha a conexão da thread atual (se houver)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def init_schema(self):
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS alerts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    location TEXT NOT NULL,
+                    lat REAL NOT NULL,
+                    lon REAL NOT NULL,
+                    aqi_limit REAL NOT NULL,
+                    device_token TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    last_notified_at TEXT
+                )
+            ''')
+            # migração: coluna para tokens que o FCM rejeitou de forma permanente
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(alerts)')]
+            if 'token_invalid' not in columns:
+                conn.execute('ALTER TABLE alerts ADD COLUMN token_invalid INTEGER NOT NULL DEFAULT 0')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_user_id ON alerts (user_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_last_notified_at ON alerts (last_notified_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_device_token ON alerts (device_token)')
+            # contador de mudanças da tabela (ETag/cache de GET /alerts)
+            for ddl in version_counter_ddl('alerts'):
+                conn.execute(ddl)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS alert_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    alert_id INTEGER NOT NULL
+                )
+            ''')
+            for ddl in _ALERT_CHANGE_TRIGGERS:
+                conn.execute(ddl)
+            self._init_spatial_index(conn)
+            self._init_sources_view(conn)
+
+    def _init_sources_view(self, conn):
+        """
+        Cria a view alert_sources se as tabelas do SQLAlchemy estiverem neste
+        banco (com as colunas de models.upgrade_schema); senão, segue só com alerts.
+        """
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        ready = {'localizacoes', 'usuarios'} <= tables and \
+            'last_notified_at' in {r[1] for r in conn.execute('PRAGMA table_info(localizacoes)')} and \
+            'token_invalid' in {r[1] for r in conn.execute('PRAGMA table_info(usuarios)')}
+        # recriada a cada init para acompanhar mudanças na definição
+        conn.execute('DROP VIEW IF EXISTS alert_sources')
+        if ready:
+            conn.execute(ALERT_SOURCES_VIEW)
+            for ddl in _LOCATION_CHANGE_TRIGGERS:
+                conn.execute(ddl)
+        self.unified = ready
+        self.source = 'alert_sources' if ready else 'alerts'
+
+    def merge_from(self, legacy_path):
+        """
+        Migração: copia os alerts de um alerts.sqlite separado para este banco.
+        Linhas com id livre mantêm o id; as que colidem com um alert diferente
+        recebem id novo; as já copiadas (mesmo conteúdo) são ignoradas, então
+        repetir a migração não duplica nada.
+        Retorna (quantas entraram, {id antigo: id novo} das remapeadas).
+        FileNotFoundError se o arquivo não existe (o ATTACH criaria um vazio).
+        """
+        if not os.path.exists(legacy_path):
+            raise FileNotFoundError(legacy_path)
+        conn = self.connection()
+        conn.execute('ATTACH DATABASE ? AS legacy', (legacy_path,))
+        try:
+            legacy_columns = {row[1] for row in conn.execute('PRAGMA legacy.table_info(alerts)')}
+            if not legacy_columns:
+                return 0, {}
+            columns = ALERT_COLUMNS.split(', ') + (['token_invalid'] if 'token_invalid' in legacy_columns else [])
+            selected = ', '.join('l.' + c for c in columns)
+            same_content = ' AND '.join(f'm.{c} IS l.{c}' for c in columns[1:]
+                                    if c not in ('last_notified_at', 'token_invalid'))
+            remapped = {}
+            with conn:
+                copied = conn.execute(
+                    f"INSERT INTO main.alerts ({', '.join(columns)}) SELECT {selected} FROM legacy.alerts l "
+                    'WHERE NOT EXISTS (SELECT 1 FROM main.alerts m WHERE m.id = l.id)').rowcount
+                # o que sobrou sem cópia idêntica colide com outro alert no mesmo id
+                colliding = conn.execute(
+                    f'SELECT {selected} FROM legacy.alerts l '
+                    f'WHERE NOT EXISTS (SELECT 1 FROM main.alerts m WHERE {same_content}) ORDER BY l.id').fetchall()
+                for row in colliding:
+                    cur = conn.execute(
+                        f"INSERT INTO main.alerts ({', '.join(columns[1:])}) VALUES ({','.join('?' * (len(columns) - 1))})",
+                        row[1:])
+                    remapped[row[0]] = cur.lastrowid
+            return copied + len(remapped), remapped
+        finally:
+            conn.execute('DETACH DATABASE legacy')
+
+    def _init_spatial_index(self, conn):
+        # índice espacial R*Tree (pontos: min == max), mantido por triggers
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS alerts_rtree
+            USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS alerts_rtree_insert AFTER INSERT ON alerts BEGIN
+                INSERT INTO alerts_rtree VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS alerts_rtree_update AFTER UPDATE OF lat, lon ON alerts BEGIN
+                UPDATE alerts_rtree SET min_lat = NEW.lat, max_lat = NEW.lat,
+                                        min_lon = NEW.lon, max_lon = NEW.lon
+                WHERE id = NEW.id;
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS alerts_rtree_delete AFTER DELETE ON alerts BEGIN
+                DELETE FROM alerts_rtree WHERE id = OLD.id;
+            END
+        ''')
+        # migração: indexa linhas criadas antes do índice existir
+        total = conn.execute('SELECT COUNT(*) FROM alerts').fetchone()[0]
+        indexed = conn.execute('SELECT COUNT(*) FROM alerts_rtree').fetchone()[0]
+        if indexed != total:
+            conn.execute('DELETE FROM alerts_rtree')
+            conn.execute('INSERT INTO alerts_rtree SELECT id, lat, lat, lon, lon FROM alerts')
+
+    @db_timed('alerts', 'insert')
+    def insert(self, alert, in_transaction=None):
+        """
+        Insere e retorna o id. `in_transaction(conn, id)` roda na mesma
+        transação do INSERT (ex.: gravar um job no outbox junto com o alerta).
+        """
+        conn = self.connection()
+        with conn:
+            cur = conn.execute('''
+                INSERT INTO alerts (user_id, location, lat, lon, aqi_limit, device_token, created_at, last_notified_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                alert['user_id'],
+                alert['location'],
+                float(alert['lat']),
+                float(alert['lon']),
+                float(alert['aqi_limit']),
+                alert['device_token'],
+                datetime.utcnow().isoformat(),
+                None
+            ))
+            if in_transaction is not None:
+                in_transaction(conn, cur.lastrowid)
+            return cur.lastrowid
+
+    @db_timed('alerts', 'insert_many')
+    def insert_many(self, alerts, chunk_size=1000):
+        """
+        Insere em lote com executemany, uma transação por bloco de `chunk_size`.
+        Retorna os ids na mesma ordem: com a escrita travada (BEGIN IMMEDIATE)
+        o AUTOINCREMENT gera ids consecutivos a partir do maior já usado.
+        """
+        conn = self.connection()
+        created_at = datetime.utcnow().isoformat()
+        ids = []
+        for i in range(0, len(alerts), chunk_size):
+            rows = [(
+                a['user_id'], a['location'], float(a['lat']), float(a['lon']),
+                float(a['aqi_limit']), a['device_token'], created_at,
+            ) for a in alerts[i:i + chunk_size]]
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                start = conn.execute(
+                    "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'alerts'), 0), "
+                    "COALESCE((SELECT MAX(id) FROM alerts), 0))"
+                ).fetchone()[0]
+                conn.executemany('''
+                    INSERT INTO alerts (user_id, location, lat, lon, aqi_limit, device_token, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                last = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+                if last != start + len(rows):
+                    raise sqlite3.DatabaseError('ids do lote não são consecutivos')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            ids.extend(range(start + 1, last + 1))
+        return ids
+
+    @db_timed('alerts', 'fetch_all')
+    def fetch_all(self, active_only=False):
+        """Todos os alvos do scheduler (alerts + localizações, se unificado)."""
+        where = ' WHERE token_invalid = 0' if active_only else ''
+        cur = self.connection().execute(f'SELECT {ALERT_COLUMNS} FROM {self.source}{where}')
+        return [row_to_alert(r) for r in cur.fetchall()]
+
+    @db_timed('alerts', 'version')
+    def data_version(self):
+        """Contador incrementado por trigger a cada INSERT/UPDATE/DELETE em alerts."""
+        row = self.connection().execute("SELECT version FROM data_versions WHERE name = 'alerts'").fetchone()
+        return row[0] if row else 0
+
+    def last_change_seq(self):
+        """Posição atual do log de mudanças (ler antes de uma carga completa)."""
+        return self.connection().execute('SELECT COALESCE(MAX(seq), 0) FROM alert_changes').fetchone()[0]
+
+    @db_timed('alerts', 'changes_since')
+    def changes_since(self, seq):
+        """
+        (última posição, ids alterados depois de `seq`, sem repetição).
+        None se a poda já removeu mudanças posteriores a `seq`: quem chamou
+        precisa de uma carga completa.
+        """
+        conn = self.connection()
+        first = conn.execute('SELECT MIN(seq) FROM alert_changes').fetchone()[0]
+        if first is not None and first > seq + 1:
+            return None
+        rows = conn.execute('SELECT seq, alert_id FROM alert_changes WHERE seq > ? ORDER BY seq', (seq,)).fetchall()
+        if not rows:
+            return seq, []
+        return rows[-1][0], list(dict.fromkeys(alert_id for _, alert_id in rows))
+
+    def prune_changes(self, keep=CHANGE_LOG_KEEP):
+        """Mantém só as `keep` mudanças mais recentes; retorna quantas saíram."""
+        conn = self.connection()
+        with conn:
+            return conn.execute(
+                'DELETE FROM alert_changes WHERE seq <= (SELECT MAX(seq) FROM alert_changes) - ?', (keep,)
+            ).rowcount
+
+    @db_timed('alerts', 'fetch_active_by_ids')
+    def fetch_active_by_ids(self, alert_ids, chunk_size=900):
+        """Como fetch_by_ids, mas só alvos ativos (token válido)."""
+        return self._fetch_targets(alert_ids, chunk_size, active_only=True)
+
+    def _fetch_targets(self, alert_ids, chunk_size, active_only):
+        """
+        Alvos com os ids informados, consultando alerts e localizacoes pelas
+        chaves primárias: o id negativo da view é uma expressão e um IN sobre
+        alert_sources percorreria as localizações inteiras a cada bloco.
+        """
+        conn = self.connection()
+        alert_ids = list(alert_ids)
+        plain = [i for i in alert_ids if i > 0]
+        locations = [-i for i in alert_ids if i < 0] if self.unified else []
+        alerts = []
+        alert_active = 'token_invalid = 0 AND ' if active_only else ''
+        location_active = 'AND u.token_invalid = 0 ' if active_only else ''
+        for ids, sql in ((plain, f'SELECT {ALERT_COLUMNS} FROM alerts WHERE {alert_active}id IN'),
+                         (locations, f'{LOCATION_SOURCES_SELECT} {location_active}AND l.id_localizacao IN')):
+            for i in range(0, len(ids), chunk_size):
+                chunk = ids[i:i + chunk_size]
+                cur = conn.execute(f"{sql} ({','.join('?' * len(chunk))})", chunk)
+                alerts.extend(row_to_alert(r) for r in cur)
+        return alerts
+
+    def iter_alerts(self, user_id=None, after_id=None, limit=None):
+        """
+        Percorre os alerts em ordem de id direto do cursor (keyset: id > after_id),
+        sem carregar a tabela inteira em memória.
+        """
+        clauses, params = [], []
+        if user_id is not None:
+            clauses.append('user_id = ?')
+            params.append(user_id)
+        if after_id is not None:
+            clauses.append('id > ?')
+            params.append(after_id)
+        sql = f'SELECT {ALERT_COLUMNS} FROM alerts'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        # mede a execução da consulta; a leitura das linhas acompanha o streaming
+        with DB_QUERY_DURATION.time(store='alerts', operation='iter_alerts'):
+            cur = self.connection().execute(sql, params)
+        for r in cur:
+            yield row_to_alert(r)
+
+    @db_timed('alerts', 'alerts_near')
+    def alerts_near(self, lat, lon, radius_km, active_only=False, limit=None, include_locations=False):
+        """
+        Alerts a até `radius_km` do ponto, do mais próximo ao mais distante.
+        O R*Tree filtra pelo retângulo envolvente e a distância exata é
+        conferida com haversine; cada alerta ganha a chave 'distance_km'.
+        include_locations: inclui as localizações da view alert_sources
+        (filtradas pelo R*Tree de localizacoes).
+        """
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+        box = (min_lat, max_lat, min_lon, max_lon)
+        if include_locations and self.unified:
+            rtree_filter = 'max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?'
+            sql = f'''
+                SELECT {ALERT_COLUMNS} FROM alert_sources
+                WHERE (id IN (SELECT id FROM alerts_rtree WHERE {rtree_filter})
+                       OR id IN (SELECT -id FROM localizacoes_rtree WHERE {rtree_filter}))
+            '''
+            params = box + box
+            if active_only:
+                sql += ' AND token_invalid = 0'
+        else:
+            sql = f'''
+                SELECT {', '.join('a.' + c.strip() for c in ALERT_COLUMNS.split(','))}
+                FROM alerts_rtree r JOIN alerts a ON a.id = r.id
+                WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+            '''
+            params = box
+            if active_only:
+                sql += ' AND a.token_invalid = 0'
+        found = []
+        for r in self.connection().execute(sql, params):
+            distance = haversine_km(lat, lon, r[3], r[4])
+            if distance <= radius_km:
+                alert = row_to_alert(r)
+                alert['distance_km'] = round(distance, 3)
+                found.append(alert)
+        found.sort(key=lambda a: a['distance_km'])
+        return found[:limit] if limit is not None else found
+
+    @db_timed('alerts', 'fetch_numeric_rows')
+    def fetch_numeric_rows(self, active_only=False):
+        """
+        Linhas (id, lat, lon, aqi_limit, last_notified_epoch) para a avaliação
+        vetorizada; a conversão ISO -> epoch é feita pelo próprio SQLite.
+        """
+        where = ' WHERE token_invalid = 0' if active_only else ''
+        return self.connection().execute(
+            "SELECT id, lat, lon, aqi_limit, CAST(strftime('%s', last_notified_at) AS REAL) "
+            f'FROM {self.source}{where}'
+        ).fetchall()
+
+    @db_timed('alerts', 'fetch_by_ids')
+    def fetch_by_ids(self, alert_ids, chunk_size=900):
+        """
+        Alvos com os ids informados (ids negativos: localizações), em blocos
+        para respeitar o limite de parâmetros.
+        """
+        return self._fetch_targets(alert_ids, chunk_size, active_only=False)
+
+    @db_timed('alerts', 'update_last_notified_many')
+    def update_last_notified_many(self, alert_ids, when=None):
+        """
+        Atualiza last_notified_at de vários alvos numa única transação
+        (ids negativos são localizações da view alert_sources).
+        """
+        if not alert_ids:
+            return
+        now = (when or datetime.utcnow()).isoformat()
+        conn = self.connection()
+        with conn:
+            conn.executemany('UPDATE alerts SET last_notified_at = ? WHERE id = ?',
+                             [(now, i) for i in alert_ids if i > 0])
+            if self.unified:
+                conn.executemany('UPDATE localizacoes SET last_notified_at = ? WHERE id_localizacao = ?',
+                                 [(now, -i) for i in alert_ids if i < 0])
+
+    @db_timed('alerts', 'mark_tokens_invalid')
+    def mark_tokens_invalid(self, tokens):
+        if not tokens:
+            return
+        conn = self.connection()
+        with conn:
+            conn.executemany('UPDATE alerts SET token_invalid = 1 WHERE device_token = ?', [(t,) for t in tokens])
+            if self.unified:
+                conn.executemany('UPDATE usuarios SET token_invalid = 1 WHERE device_token = ?',
+                                 [(t,) for t in tokens])
+
+    @db_timed('alerts', 'delete')
+    def delete(self, alert_id):
+        """Remove o alerta; retorna True se existia."""
+        conn = self.connection()
+        with conn:
+            cur = conn.execute('DELETE FROM alerts WHERE id = ?', (alert_id,))
+            return cur.rowcount > 0
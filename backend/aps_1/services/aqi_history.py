@@ -0,0 +1,311 @@
+# services/aqi_history.py
+# Histórico local das leituras do WAQI: tabela bruta append-only (uma linha por
+# observação, poluentes empacotados em float32) e agregados horários/diários
+# gerados por downsample, para servir séries sem consultar o WAQI.
+import math
+import os
+import sqlite3
+import struct
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+AQI_HISTORY_DB_PATH = os.environ.get('AQI_HISTORY_DB_PATH', 'aqi_history.sqlite')
+RAW_RETENTION_SECONDS = int(os.environ.get('AQI_HISTORY_RAW_RETENTION', 7 * 24 * 3600))       # 7 dias
+HOURLY_RETENTION_SECONDS = int(os.environ.get('AQI_HISTORY_HOURLY_RETENTION', 90 * 24 * 3600))  # 90 dias
+
+# ordem fixa das colunas do blob de poluentes (iaqi do WAQI); ausente = NaN
+POLLUTANTS = ('pm25', 'pm10', 'o3', 'no2', 'so2', 'co', 't', 'h', 'p', 'w')
+_PACK = struct.Struct(f'<{len(POLLUTANTS)}f')
+
+RESOLUTIONS = {'raw': 0, 'hour': 3600, 'day': 86400}
+_TABLES = {'hour': 'readings_hourly', 'day': 'readings_daily'}
+
+
+def pack_pollutants(iaqi):
+    values = []
+    for name in POLLUTANTS:
+        value = iaqi.get(name) if isinstance(iaqi, dict) else None
+        if isinstance(value, dict):
+            value = value.get('v')
+        try:
+            values.append(float(value))
+        except (TypeError, ValueError):
+            values.append(math.nan)
+    return _PACK.pack(*values)
+
+
+def unpack_pollutants(blob):
+    if not blob:
+        return {}
+    return {name: round(v, 2) for name, v in zip(POLLUTANTS, _PACK.unpack(blob)) if not math.isnan(v)}
+
+
+def observation_epoch(data):
+    """Instante da observação informado pelo WAQI (data.time.v ou data.time.iso); None se ausente."""
+    info = data.get('time') if isinstance(data, dict) else None
+    if not isinstance(info, dict):
+        return None
+    iso = info.get('iso')
+    if iso:
+        try:
+            return int(datetime.fromisoformat(iso).timestamp())
+        except (TypeError, ValueError):
+            pass
+    try:
+        # 'v' vem no horário local da estação; sem 'iso' é a melhor aproximação
+        return int(info['v'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class _Aggregate:
+    __slots__ = ('count', 'total', 'min', 'max', 'pol_sums', 'pol_counts')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.pol_sums = [0.0] * len(POLLUTANTS)
+        self.pol_counts = [0] * len(POLLUTANTS)
+
+    def add(self, count, avg, vmin, vmax, pollutants_blob):
+        if avg is None:
+            return
+        self.count += count
+        self.total += avg * count
+        self.min = min(self.min, vmin)
+        self.max = max(self.max, vmax)
+        if pollutants_blob:
+            for i, v in enumerate(_PACK.unpack(pollutants_blob)):
+                if not math.isnan(v):
+                    self.pol_sums[i] += v * count
+                    self.pol_counts[i] += count
+
+    def row(self):
+        avg = self.total / self.count if self.count else None
+        pols = [s / c if c else math.nan for s, c in zip(self.pol_sums, self.pol_counts)]
+        return self.count, avg, self.min, self.max, _PACK.pack(*pols)
+
+
+class HistoryStore:
+    def __init__(self, path=AQI_HISTORY_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._cell_ids = {}
+        self._cell_lock = threading.Lock()
+        self._ready = False
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            if not self._ready:
+                self._init_schema(conn)
+                self._ready = True
+        return conn
+
+    def _init_schema(self, conn):
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cells (
+                    cell_id INTEGER PRIMARY KEY,
+                    cell_key TEXT NOT NULL UNIQUE,
+                    station TEXT
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS readings_raw (
+                    cell_id INTEGER NOT NULL,
+                    ts INTEGER NOT NULL,
+                    aqi REAL,
+                    pollutants BLOB,
+                    PRIMARY KEY (cell_id, ts)
+                ) WITHOUT ROWID
+            ''')
+            for table in _TABLES.values():
+                conn.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        cell_id INTEGER NOT NULL,
+                        bucket_ts INTEGER NOT NULL,
+                        count INTEGER NOT NULL,
+                        aqi_avg REAL,
+                        aqi_min REAL,
+                        aqi_max REAL,
+                        pollutants BLOB,
+                        PRIMARY KEY (cell_id, bucket_ts)
+                    ) WITHOUT ROWID
+                ''')
+
+    def _cell_id(self, key, station=None, create=True):
+        cell_id = self._cell_ids.get(key)
+        if cell_id is not None:
+            return cell_id
+        conn = self.connection()
+        with self._cell_lock:
+            row = conn.execute('SELECT cell_id FROM cells WHERE cell_key = ?', (key,)).fetchone()
+            if row is None:
+                if not create:
+                    return None
+                with conn:
+                    cur = conn.execute('INSERT INTO cells (cell_key, station) VALUES (?, ?)', (key, station))
+                cell_id = cur.lastrowid
+            else:
+                cell_id = row[0]
+            self._cell_ids[key] = cell_id
+            return cell_id
+
+    def record(self, key, data):
+        """
+        Grava uma leitura (campo `data` do payload WAQI com status ok).
+        Observações repetidas (mesmo instante) são ignoradas.
+        """
+        try:
+            aqi = float(data.get('aqi'))
+        except (TypeError, ValueError):
+            aqi = None
+        ts = observation_epoch(data) or int(time.time())
+        station = data['city'].get('name') if isinstance(data.get('city'), dict) else None
+        conn = self.connection()
+        cell_id = self._cell_id(key, station)
+        with conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO readings_raw (cell_id, ts, aqi, pollutants) VALUES (?, ?, ?, ?)',
+                (cell_id, ts, aqi, pack_pollutants(data.get('iaqi')))
+            )
+
+    def _rollup(self, conn, source_sql, params, target, bucket_seconds):
+        """Agrega linhas (cell_id, ts, count, avg, min, max, blob) em `target`, somando ao que já existir."""
+        groups = {}
+        for cell_id, ts, count, avg, vmin, vmax, blob in conn.execute(source_sql, params):
+            key = (cell_id, ts - ts % bucket_seconds)
+            groups.setdefault(key, _Aggregate()).add(count, avg, vmin, vmax, blob)
+        for (cell_id, bucket_ts), agg in groups.items():
+            existing = conn.execute(
+                f'SELECT count, aqi_avg, aqi_min, aqi_max, pollutants FROM {target} '
+                'WHERE cell_id = ? AND bucket_ts = ?', (cell_id, bucket_ts)
+            ).fetchone()
+            if existing is not None:
+                agg.add(*existing)
+            if agg.count == 0:
+                continue
+            conn.execute(
+                f'INSERT OR REPLACE INTO {target} (cell_id, bucket_ts, count, aqi_avg, aqi_min, aqi_max, pollutants) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)', (cell_id, bucket_ts, *agg.row())
+            )
+        return len(groups)
+
+    def downsample(self, now=None):
+        """
+        Move leituras brutas mais antigas que RAW_RETENTION_SECONDS para o agregado
+        horário e horas mais antigas que HOURLY_RETENTION_SECONDS para o diário.
+        """
+        now = int(now or time.time())
+        raw_cutoff = now - RAW_RETENTION_SECONDS
+        hourly_cutoff = now - HOURLY_RETENTION_SECONDS
+        conn = self.connection()
+        with conn:
+            hours = self._rollup(
+                conn, 'SELECT cell_id, ts, 1, aqi, aqi, aqi, pollutants FROM readings_raw WHERE ts < ?',
+                (raw_cutoff,), 'readings_hourly', 3600)
+            conn.execute('DELETE FROM readings_raw WHERE ts < ?', (raw_cutoff,))
+            days = self._rollup(
+                conn, 'SELECT cell_id, bucket_ts, count, aqi_avg, aqi_min, aqi_max, pollutants '
+                      'FROM readings_hourly WHERE bucket_ts < ?',
+                (hourly_cutoff,), 'readings_daily', 86400)
+            conn.execute('DELETE FROM readings_hourly WHERE bucket_ts < ?', (hourly_cutoff,))
+        return {'hourly_buckets': hours, 'daily_buckets': days}
+
+    def query(self, key, from_ts, to_ts, resolution='auto'):
+        """
+        Série da célula entre from_ts e to_ts (epoch, inclusive).
+        resolution: 'raw', 'hour', 'day' ou 'auto' (escolhe pelo tamanho do intervalo).
+        Dados recentes ainda não agregados são agregados na hora.
+        """
+        if resolution == 'auto':
+            span = to_ts - from_ts
+            resolution = 'raw' if span <= 2 * 86400 else 'hour' if span <= 60 * 86400 else 'day'
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution deve ser uma de: auto, {', '.join(RESOLUTIONS)}")
+        cell_id = self._cell_id(key, create=False)
+        if cell_id is None:
+            return resolution, []
+        conn = self.connection()
+        raw = conn.execute(
+            'SELECT ts, aqi, pollutants FROM readings_raw WHERE cell_id = ? AND ts BETWEEN ? AND ? ORDER BY ts',
+            (cell_id, from_ts, to_ts)
+        )
+        if resolution == 'raw':
+            return resolution, [
+                {'ts': ts, 'aqi': aqi, 'pollutants': unpack_pollutants(blob)} for ts, aqi, blob in raw
+            ]
+
+        bucket_seconds = RESOLUTIONS[resolution]
+        start = from_ts - from_ts % bucket_seconds
+        groups = {}
+        for ts, aqi, blob in raw:
+            groups.setdefault(ts - ts % bucket_seconds, _Aggregate()).add(1, aqi, aqi, aqi, blob)
+        tables = ['readings_hourly'] if resolution == 'hour' else ['readings_hourly', 'readings_daily']
+        for table in tables:
+            for bucket_ts, count, avg, vmin, vmax, blob in conn.execute(
+                f'SELECT bucket_ts, count, aqi_avg, aqi_min, aqi_max, pollutants FROM {table} '
+                'WHERE cell_id = ? AND bucket_ts BETWEEN ? AND ?', (cell_id, start, to_ts)
+            ):
+                groups.setdefault(bucket_ts - bucket_ts % bucket_seconds, _Aggregate()).add(
+                    count, avg, vmin, vmax, blob)
+
+        points = []
+        for bucket_ts in sorted(groups):
+            count, avg, vmin, vmax, blob = groups[bucket_ts].row()
+            if not count:
+                continue
+            points.append({
+                'ts': bucket_ts,
+                'aqi': round(avg, 1),
+                'aqi_min': vmin,
+                'aqi_max': vmax,
+                'count': count,
+                'pollutants': unpack_pollutants(blob),
+            })
+        return resolution, points
+
+
+history = HistoryStore()
+
+
+def record_waqi_payload(key, payload):
+    """Grava o payload do WAQI no histórico; falhas nunca afetam quem buscou a leitura."""
+    if not isinstance(payload, dict) or payload.get('status') != 'ok':
+        return
+    try:
+        history.record(key, payload.get('data') or {})
+    except Exception as e:
+        logger.warning(f"Falha ao gravar histórico de AQI ({key}): {e}")
+
+
+def history_key(cell):
+    """Chave textual da célula (tupla lat/lon arredondados ou geohash)."""
+    if isinstance(cell, str):
+        return cell
+    return f'{cell[0]},{cell[1]}'
+
+
+def parse_time_arg(value, default):
+    """Aceita epoch em segundos ou data ISO 8601 (UTC se sem fuso)."""
+    if value is None or value == '':
+        return default
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
@@ -0,0 +1,152 @@
+# services/async_engine.py
+# Modo alternativo ('asyncio') da checagem periódica: um event loop orquestra as
+# buscas WAQI/OpenAQ e os envios FCM, com teto de concorrência e prazo por
+# ciclo. Não há I/O assíncrono: fetch/apply são as mesmas funções síncronas
+# dos outros motores (cliente HTTP compartilhado, com retry, circuit breaker
+# e orçamento) e rodam num pool de threads; o que o loop acrescenta é o
+# semáforo único para buscas e envios e o cancelamento no prazo.
+import asyncio
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from services.check_engine import group_by_cell
+from services.geo import cell_center, DEFAULT_CELL_PRECISION, DEFAULT_CELL_MODE
+
+DEFAULT_CONCURRENCY = 64
+DEFAULT_DEADLINE_SECONDS = 14 * 60  # folga dentro da janela de 15 min do scheduler
+
+logger = logging.getLogger(__name__)
+
+_DISCARDED = object()
+
+
+class _ApplyGate:
+    """
+    Controla as aplicações que rodam no pool: depois de close() nenhuma
+    começa (o resultado é descartado) e wait() espera as que já começaram.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._running = 0
+        self._closed = False
+
+    def run(self, fn, *args):
+        with self._cond:
+            if self._closed:
+                return _DISCARDED
+            self._running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._cond.notify_all()
+
+    def close_and_wait(self):
+        with self._cond:
+            self._closed = True
+            self._cond.wait_for(lambda: self._running == 0)
+
+
+class AsyncCheckEngine:
+    """
+    Mesma interface do CheckEngine (fetch/apply síncronos, executados num pool
+    de `concurrency` threads), mas orquestrada por um event loop: cada busca de
+    célula e cada aplicação/envio de alerta é uma tarefa, limitada por um
+    semáforo de `concurrency` operações simultâneas.
+    Ao atingir `deadline_seconds`, as tarefas pendentes são canceladas e o ciclo
+    termina; os alertas não avaliados entram de novo no ciclo seguinte. run()
+    só retorna depois que as aplicações já iniciadas terminam (o chamador faz
+    o flush do lote de notificações em seguida); as que ainda não tinham
+    começado são descartadas. Buscas em andamento terminam em segundo plano
+    e o resultado delas é ignorado.
+    """
+
+    def __init__(self, fetch, apply, precision=DEFAULT_CELL_PRECISION, mode=DEFAULT_CELL_MODE,
+                 concurrency=DEFAULT_CONCURRENCY, deadline_seconds=DEFAULT_DEADLINE_SECONDS):
+        self.fetch = fetch
+        self.apply = apply
+        self.precision = precision
+        self.mode = mode
+        self.concurrency = max(1, int(concurrency))
+        self.deadline_seconds = deadline_seconds
+        self.last_stats = None
+
+    async def _check_cell(self, key, alerts, sem, loop, pool, gate, counters):
+        lat, lon = cell_center(key)
+        async with sem:
+            try:
+                aqi = await loop.run_in_executor(pool, self.fetch, lat, lon)
+            except Exception as e:
+                logger.debug(f"Erro ao buscar AQI da célula {key}: {e}")
+                aqi = None
+        counters['fetches'] += 1
+        counters['covered'] += len(alerts)
+        if aqi is None:
+            counters['failed_fetches'] += 1
+            return
+
+        async def apply_one(alert):
+            async with sem:
+                try:
+                    result = await loop.run_in_executor(pool, gate.run, self.apply, alert, aqi)
+                except Exception as e:
+                    logger.exception(f"Erro checando alert id={alert.get('id')}: {e}")
+                    result = False
+            if result is _DISCARDED:
+                return
+            if result:
+                counters['notified'] += 1
+            counters['evaluated'] += 1
+
+        await asyncio.gather(*(apply_one(alert) for alert in alerts))
+
+    async def _run(self, cells):
+        loop = asyncio.get_running_loop()
+        sem = asyncio.Semaphore(self.concurrency)
+        counters = {'fetches': 0, 'covered': 0, 'failed_fetches': 0, 'notified': 0, 'evaluated': 0}
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='aqi-async')
+        gate = _ApplyGate()
+        try:
+            tasks = [asyncio.ensure_future(self._check_cell(key, group, sem, loop, pool, gate, counters))
+                     for key, group in cells.items()]
+            pending = set()
+            if tasks:
+                _, pending = await asyncio.wait(tasks, timeout=self.deadline_seconds)
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    await asyncio.gather(*pending, return_exceptions=True)
+            counters['timed_out_cells'] = len(pending)
+            return counters
+        finally:
+            # aplicações em andamento terminam antes do flush do lote; buscas
+            # em andamento terminam sozinhas e as que estão na fila são descartadas
+            gate.close_and_wait()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, alerts):
+        """Executa um ciclo completo (bloqueante) e devolve as estatísticas."""
+        started = time.monotonic()
+        alerts = list(alerts)
+        cells = group_by_cell(alerts, self.precision, self.mode)
+
+        counters = asyncio.run(self._run(cells))
+
+        stats = {
+            'alerts': len(alerts),
+            'cells': len(cells),
+            'fetches': counters['fetches'],
+            'fetches_saved': counters['covered'] - counters['fetches'],
+            'failed_fetches': counters['failed_fetches'],
+            'notified': counters['notified'],
+            'evaluated': counters['evaluated'],
+            'timed_out_cells': counters['timed_out_cells'],
+            'deadline_exceeded': counters['timed_out_cells'] > 0,
+            'duration_seconds': round(time.monotonic() - started, 3),
+        }
+        self.last_stats = stats
+        return stats
@@ -0,0 +1,82 @@
+# services/bulk.py
+# Entrada dos endpoints de importação em lote (/alerts/bulk, /enderecos/bulk):
+# corpo JSON (lista ou {"records": [...]}) ou NDJSON (um objeto por linha),
+# e o resumo por registro devolvido ao cliente.
+import json
+import os
+
+from services.pagination import NDJSON_MIMETYPE
+
+BULK_MAX_RECORDS = int(os.environ.get('BULK_MAX_RECORDS', 50_000))
+BULK_CHUNK_SIZE = 1000              # registros por transação
+# bloco que não foi gravado (ex.: banco travado): os anteriores já estão salvos,
+# então só estes registros devem ser reenviados
+BULK_CHUNK_ERROR = 'erro ao gravar no banco; reenvie este registro'
+BULK_MAX_GEOCODE_LOOKUPS = 60       # consultas novas ao Nominatim por requisição (~1 min a 1 req/s)
+
+
+class BulkError(ValueError):
+    pass
+
+
+def parse_bulk_records(request, max_records=BULK_MAX_RECORDS):
+    """
+    Retorna (registros, erros): registros na ordem de envio (None nas linhas
+    NDJSON inválidas) e erros = {índice: mensagem} dessas linhas.
+    Levanta BulkError se o corpo inteiro for inválido ou grande demais.
+    """
+    records, errors = [], {}
+    if request.mimetype == NDJSON_MIMETYPE or request.args.get('format') == 'ndjson':
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            if len(records) >= max_records:
+                raise BulkError(f'no máximo {max_records} registros por requisição')
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError('cada linha deve ser um objeto JSON')
+                records.append(record)
+            except ValueError as e:
+                errors[len(records)] = f'linha inválida: {e}'
+                records.append(None)
+    else:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('records')
+        if not isinstance(data, list):
+            raise BulkError('envie uma lista JSON, {"records": [...]} ou NDJSON')
+        if len(data) > max_records:
+            raise BulkError(f'no máximo {max_records} registros por requisição')
+        for i, record in enumerate(data):
+            if not isinstance(record, dict):
+                errors[i] = 'cada registro deve ser um objeto JSON'
+                record = None
+            records.append(record)
+    if not records:
+        raise BulkError('nenhum registro enviado')
+    return records, errors
+
+
+class BulkResult:
+    """Resumo por registro: {'index', 'status': 'created'|'error', 'id' | 'error'}."""
+
+    def __init__(self, total):
+        self.total = total
+        self._items = {}
+
+    def created(self, index, record_id):
+        self._items[index] = {'index': index, 'status': 'created', 'id': record_id}
+
+    def error(self, index, message):
+        self._items[index] = {'index': index, 'status': 'error', 'error': message}
+
+    def to_dict(self):
+        results = [self._items[i] for i in sorted(self._items)]
+        created = sum(1 for item in results if item['status'] == 'created')
+        return {
+            'total': self.total,
+            'created': created,
+            'failed': len(results) - created,
+            'results': results,
+        }
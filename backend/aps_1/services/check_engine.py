@@ -0,0 +1,90 @@
+# services/check_engine.py
+# Motor da checagem periódica: agrupa alertas por célula geográfica, busca o AQI
+# de cada célula uma única vez (em paralelo) e aplica o resultado a todos os
+# alertas da célula.
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from services.geo import cell_key, cell_center, DEFAULT_CELL_PRECISION, DEFAULT_CELL_MODE
+
+DEFAULT_MAX_WORKERS = 8
+
+logger = logging.getLogger(__name__)
+
+
+def group_by_cell(alerts, precision=DEFAULT_CELL_PRECISION, mode=DEFAULT_CELL_MODE):
+    """Retorna {chave_da_celula: [alertas]} preservando a ordem de chegada."""
+    cells = {}
+    for alert in alerts:
+        try:
+            key = cell_key(alert['lat'], alert['lon'], precision, mode)
+        except (KeyError, TypeError, ValueError):
+            continue
+        cells.setdefault(key, []).append(alert)
+    return cells
+
+
+class CheckEngine:
+    """
+    fetch(lat, lon) -> AQI (número) ou None
+    apply(alert, aqi) -> True se o alerta gerou notificação
+    """
+
+    def __init__(self, fetch, apply, precision=DEFAULT_CELL_PRECISION,
+                 mode=DEFAULT_CELL_MODE, max_workers=DEFAULT_MAX_WORKERS):
+        self.fetch = fetch
+        self.apply = apply
+        self.precision = precision
+        self.mode = mode
+        self.max_workers = max(1, int(max_workers))
+        self.last_stats = None
+
+    def _check_cell(self, key, alerts):
+        lat, lon = cell_center(key)
+        try:
+            aqi = self.fetch(lat, lon)
+        except Exception as e:
+            logger.debug(f"Erro ao buscar AQI da célula {key}: {e}")
+            aqi = None
+        if aqi is None:
+            return False, 0
+        notified = 0
+        for alert in alerts:
+            try:
+                if self.apply(alert, aqi):
+                    notified += 1
+            except Exception as e:
+                logger.exception(f"Erro checando alert id={alert.get('id')}: {e}")
+        return True, notified
+
+    def run(self, alerts):
+        """Executa um ciclo completo e devolve as estatísticas do ciclo."""
+        started = time.monotonic()
+        alerts = list(alerts)
+        cells = group_by_cell(alerts, self.precision, self.mode)
+        grouped = sum(len(group) for group in cells.values())
+
+        fetched = failed = notified = 0
+        if cells:
+            workers = min(self.max_workers, len(cells))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='aqi-check') as pool:
+                futures = [pool.submit(self._check_cell, key, group) for key, group in cells.items()]
+                for fut in as_completed(futures):
+                    ok, n = fut.result()
+                    fetched += 1
+                    if not ok:
+                        failed += 1
+                    notified += n
+
+        stats = {
+            'alerts': len(alerts),
+            'cells': len(cells),
+            'fetches': fetched,
+            'fetches_saved': grouped - fetched,
+            'failed_fetches': failed,
+            'notified': notified,
+            'duration_seconds': round(time.monotonic() - started, 3),
+        }
+        self.last_stats = stats
+        return stats
@@ -0,0 +1,218 @@
+# services/coordination.py
+# Coordenação entre processos/containers do mesmo host via SQLite, sem serviço
+# externo: cada worker mantém um heartbeat e disputa leases com prazo de
+# validade. Os alertas são divididos em `shards` (por célula, para que cada
+# leitura do WAQI seja buscada por um único worker); com um shard só, o dono
+# da lease é o líder do scheduler. Lease não renovada expira e é assumida por
+# outro worker no heartbeat seguinte.
+import os
+import math
+import time
+import uuid
+import zlib
+import socket
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+COORDINATION_DB_PATH = os.environ.get('COORDINATION_DB_PATH', 'coordination.sqlite')
+DEFAULT_LEASE_TTL_SECONDS = 60
+DEFAULT_SHARDS = 8
+MODES = ('leader', 'shards', 'off')
+
+
+@contextmanager
+def exclusive_lock(path, timeout=600):
+    """
+    Trava exclusiva entre processos: mantém o arquivo SQLite `path` em BEGIN
+    EXCLUSIVE enquanto o bloco roda (os demais esperam até `timeout`).
+    Serializa tarefas únicas de inicialização, como migrações de esquema.
+    """
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    try:
+        conn.execute('BEGIN EXCLUSIVE')
+        try:
+            yield
+        finally:
+            conn.execute('ROLLBACK')
+    finally:
+        conn.close()
+
+
+def shard_of(cell, shards):
+    """Shard estável (igual em todos os processos) de uma célula."""
+    return zlib.crc32(repr(cell).encode('utf-8')) % shards
+
+
+class Coordinator:
+    """
+    mode='leader': um único shard; quem detém a lease faz todo o trabalho.
+    mode='shards': `shards` leases divididas entre os workers vivos, cada um
+                   com no máximo ceil(shards / workers) delas.
+    mode='off':    sem coordenação (processo único); o worker é dono de tudo.
+    """
+
+    def __init__(self, path=COORDINATION_DB_PATH, mode='leader', shards=DEFAULT_SHARDS,
+                 lease_ttl=DEFAULT_LEASE_TTL_SECONDS, worker_id=None):
+        if mode not in MODES:
+            raise ValueError(f"modo de coordenação inválido: {mode!r} (use {', '.join(MODES)})")
+        self.path = path
+        self.mode = mode
+        self.shards = 1 if mode == 'leader' else max(1, int(shards))
+        self.lease_ttl = lease_ttl
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self._owned = frozenset(range(self.shards)) if mode == 'off' else frozenset()
+        self._valid_until = math.inf if mode == 'off' else 0.0
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._ready:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker_id TEXT PRIMARY KEY,
+                    heartbeat_at REAL NOT NULL,
+                    started_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            self._ready = True
+        return conn
+
+    def _lease_name(self, shard):
+        return 'leader' if self.mode == 'leader' else f'shard:{shard}/{self.shards}'
+
+    def heartbeat(self, now=None):
+        """
+        Registra o worker como vivo, renova as próprias leases, devolve as que
+        excedem a parte justa e assume leases livres/expiradas até completá-la.
+        Retorna o conjunto de shards em posse deste worker.
+        """
+        if self.mode == 'off':
+            return self._owned
+        now = now if now is not None else time.time()
+        expires = now + self.lease_ttl
+        names = {self._lease_name(s): s for s in range(self.shards)}
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE: um heartbeat por vez entre todos os processos
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT INTO workers (worker_id, heartbeat_at, started_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at',
+                (self.worker_id, now, now))
+            # workers sem heartbeat por 3 TTLs saem da contagem e da tabela
+            conn.execute('DELETE FROM workers WHERE heartbeat_at < ?', (now - 3 * self.lease_ttl,))
+            alive = conn.execute('SELECT COUNT(*) FROM workers WHERE heartbeat_at >= ?',
+                                 (now - self.lease_ttl,)).fetchone()[0]
+            fair_share = math.ceil(self.shards / max(1, alive))
+
+            rows = conn.execute('SELECT name, owner, expires_at FROM leases').fetchall()
+            current = {name: (owner, exp) for name, owner, exp in rows if name in names}
+            mine = sorted(names[n] for n, (owner, exp) in current.items() if owner == self.worker_id and exp > now)
+            keep, release = mine[:fair_share], mine[fair_share:]
+            free = [s for n, s in sorted(names.items(), key=lambda item: item[1])
+                    if n not in current or current[n][1] <= now or current[n][0] is None]
+            acquire = free[:max(0, fair_share - len(keep))]
+
+            for shard in release:
+                conn.execute('UPDATE leases SET owner = NULL, expires_at = 0 WHERE name = ? AND owner = ?',
+                             (self._lease_name(shard), self.worker_id))
+            for shard in keep + acquire:
+                conn.execute(
+                    'INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at',
+                    (self._lease_name(shard), self.worker_id, expires))
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        owned = frozenset(keep + acquire)
+        with self._lock:
+            changed = owned != self._owned
+            self._owned = owned
+            self._valid_until = expires
+        if changed:
+            logger.info(f"Worker {self.worker_id}: {self.describe()}")
+        return owned
+
+    def release(self):
+        """Devolve todas as leases (encerramento limpo: outro worker assume sem esperar o TTL)."""
+        if self.mode == 'off':
+            return
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE leases SET owner = NULL, expires_at = 0 WHERE owner = ?', (self.worker_id,))
+            conn.execute('DELETE FROM workers WHERE worker_id = ?', (self.worker_id,))
+        finally:
+            conn.close()
+        with self._lock:
+            self._owned = frozenset()
+            self._valid_until = 0.0
+
+    def owned_shards(self, now=None):
+        """Shards em posse (vazio se a última renovação já expirou)."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            return self._owned if now < self._valid_until else frozenset()
+
+    def is_leader(self):
+        """Dono do shard 0: executa as tarefas únicas (ex.: downsample do histórico)."""
+        return 0 in self.owned_shards()
+
+    def owns(self, cell, owned=None):
+        owned = self.owned_shards() if owned is None else owned
+        return shard_of(cell, self.shards) in owned
+
+    def describe(self, now=None):
+        owned = sorted(self.owned_shards(now))
+        if self.mode == 'leader':
+            return 'líder do scheduler' if owned else 'em espera (outro worker é o líder)'
+        if self.mode == 'off':
+            return 'sem coordenação (todos os alertas)'
+        return f"shards {owned} de {self.shards}" if owned else f"nenhum shard de {self.shards}"
+
+    def status(self, now=None):
+        """Visão deste worker e das leases de todos (para o endpoint de status)."""
+        now = now if now is not None else time.time()
+        owned = self.owned_shards(now)
+        result = {
+            'worker_id': self.worker_id,
+            'mode': self.mode,
+            'shards': self.shards,
+            'owned_shards': sorted(owned),
+            'is_leader': 0 in owned,
+            'lease_expires_in': round(max(0.0, self._valid_until - now), 1) if owned and self.mode != 'off' else None,
+            'description': self.describe(now),
+        }
+        if self.mode == 'off':
+            return result
+        conn = self._connect()
+        try:
+            result['workers'] = [
+                {'worker_id': w, 'alive': hb >= now - self.lease_ttl,
+                 'last_heartbeat_seconds_ago': round(now - hb, 1)}
+                for w, hb in conn.execute('SELECT worker_id, heartbeat_at FROM workers ORDER BY started_at')
+            ]
+            result['leases'] = [
+                {'name': name, 'owner': owner if exp > now else None}
+                for name, owner, exp in conn.execute('SELECT name, owner, expires_at FROM leases ORDER BY name')
+            ]
+        finally:
+            conn.close()
+        return result
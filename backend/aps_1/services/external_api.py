@@ -0,0 +1,371 @@
+# services/external_api.py
+# Cliente HTTP compartilhado para as APIs externas (WAQI, OpenAQ, Nominatim e,
+# quando FCM_ENDPOINT aponta para um servidor local, o FCM):
+# pool de conexões keep-alive por host, timeouts padronizados, retry com
+# backoff exponencial + jitter e estatísticas de latência por host. Cada
+# provedor registrado tem ainda circuit breaker e orçamento de requisições
+# (services/resilience.py).
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.geo import cell_key, DEFAULT_CELL_PRECISION
+from services.reading_cache import ReadingCache
+from services.aqi_history import record_waqi_payload, history_key
+from services.metrics import UPSTREAM_LATENCY, UPSTREAM_REJECTED, UPSTREAM_CIRCUIT_STATE
+from services.resilience import CircuitBreaker, TokenBucket, CircuitOpenError, BudgetExhaustedError
+from services.region_snapshot import (RegionSnapshot, parse_regions, DEFAULT_INTERVAL_SECONDS,
+                                      DEFAULT_MAX_DISTANCE_KM, DEFAULT_NEIGHBORS)
+
+WAQI_BASE_URL = os.environ.get('WAQI_BASE_URL', 'https://api.waqi.info')
+OPENAQ_BASE_URL = os.environ.get('OPENAQ_BASE_URL', 'https://api.openaq.org')
+USER_AGENT = 'air-quality-app/1.0 (+https://example.com)'
+
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 20))              # conexões por host
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 10))
+UPSTREAM_MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', 2))
+UPSTREAM_BACKOFF_BASE = float(os.environ.get('UPSTREAM_BACKOFF_BASE', 0.5))     # segundos
+UPSTREAM_BACKOFF_MAX = float(os.environ.get('UPSTREAM_BACKOFF_MAX', 8))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))   # falhas seguidas para abrir
+CIRCUIT_RESET_SECONDS = float(os.environ.get('CIRCUIT_RESET_SECONDS', 30))        # aberto -> half-open
+WAQI_REQUESTS_PER_MINUTE = float(os.environ.get('WAQI_REQUESTS_PER_MINUTE', 1000))
+OPENAQ_REQUESTS_PER_MINUTE = float(os.environ.get('OPENAQ_REQUESTS_PER_MINUTE', 60))
+# o orçamento é por processo: com vários workers do gunicorn, a cota de cada
+# provedor é dividida entre eles para que a soma não passe do contratado
+UPSTREAM_PROCESSES = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+UPSTREAM_BACKGROUND_RESERVE = float(os.environ.get('UPSTREAM_BACKGROUND_RESERVE', 0.2))  # fração do burst
+UPSTREAM_BUDGET_MAX_WAIT = float(os.environ.get('UPSTREAM_BUDGET_MAX_WAIT', 2))              # interativo
+UPSTREAM_BUDGET_BACKGROUND_MAX_WAIT = float(os.environ.get('UPSTREAM_BUDGET_BACKGROUND_MAX_WAIT', 30))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+CIRCUIT_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+LATENCY_WINDOW = 1000  # últimas N latências usadas nos percentis
+
+
+class _HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.window = deque(maxlen=LATENCY_WINDOW)
+
+    def snapshot(self):
+        ordered = sorted(self.window)
+
+        def pct(p):
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 4)
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'mean_seconds': round(self.total_seconds / self.requests, 4) if self.requests else None,
+            'p50_seconds': pct(0.50),
+            'p95_seconds': pct(0.95),
+            'p99_seconds': pct(0.99),
+            'max_seconds': round(self.max_seconds, 4),
+        }
+
+
+class UpstreamClient:
+    """
+    Uma requests.Session por host, com pool de `pool_size` conexões keep-alive.
+    Erros transitórios (falha de conexão, timeout, 429 e 5xx) são repetidos até
+    `max_retries` vezes com backoff exponencial e jitter ("full jitter").
+    Nos hosts registrados com register_provider, um circuito aberto faz a
+    chamada falhar na hora com CircuitOpenError e cada tentativa consome uma
+    ficha do orçamento do provedor (background=True: só acima da reserva).
+    """
+
+    def __init__(self, pool_size=UPSTREAM_POOL_SIZE, timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT),
+                 max_retries=UPSTREAM_MAX_RETRIES, backoff_base=UPSTREAM_BACKOFF_BASE,
+                 backoff_max=UPSTREAM_BACKOFF_MAX, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout=CIRCUIT_RESET_SECONDS):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._sessions = {}
+        self._stats = {}
+        self._providers = {}   # host -> nome do provedor nas métricas
+        self._breakers = {}    # host -> CircuitBreaker
+        self._budgets = {}     # host -> TokenBucket
+        self._lock = threading.Lock()
+
+    def _session(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['User-Agent'] = USER_AGENT
+                self._sessions[host] = session
+                self._stats[host] = _HostStats()
+            return session
+
+    def register_provider(self, url, name, requests_per_minute=None, burst=None):
+        """
+        Associa o host de `url` a um nome de provedor (rótulo das métricas) e
+        cria o circuit breaker dele. Com `requests_per_minute`, as chamadas
+        passam também pelo orçamento (padrão de burst: 10 s da cota), que é
+        a cota dividida por UPSTREAM_PROCESSES.
+        """
+        host = urlsplit(url).netloc
+        self._providers[host] = name
+        self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        if requests_per_minute:
+            rate = requests_per_minute / 60.0 / UPSTREAM_PROCESSES
+            self._budgets[host] = TokenBucket(rate, burst or max(1.0, rate * 10), UPSTREAM_BACKGROUND_RESERVE)
+
+    def _record(self, host, elapsed, error=False, retry=False):
+        UPSTREAM_LATENCY.observe(elapsed, provider=self._providers.get(host, host),
+                                 outcome='error' if error else 'ok')
+        with self._lock:
+            stats = self._stats[host]
+            stats.requests += 1
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+            stats.window.append(elapsed)
+            if error:
+                stats.errors += 1
+            if retry:
+                stats.retries += 1
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def get(self, url, params=None, headers=None, timeout=None, before_attempt=None, background=False):
+        return self.request('GET', url, params=params, headers=headers, timeout=timeout,
+                            before_attempt=before_attempt, background=background)
+
+    def post(self, url, json=None, headers=None, timeout=None, background=False):
+        return self.request('POST', url, json=json, headers=headers, timeout=timeout, background=background)
+
+    def request(self, method, url, params=None, json=None, headers=None, timeout=None, before_attempt=None,
+                background=False):
+        """
+        Requisição com retry. Retorna a Response (já validada com raise_for_status)
+        ou propaga requests.RequestException após esgotar as tentativas.
+        `before_attempt` é chamado antes de cada tentativa (ex.: rate limiter).
+        `background=True` marca chamadas do scheduler: cedem o orçamento às
+        interativas e podem esperar mais por ele.
+        CircuitOpenError e BudgetExhaustedError também são RequestException.
+        """
+        host = urlsplit(url).netloc
+        provider = self._providers.get(host, host)
+        breaker = self._breakers.get(host)
+        if breaker is not None and not breaker.allow():
+            UPSTREAM_REJECTED.inc(provider=provider, reason='circuit_open')
+            raise CircuitOpenError(f'circuito aberto para {provider}')
+        try:
+            resp = self._attempts(method, url, host, params, json, headers, timeout, before_attempt, background)
+        except BudgetExhaustedError:
+            UPSTREAM_REJECTED.inc(provider=provider, reason='budget_background' if background else 'budget')
+            if breaker is not None:
+                breaker.cancel()
+            raise
+        except requests.HTTPError as e:
+            # 4xx (exceto 429) é resposta válida do provedor, não indisponibilidade
+            status = e.response.status_code if e.response is not None else None
+            self._record_outcome(breaker, provider, ok=status is not None and status < 500 and status != 429)
+            raise
+        except requests.RequestException:
+            self._record_outcome(breaker, provider, ok=False)
+            raise
+        self._record_outcome(breaker, provider, ok=True)
+        return resp
+
+    def _record_outcome(self, breaker, provider, ok):
+        if breaker is None:
+            return
+        if ok:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        UPSTREAM_CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[breaker.state], provider=provider)
+
+    def _attempts(self, method, url, host, params, json, headers, timeout, before_attempt, background):
+        session = self._session(host)
+        budget = self._budgets.get(host)
+        max_wait = UPSTREAM_BUDGET_BACKGROUND_MAX_WAIT if background else UPSTREAM_BUDGET_MAX_WAIT
+        attempt = 0
+        while True:
+            if budget is not None:
+                budget.acquire(background=background, max_wait=max_wait)
+            if before_attempt is not None:
+                before_attempt()
+            started = time.monotonic()
+            try:
+                resp = session.request(method, url, params=params, json=json, headers=headers,
+                                       timeout=timeout or self.timeout)
+                if resp.status_code in RETRY_STATUS and attempt < self.max_retries:
+                    self._record(host, time.monotonic() - started, error=True, retry=True)
+                    resp.close()
+                    time.sleep(self._backoff(attempt))
+                    attempt += 1
+                    continue
+                resp.raise_for_status()
+                self._record(host, time.monotonic() - started)
+                return resp
+            except (requests.ConnectionError, requests.Timeout):
+                retry = attempt < self.max_retries
+                self._record(host, time.monotonic() - started, error=True, retry=retry)
+                if not retry:
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+            except requests.RequestException:
+                self._record(host, time.monotonic() - started, error=True)
+                raise
+
+    def stats(self):
+        """Estatísticas de latência/erros, circuito e orçamento por host."""
+        with self._lock:
+            result = {host: stats.snapshot() for host, stats in self._stats.items()}
+        for host, snapshot in result.items():
+            snapshot['provider'] = self._providers.get(host, host)
+            if host in self._breakers:
+                snapshot['circuit'] = self._breakers[host].snapshot()
+            if host in self._budgets:
+                snapshot['budget'] = self._budgets[host].snapshot()
+        return result
+
+
+# cliente único usado pelas rotas e pelo scheduler
+upstream = UpstreamClient()
+upstream.register_provider(WAQI_BASE_URL, 'waqi', WAQI_REQUESTS_PER_MINUTE)
+upstream.register_provider(OPENAQ_BASE_URL, 'openaq', OPENAQ_REQUESTS_PER_MINUTE)
+
+# Cache das leituras do WAQI, chaveado pela coordenada arredondada.
+READING_CACHE_PRECISION = int(os.environ.get('READING_CACHE_PRECISION', DEFAULT_CELL_PRECISION))
+reading_cache = ReadingCache(
+    ttl=int(os.environ.get('READING_CACHE_TTL', 600)),
+    stale_ttl=int(os.environ.get('READING_CACHE_STALE_TTL', 1800)),
+    max_entries=int(os.environ.get('READING_CACHE_MAX_ENTRIES', 10000)),
+    # só guarda respostas válidas; erros do WAQI (status != ok) são repetidos
+    should_cache=lambda payload: isinstance(payload, dict) and payload.get('status') == 'ok',
+)
+
+
+# Snapshot regional (services/region_snapshot.py); desligado sem regiões.
+#   WAQI_SNAPSHOT_REGIONS          "lat1,lon1,lat2,lon2;..." buscadas no map/bounds
+#   WAQI_SNAPSHOT_INTERVAL         segundos entre atualizações (scheduler)
+#   WAQI_SNAPSHOT_MAX_DISTANCE_KM  estação mais longe que isso -> feed/geo: normal
+#   WAQI_SNAPSHOT_MODE             'nearest' ou 'idw' (inverso da distância entre
+#                                  WAQI_SNAPSHOT_NEIGHBORS estações)
+#   WAQI_SNAPSHOT_MAX_AGE          leituras mais velhas que isso são ignoradas
+WAQI_SNAPSHOT_INTERVAL = int(os.environ.get('WAQI_SNAPSHOT_INTERVAL', DEFAULT_INTERVAL_SECONDS))
+region_snapshot = RegionSnapshot(
+    parse_regions(os.environ.get('WAQI_SNAPSHOT_REGIONS', '')),
+    max_distance_km=float(os.environ.get('WAQI_SNAPSHOT_MAX_DISTANCE_KM', DEFAULT_MAX_DISTANCE_KM)),
+    mode=os.environ.get('WAQI_SNAPSHOT_MODE', 'nearest'),
+    neighbors=int(os.environ.get('WAQI_SNAPSHOT_NEIGHBORS', DEFAULT_NEIGHBORS)),
+    max_age=float(os.environ.get('WAQI_SNAPSHOT_MAX_AGE', 3 * WAQI_SNAPSHOT_INTERVAL)),
+)
+
+
+def fetch_waqi_bounds(region, token, background=False):
+    """Todas as estações do retângulo (min_lat, min_lon, max_lat, max_lon) via map/bounds."""
+    min_lat, min_lon, max_lat, max_lon = region
+    r = upstream.get(f'{WAQI_BASE_URL}/map/bounds',
+                     params={'latlng': f'{min_lat},{min_lon},{max_lat},{max_lon}', 'networks': 'all', 'token': token},
+                     background=background)
+    return r.json()
+
+
+def refresh_region_snapshot(token, background=True):
+    """Uma chamada ao map/bounds por região; retorna o resumo da atualização."""
+    return region_snapshot.refresh(lambda region: fetch_waqi_bounds(region, token, background=background))
+
+
+# última observação do snapshot gravada no histórico, por célula consultada
+_snapshot_recorded = OrderedDict()
+_snapshot_recorded_lock = threading.Lock()
+
+
+def record_snapshot_reading(key, payload):
+    """
+    Grava no histórico da célula consultada (a mesma que /air-quality/history
+    procura) a leitura respondida pelo snapshot, uma vez por observação: as
+    consultas seguintes da mesma célula não escrevem de novo.
+    """
+    data = payload['data']
+    observation = (data.get('aqi'), repr(data.get('time')))
+    with _snapshot_recorded_lock:
+        if _snapshot_recorded.get(key) == observation:
+            return
+        _snapshot_recorded[key] = observation
+        _snapshot_recorded.move_to_end(key)
+        while len(_snapshot_recorded) > reading_cache.max_entries:
+            _snapshot_recorded.popitem(last=False)
+    record_waqi_payload(history_key(key), payload)
+
+
+def fetch_waqi_feed(lat, lon, token, background=False):
+    """Consulta o feed geo do WAQI e devolve o JSON completo (sem cache)."""
+    r = upstream.get(f'{WAQI_BASE_URL}/feed/geo:{lat};{lon}/', params={'token': token}, background=background)
+    return r.json()
+
+
+def get_waqi_feed(lat, lon, token, background=False, fresh=False, detailed=False):
+    """
+    Igual a fetch_waqi_feed, mas passando pelo cache compartilhado.
+    Coordenadas cobertas pelo snapshot regional são respondidas localmente,
+    sem chamada ao WAQI (o payload traz data.snapshot com a origem e iaqi
+    vazio). `detailed=True`, para quem pediu os poluentes, ignora o
+    snapshot e usa sempre o feed.
+    Como o feed, a leitura do snapshot entra no histórico da célula.
+    `fresh=True` (checagem de alertas) nunca devolve leitura além do TTL do
+    cache, mesmo dentro da janela de stale-while-revalidate.
+    Propaga requests.RequestException quando não há leitura em cache.
+    """
+    key = cell_key(lat, lon, READING_CACHE_PRECISION)
+    if region_snapshot.regions and not detailed:
+        payload = region_snapshot.lookup(float(lat), float(lon))
+        if payload is not None:
+            record_snapshot_reading(key, payload)
+            return payload
+
+    def load():
+        payload = fetch_waqi_feed(key[0], key[1], token, background=background)
+        # toda leitura nova buscada no WAQI vai para o histórico local
+        record_waqi_payload(history_key(key), payload)
+        return payload
+
+    return reading_cache.get(key, load, allow_stale=not fresh, background=background)
+
+
+def reading_version(payload):
+    """
+    Marca da leitura (estação, AQI, instante da observação e origem no
+    snapshot) usada para validar respostas já serializadas a partir dela.
+    """
+    data = payload.get('data')
+    if payload.get('status') != 'ok' or not isinstance(data, dict):
+        return (payload.get('status'), repr(data))
+    snapshot = data.get('snapshot') or {}
+    return ('ok', data.get('idx'), data.get('aqi'), repr(data.get('time')),
+            snapshot.get('fetched_at'), snapshot.get('stations'))
+
+
+def fetch_openaq_latest(lat, lon, background=False):
+    """Consulta /v2/latest do OpenAQ e devolve a lista `results`."""
+    r = upstream.get(f'{OPENAQ_BASE_URL}/v2/latest', params={'coordinates': f'{lat},{lon}'},
+                     background=background)
+    return r.json().get('results', [])
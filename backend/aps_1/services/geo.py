@@ -0,0 +1,123 @@
+# services/geo.py
+# Agrupamento de coordenadas em "células" geográficas para compartilhar leituras
+# e utilitários de distância para as buscas por proximidade.
+import math
+
+DEFAULT_CELL_PRECISION = 2   # casas decimais (~1,1 km no equador)
+DEFAULT_CELL_MODE = 'round'  # 'round' (lat/lon arredondados) ou 'geohash'
+
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(lat, lon, precision=6):
+    """
+    Codifica lat/lon em geohash com `precision` caracteres
+    (6 caracteres ~ 1,2 km x 0,6 km).
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bit = 0
+    ch = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            ch |= 1 << (4 - bit)
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        if bit < 4:
+            bit += 1
+        else:
+            chars.append(_GEOHASH_BASE32[ch])
+            bit = 0
+            ch = 0
+    return ''.join(chars)
+
+
+def geohash_decode(code):
+    """Retorna o centro (lat, lon) da célula geohash."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for c in code:
+        cd = _GEOHASH_BASE32.index(c)
+        for mask in (16, 8, 4, 2, 1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if cd & mask:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def cell_key(lat, lon, precision=DEFAULT_CELL_PRECISION, mode=DEFAULT_CELL_MODE):
+    """
+    Chave da célula que contém (lat, lon).
+    - mode='round': tupla (lat, lon) arredondada a `precision` casas decimais;
+    - mode='geohash': string geohash com `precision` caracteres.
+    """
+    lat = float(lat)
+    lon = float(lon)
+    if mode == 'geohash':
+        return geohash_encode(lat, lon, precision)
+    return (round(lat, precision), round(lon, precision))
+
+
+def cell_center(key):
+    """Coordenada representativa de uma célula (usada para a consulta upstream)."""
+    if isinstance(key, str):
+        return geohash_decode(key)
+    return key
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distância em km entre dois pontos (fórmula de haversine)."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Retângulo (min_lat, max_lat, min_lon, max_lon) que contém o círculo de
+    `radius_km` em volta do ponto; usado como filtro grosso no índice espacial.
+    """
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(lat))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, radius_km / (KM_PER_DEGREE_LAT * cos_lat))
+    return (max(-90.0, lat - dlat), min(90.0, lat + dlat), lon - dlon, lon + dlon)
+
+
+DEFAULT_NEARBY_RADIUS_KM = 5.0
+MAX_NEARBY_RADIUS_KM = 100.0
+
+
+def parse_nearby_args(args):
+    """
+    Lê lat, lon e radius_km (opcional) da query string das rotas /nearby.
+    Levanta ValueError com a mensagem de erro para o cliente.
+    """
+    try:
+        lat = float(args['lat'])
+        lon = float(args['lon'])
+        radius_km = float(args.get('radius_km', DEFAULT_NEARBY_RADIUS_KM))
+    except KeyError:
+        raise ValueError('Parâmetros obrigatórios: lat e lon')
+    except (TypeError, ValueError):
+        raise ValueError('lat, lon e radius_km devem ser numéricos')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('Latitude/longitude inválidas')
+    if not 0 < radius_km <= MAX_NEARBY_RADIUS_KM:
+        raise ValueError(f'radius_km deve estar entre 0 e {MAX_NEARBY_RADIUS_KM:g}')
+    return lat, lon, radius_km
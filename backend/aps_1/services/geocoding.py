@@ -0,0 +1,243 @@
+# services/geocoding.py
+# Geocodificação via Nominatim com cache persistente em SQLite e limite global
+# de requisições (política do Nominatim: no máximo 1 req/s). O limite vale
+# para todos os processos que usam o mesmo arquivo (workers do gunicorn,
+# CLI): o próximo horário livre fica numa linha do próprio banco do cache.
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+
+import requests
+
+from services.external_api import upstream
+
+NOMINATIM_URL = os.environ.get('NOMINATIM_URL', 'https://nominatim.openstreetmap.org/search')
+GEOCODE_DB_PATH = os.environ.get('GEOCODE_DB_PATH', 'geocode_cache.sqlite')
+GEOCODE_POSITIVE_TTL = int(os.environ.get('GEOCODE_POSITIVE_TTL', 30 * 24 * 60 * 60))  # 30 dias
+GEOCODE_NEGATIVE_TTL = int(os.environ.get('GEOCODE_NEGATIVE_TTL', 24 * 60 * 60))       # 1 dia
+NOMINATIM_MIN_INTERVAL = float(os.environ.get('NOMINATIM_MIN_INTERVAL', 1.0))          # segundos
+
+# o orçamento acompanha o limite de 1 req/s (o RateLimiter abaixo enfileira)
+upstream.register_provider(NOMINATIM_URL, 'nominatim',
+                           60 / NOMINATIM_MIN_INTERVAL if NOMINATIM_MIN_INTERVAL > 0 else None)
+
+_db_lock = threading.Lock()
+_db_ready = False
+
+
+class RateLimiter:
+    """
+    Garante um intervalo mínimo entre chamadas de todos os processos que
+    abrem o banco do cache. Quem chega antes da hora reserva o próximo
+    horário livre (linha `name` de rate_limits, numa transação IMMEDIATE) e
+    espera a sua vez, em vez de receber erro.
+    """
+
+    def __init__(self, min_interval, name='nominatim'):
+        self.min_interval = min_interval
+        self.name = name
+
+    def acquire(self):
+        if self.min_interval <= 0:
+            return
+        conn = _connect()
+        try:
+            conn.isolation_level = None
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT next_slot FROM rate_limits WHERE name = ?', (self.name,)).fetchone()
+                # relógio de parede: o horário é comparado entre processos
+                now = time.time()
+                slot = max(now, row[0] if row else 0.0)
+                conn.execute('INSERT OR REPLACE INTO rate_limits (name, next_slot) VALUES (?, ?)',
+                             (self.name, slot + self.min_interval))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+nominatim_limiter = RateLimiter(NOMINATIM_MIN_INTERVAL)
+# serializa misses da mesma chave para não repetir a consulta ao Nominatim
+_key_locks = {}
+_key_locks_guard = threading.Lock()
+
+
+def normalize_address(address):
+    """Chave do cache: sem acentos, minúscula e com espaços/vírgulas padronizados."""
+    text = unicodedata.normalize('NFKD', str(address))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = text.casefold()
+    text = re.sub(r'\s*,\s*', ', ', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip(' ,')
+
+
+def _connect():
+    global _db_ready
+    conn = sqlite3.connect(GEOCODE_DB_PATH, timeout=30)
+    if not _db_ready:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                address_key TEXT PRIMARY KEY,
+                lat TEXT,
+                lon TEXT,
+                expires_at REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                name TEXT PRIMARY KEY,
+                next_slot REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        _db_ready = True
+    return conn
+
+
+@contextmanager
+def _database():
+    """Conexão de uma operação: commit (ou rollback) no fim e sempre fechada."""
+    conn = _connect()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _cache_get(key):
+    with _db_lock, _database() as conn:
+        row = conn.execute(
+            'SELECT lat, lon, expires_at FROM geocode_cache WHERE address_key = ?', (key,)
+        ).fetchone()
+    if row is None or row[2] < time.time():
+        return None
+    return row[0], row[1]
+
+
+def _cache_get_many(keys, chunk_size=900):
+    """{chave: (lat, lon)} das chaves com entrada válida no cache."""
+    keys = list(keys)
+    now = time.time()
+    found = {}
+    with _db_lock, _database() as conn:
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            marks = ','.join('?' * len(chunk))
+            for key, lat, lon in conn.execute(
+                f'SELECT address_key, lat, lon FROM geocode_cache WHERE address_key IN ({marks}) AND expires_at >= ?',
+                chunk + [now],
+            ):
+                found[key] = (lat, lon)
+    return found
+
+
+def _cache_put(key, lat, lon):
+    now = time.time()
+    ttl = GEOCODE_POSITIVE_TTL if lat and lon else GEOCODE_NEGATIVE_TTL
+    with _db_lock, _database() as conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO geocode_cache (address_key, lat, lon, expires_at, created_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (key, lat, lon, now + ttl, now)
+        )
+
+
+def _query_nominatim(address):
+    """Retorna (lat, lon), (None, None) se não encontrado; propaga erros de rede."""
+    params = {'q': address, 'format': 'json', 'limit': 1}
+    # cada tentativa (inclusive retries) respeita o limite do Nominatim
+    resp = upstream.get(NOMINATIM_URL, params=params, before_attempt=nominatim_limiter.acquire)
+    data = resp.json()
+    if data:
+        return data[0].get('lat'), data[0].get('lon')
+    return None, None
+
+
+def geocode(address):
+    """
+    Geocodifica um endereço usando o cache persistente.
+    Resultados positivos e negativos (endereço não encontrado) ficam em cache
+    com TTLs separados; falhas de rede não são cacheadas.
+    """
+    key = normalize_address(address)
+    if not key:
+        return None, None
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    with _key_locks_guard:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        try:
+            # outro thread pode ter resolvido a mesma chave enquanto esperávamos
+            cached = _cache_get(key)
+            if cached is not None:
+                return cached
+            lat, lon = _query_nominatim(address)
+            _cache_put(key, lat, lon)
+            return lat, lon
+        finally:
+            with _key_locks_guard:
+                _key_locks.pop(key, None)
+
+
+def geocode_many(addresses, max_lookups=None):
+    """
+    Geocodificação em lote: endereços iguais após normalize_address são
+    resolvidos uma única vez, os que estão em cache saem de uma consulta só
+    e apenas os restantes vão ao Nominatim (respeitando o rate limiter),
+    no máximo `max_lookups` por chamada.
+    Retorna (resultados, pendentes): resultados[endereço] = (lat, lon) ou
+    (None, None) se não encontrado; pendentes[endereço] = motivo (limite de
+    consultas atingido ou erro de rede), para o chamador reenviar depois.
+    """
+    by_key = {}
+    for address in addresses:
+        key = normalize_address(address)
+        if key:
+            by_key.setdefault(key, []).append(address)
+    results, pending = {}, {}
+    cached = _cache_get_many(by_key)
+    lookups = 0
+    for key, originals in by_key.items():
+        if key in cached:
+            value = cached[key]
+        elif max_lookups is not None and lookups >= max_lookups:
+            pending.update((a, 'limite de geocodificações por requisição atingido; reenvie') for a in originals)
+            continue
+        else:
+            lookups += 1
+            try:
+                value = geocode(originals[0])
+            except requests.RequestException as e:
+                pending.update((a, f'erro no geocode: {e}') for a in originals)
+                continue
+        results.update((a, value) for a in originals)
+    for address in addresses:
+        if address not in results and address not in pending:
+            results[address] = (None, None)
+    return results, pending
+
+
+def cache_stats():
+    now = time.time()
+    with _db_lock, _database() as conn:
+        row = conn.execute(
+            'SELECT COUNT(*), SUM(lat IS NOT NULL), SUM(expires_at < ?) FROM geocode_cache', (now,)
+        ).fetchone()
+    total, positive, expired = row[0], row[1] or 0, row[2] or 0
+    return {'entries': total, 'positive': positive, 'negative': total - positive, 'expired': expired}
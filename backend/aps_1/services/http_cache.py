@@ -0,0 +1,144 @@
+# services/http_cache.py
+# Respostas GET pré-serializadas com ETag forte e GET condicional.
+# Cada entrada guarda os bytes do JSON (e, sob demanda, a versão gzip, feita
+# uma única vez) junto com a versão dos dados de origem: a leitura do WAQI ou
+# o contador de versão da tabela (mantido por triggers, ver
+# version_counter_ddl). Enquanto a versão não muda, a rota não monta nem
+# serializa a resposta de novo; com If-None-Match igual ao ETag responde 304
+# sem corpo. As representações identity e gzip têm ETags distintos (o da gzip
+# termina em '-gz'), como pede um ETag forte; qualquer um dos dois vale no
+# If-None-Match, já que o conteúdo é o mesmo.
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+DEFAULT_MAX_ENTRIES = 4096
+GZIP_MIN_BYTES = 512        # corpos menores não compensam a compressão
+GZIP_LEVEL = 6
+
+DATA_VERSIONS_DDL = '''
+    CREATE TABLE IF NOT EXISTS data_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+'''
+
+
+def version_counter_ddl(table, name=None, columns=None):
+    """
+    Comandos que criam o contador `name` (padrão: nome da tabela) em
+    data_versions e os triggers que o incrementam a cada INSERT, UPDATE e
+    DELETE em `table` (com `columns`, só UPDATEs dessas colunas contam).
+    Idempotentes (IF NOT EXISTS / OR IGNORE).
+    """
+    name = name or table
+    bump = f"UPDATE data_versions SET version = version + 1 WHERE name = '{name}';"
+    events = ('INSERT', f"UPDATE OF {', '.join(columns)}" if columns else 'UPDATE', 'DELETE')
+    return [DATA_VERSIONS_DDL, f"INSERT OR IGNORE INTO data_versions (name, version) VALUES ('{name}', 0)"] + [
+        f'CREATE TRIGGER IF NOT EXISTS {table}_version_{event.split()[0].lower()} AFTER {event} ON {table} '
+        f'BEGIN {bump} END'
+        for event in events
+    ]
+
+
+class _Entry:
+    __slots__ = ('version', 'body', 'etag', 'gzip_etag', 'headers', '_gzip', '_lock')
+
+    def __init__(self, version, body, headers):
+        self.version = version
+        self.body = body
+        # hash do conteúdo: o mesmo corpo tem o mesmo ETag em todos os processos
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.gzip_etag = self.etag + '-gz'
+        self.headers = headers
+        self._gzip = None
+        self._lock = threading.Lock()
+
+    def gzip_body(self):
+        if self._gzip is None:
+            with self._lock:
+                if self._gzip is None:
+                    self._gzip = gzip.compress(self.body, GZIP_LEVEL, mtime=0)
+        return self._gzip
+
+
+class ResponseCache:
+    """LRU chave -> entrada; uma entrada só vale para a versão com que foi gravada."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'not_modified': 0, 'gzip': 0, 'evictions': 0}
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def count(self, name):
+        """Incrementa um dos contadores de stats() (ex.: 'not_modified')."""
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry.version == version:
+                self._data.move_to_end(key)
+                self._counters['hits'] += 1
+                return entry
+            self._counters['misses'] += 1
+            return None
+
+    def put(self, key, version, body, headers=None):
+        entry = _Entry(version, body, headers or {})
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self._counters['evictions'] += 1
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, entries=len(self._data))
+
+
+# cache único das rotas de leitura
+response_cache = ResponseCache()
+
+
+def cached_json_response(key, version, build, headers=None, cache=response_cache):
+    """
+    Resposta 200 (ou 304) para `key` na versão `version`. build() monta o
+    objeto JSON só quando não há bytes em cache para essa versão;
+    headers(objeto) devolve headers extras guardados junto (ex.: paginação).
+    """
+    entry = cache.get(key, version)
+    if entry is None:
+        data = build()
+        body = (current_app.json.dumps(data) + '\n').encode('utf-8')
+        entry = cache.put(key, version, body, headers(data) if headers is not None else None)
+
+    use_gzip = len(entry.body) >= GZIP_MIN_BYTES and request.accept_encodings['gzip'] > 0
+    etag = entry.gzip_etag if use_gzip else entry.etag
+    if entry.etag in request.if_none_match or entry.gzip_etag in request.if_none_match:
+        # o 304 leva o ETag da representação negociada agora
+        cache.count('not_modified')
+        resp = Response(status=304)
+    elif use_gzip:
+        cache.count('gzip')
+        resp = Response(entry.gzip_body(), mimetype='application/json')
+        resp.headers['Content-Encoding'] = 'gzip'
+    else:
+        resp = Response(entry.body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Vary'] = 'Accept-Encoding'
+    # o cliente guarda, mas revalida sempre (If-None-Match -> 304)
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers.update(entry.headers)
+    return resp
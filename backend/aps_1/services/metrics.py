@@ -0,0 +1,237 @@
+# services/metrics.py
+# Métricas em memória no formato texto do Prometheus (exposition format 0.0.4),
+# sem dependências externas. Contadores e histogramas com rótulos; o endpoint
+# /metrics (routes/metrics.py) serializa o registro inteiro com render().
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+# buckets padrão (segundos), os mesmos do cliente oficial do Prometheus
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+# ciclos do scheduler duram de segundos a minutos
+CYCLE_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900)
+# quantidade de alertas avaliados por ciclo
+COUNT_BUCKETS = (10, 100, 1000, 10_000, 100_000, 1_000_000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: rótulos esperados {self.labelnames}, recebidos {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    @property
+    def sample_name(self):
+        """Nome nas linhas HELP/TYPE: no formato 0.0.4 tem de ser igual ao das amostras."""
+        return self.name
+
+    def render(self):
+        lines = [f'# HELP {self.sample_name} {self.documentation}', f'# TYPE {self.sample_name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    @property
+    def sample_name(self):
+        # como no prometheus_client: o contador é exposto com o sufixo _total
+        return f'{self.name}_total'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('contadores só aumentam')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self, items):
+        for key, value in items:
+            yield f'{self.sample_name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _render_samples(self, items):
+        for key, value in items:
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class _HistogramState:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = _HistogramState(len(self.buckets) + 1)
+            state.counts[i] += 1
+            state.sum += value
+            state.count += 1
+
+    def time(self, **labels):
+        """Context manager / decorador que observa a duração do bloco."""
+        return _Timer(self, labels)
+
+    def _render_samples(self, items):
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state.counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state.sum)}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {state.count}'
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self._started, **self.labels)
+        return False
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(self.histogram, self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# registro único do processo
+registry = Registry()
+
+UPSTREAM_LATENCY = registry.histogram(
+    'aps_upstream_request_seconds', 'Latência das chamadas às APIs externas (por tentativa).',
+    ('provider', 'outcome'))
+UPSTREAM_REJECTED = registry.counter(
+    'aps_upstream_rejected', 'Chamadas não feitas (circuit_open, budget, budget_background).',
+    ('provider', 'reason'))
+UPSTREAM_CIRCUIT_STATE = registry.gauge(
+    'aps_upstream_circuit_state', 'Estado do circuit breaker (0 fechado, 1 half-open, 2 aberto).', ('provider',))
+CHECK_CYCLE_DURATION = registry.histogram(
+    'aps_check_cycle_seconds', 'Duração do ciclo de checagem periódica.', ('engine',), CYCLE_BUCKETS)
+CHECK_CYCLE_ALERTS = registry.histogram(
+    'aps_check_cycle_alerts', 'Alertas avaliados por ciclo de checagem.', ('engine',), COUNT_BUCKETS)
+DB_QUERY_DURATION = registry.histogram(
+    'aps_db_query_seconds', 'Tempo das consultas SQLite.', ('store', 'operation'))
+HTTP_REQUEST_DURATION = registry.histogram(
+    'aps_http_request_seconds', 'Latência das requisições HTTP por rota.', ('endpoint', 'method', 'status'))
+STARTUP_DURATION = registry.gauge(
+    'aps_startup_seconds', 'Tempo de create_app por etapa (import, config, db, scheduler, total).', ('phase',))
+NOTIFICATIONS = registry.counter(
+    'aps_notifications', 'Notificações por resultado (sent, failed, suppressed_cooldown). '
+    'suppressed_cooldown conta só os alertas avaliados no ciclo: no motor por leituras, uma '
+    'observação repetida avalia apenas os alertas sujos da célula.', ('outcome',))
+OUTBOX_JOBS = registry.counter(
+    'aps_outbox_jobs', 'Jobs do outbox processados por resultado (done, retry, dead).', ('kind', 'outcome'))
+OUTBOX_DEPTH = registry.gauge('aps_outbox_depth', 'Jobs no outbox por status.', ('status',))
+OUTBOX_OLDEST_AGE = registry.gauge(
+    'aps_outbox_oldest_age_seconds', 'Idade do job pendente mais antigo do outbox.')
+SNAPSHOT_LOOKUPS = registry.counter(
+    'aps_snapshot_lookups', 'Consultas ao snapshot regional do WAQI (hit, outside, no_station).', ('outcome',))
+SNAPSHOT_STATIONS = registry.gauge('aps_snapshot_stations', 'Estações no snapshot regional do WAQI.')
+ADAPTIVE_FETCHES = registry.gauge(
+    'aps_adaptive_schedule_fetches',
+    'Buscas do agendamento adaptativo (adaptive) x as do intervalo fixo no mesmo período (fixed_interval).',
+    ('schedule',))
+
+
+def db_timed(store, operation):
+    """Decorador: mede a função em aps_db_query_seconds."""
+    return DB_QUERY_DURATION.time(store=store, operation=operation)
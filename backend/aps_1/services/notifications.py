@@ -1,13 +1,96 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import firebase_admin
+import requests
 from firebase_admin import credentials, messaging
 
-# Inicializa o Firebase com a chave da conta de serviço
+from services.external_api import upstream
+from services.metrics import UPSTREAM_LATENCY, NOTIFICATIONS
+
+logger = logging.getLogger(__name__)
+
+# Chave da conta de serviço do Firebase
 # Certifique-se de que o caminho para o JSON está correto no seu projeto
-cred = credentials.Certificate("services/aps1-7b3d9-08e66354e0ff.json")
-firebase_admin.initialize_app(cred)
+FIREBASE_CREDENTIALS = os.environ.get('FIREBASE_CREDENTIALS', "services/aps1-7b3d9-08e66354e0ff.json")
+# Endpoint compatível com a API v1 do FCM (ex.: servidor local do benchmark).
+# Vazio = envio real pelo firebase_admin.
+FCM_ENDPOINT = os.environ.get('FCM_ENDPOINT')
+FCM_HTTP_WORKERS = 16
 
-# Envia notificação push via Firebase Cloud Messaging (API v1)
-def send_push_notification(token, title, body):
+if FCM_ENDPOINT:
+    upstream.register_provider(FCM_ENDPOINT, 'fcm')
+
+_firebase_lock = threading.Lock()
+
+def init_firebase():
+    """Inicializa o Firebase no primeiro envio (idempotente)."""
+    with _firebase_lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            cred = credentials.Certificate(FIREBASE_CREDENTIALS)
+            return firebase_admin.initialize_app(cred)
+
+class _SendResponse:
+    def __init__(self, message_id=None, exception=None):
+        self.message_id = message_id
+        self.exception = exception
+        self.success = exception is None
+
+def _http_send(message):
+    """Envia no formato da API v1 do FCM para FCM_ENDPOINT, mapeando erros de token."""
+    payload = {'message': {
+        'token': message.token,
+        'notification': {'title': message.notification.title, 'body': message.notification.body},
+    }}
+    try:
+        return upstream.post(FCM_ENDPOINT, json=payload).json().get('name')
+    except requests.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        if status == 404:
+            raise messaging.UnregisteredError(str(e), cause=e)
+        if status == 403:
+            raise messaging.SenderIdMismatchError(str(e), cause=e)
+        raise
+
+def _timed_fcm(call, *args):
+    """Chamada ao firebase_admin medida como o upstream 'fcm' nas métricas."""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        result = call(*args)
+        outcome = 'ok'
+        return result
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, provider='fcm', outcome=outcome)
+
+def _send(message):
+    if FCM_ENDPOINT:
+        return _http_send(message)
+    init_firebase()
+    return _timed_fcm(messaging.send, message)
+
+def _send_each(messages):
+    """Lista de respostas (success/exception) na mesma ordem das mensagens."""
+    if not FCM_ENDPOINT:
+        init_firebase()
+        return _timed_fcm(messaging.send_each, messages).responses
+
+    def one(message):
+        try:
+            return _SendResponse(message_id=_http_send(message))
+        except Exception as e:
+            return _SendResponse(exception=e)
+
+    with ThreadPoolExecutor(max_workers=min(FCM_HTTP_WORKERS, len(messages))) as pool:
+        return list(pool.map(one, messages))
+
+def send_push_or_raise(token, title, body):
+    """Envia uma notificação e propaga o erro (para quem decide o retry, ex.: outbox)."""
     message = messaging.Message(
         notification=messaging.Notification(
             title=title,
@@ -16,13 +99,145 @@ def send_push_notification(token, title, body):
         token=token,
     )
     try:
-        response = messaging.send(message)
-        print(f"Notificação enviada com sucesso: {response}")
+        response = _send(message)
+    except Exception:
+        NOTIFICATIONS.inc(outcome='failed')
+        raise
+    logger.info(f"Notificação enviada com sucesso: {response}")
+    NOTIFICATIONS.inc(outcome='sent')
+    return response
+
+# Envia notificação push via Firebase Cloud Messaging (API v1)
+def send_push_notification(token, title, body):
+    try:
+        send_push_or_raise(token, title, body)
         return True
     except Exception as e:
-        print(f"Erro ao enviar notificação: {e}")
+        logger.error(f"Erro ao enviar notificação: {e}")
         return False
 
+FCM_MAX_BATCH = 500       # limite de mensagens por chamada do send_each
+FCM_FLUSH_WORKERS = 4     # lotes enviados em paralelo no flush
+# erros que indicam token definitivamente inválido (app desinstalado, outro projeto)
+PERMANENT_TOKEN_ERRORS = (messaging.UnregisteredError, messaging.SenderIdMismatchError)
+
+
+class BatchResult:
+    def __init__(self):
+        self.sent = []                # chaves enviadas com sucesso
+        self.failed = []              # chaves com falha (temporária ou permanente)
+        self.invalid_tokens = set()   # tokens que o FCM rejeitou de forma permanente
+
+    def stats(self):
+        return {
+            'sent': len(self.sent),
+            'failed': len(self.failed),
+            'invalid_tokens': len(self.invalid_tokens),
+        }
+
+
+class NotificationBatch:
+    """
+    Acumula notificações durante um ciclo e as envia em lotes de até
+    FCM_MAX_BATCH mensagens com messaging.send_each. Cada item tem uma `key`
+    (ex.: id do alerta) para o chamador saber quais envios deram certo.
+    """
+
+    def __init__(self, batch_size=FCM_MAX_BATCH, flush_workers=FCM_FLUSH_WORKERS):
+        self.batch_size = min(batch_size, FCM_MAX_BATCH)
+        self.flush_workers = flush_workers
+        self._items = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, key, token, title, body):
+        message = messaging.Message(
+            notification=messaging.Notification(title=title, body=body),
+            token=token,
+        )
+        with self._lock:
+            self._items.append((key, token, message))
+
+    def _send_chunk(self, chunk):
+        result = BatchResult()
+        try:
+            responses = _send_each([message for _, _, message in chunk])
+        except Exception as e:
+            logger.error(f"Erro ao enviar lote de {len(chunk)} notificação(ões): {e}")
+            result.failed.extend(key for key, _, _ in chunk)
+            NOTIFICATIONS.inc(len(chunk), outcome='failed')
+            return result
+        for (key, token, _), item in zip(chunk, responses):
+            if item.success:
+                result.sent.append(key)
+            else:
+                result.failed.append(key)
+                if isinstance(item.exception, PERMANENT_TOKEN_ERRORS):
+                    result.invalid_tokens.add(token)
+        NOTIFICATIONS.inc(len(result.sent), outcome='sent')
+        NOTIFICATIONS.inc(len(result.failed), outcome='failed')
+        return result
+
+    def flush(self):
+        """Envia tudo o que foi acumulado e devolve um BatchResult agregado."""
+        with self._lock:
+            items, self._items = self._items, []
+        result = BatchResult()
+        chunks = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        if not chunks:
+            return result
+        with ThreadPoolExecutor(max_workers=min(self.flush_workers, len(chunks))) as pool:
+            for partial in pool.map(self._send_chunk, chunks):
+                result.sent.extend(partial.sent)
+                result.failed.extend(partial.failed)
+                result.invalid_tokens |= partial.invalid_tokens
+        logger.info(
+            f"Lote FCM: {len(result.sent)} enviada(s), {len(result.failed)} falha(s), "
+            f"{len(result.invalid_tokens)} token(s) inválido(s)"
+        )
+        return result
+
+# Recomendações de saúde por faixa de AQI (limite superior da faixa, textos);
+# tuplas montadas uma vez no import e compartilhadas por todas as chamadas
+HEALTH_RECOMMENDATIONS = (
+    (50, (
+        "Qualidade do ar boa — atividades ao ar livre são seguras.",
+        "Continue ventilando ambientes quando apropriado.",
+        "Mantenha hábitos saudáveis.",
+    )),
+    (100, (
+        "Qualidade do ar moderada — pessoas sensíveis podem notar sintomas leves.",
+        "Se você tem problemas respiratórios, evite exercícios extenuantes ao ar livre.",
+        "Considere monitorar sintomas e reduzir exposição prolongada.",
+    )),
+    (150, (
+        "Ruim para grupos sensíveis — crianças, idosos e pessoas com doenças respiratórias devem ter cuidado.",
+        "Evite exercícios vigorosos ao ar livre.",
+        "Mantenha portas e janelas fechadas quando possível.",
+        "Considere o uso de máscara PFF2 em saídas necessárias.",
+    )),
+    (200, (
+        "Ruim — sintomas mais prováveis em indivíduos sensíveis e também em pessoas saudáveis.",
+        "Minimize atividades físicas ao ar livre.",
+        "Use máscara PFF2 ou equivalente se precisar sair.",
+        "Mantenha ambientes internos com ar mais puro (purificador, ar-condicionado com filtros).",
+    )),
+    (300, (
+        "Muito ruim — risco elevado para toda a população.",
+        "Evite sair de casa, especialmente crianças, idosos e pessoas com doenças respiratórias ou cardíacas.",
+        "Se precisar sair, use proteção respiratória adequada e reduza o tempo de exposição.",
+        "Considere procurar locais com ar filtrado e consulte um profissional de saúde se surgir piora.",
+    )),
+    (None, (
+        "Perigoso — condições ameaçam a saúde de todos.",
+        "Permanecer em ambientes fechados com ar limpo é altamente recomendado.",
+        "Se houver necessidade de sair, utilize equipamento de proteção respiratória certificado (máscara PFF2/N95).",
+        "Procure atendimento médico se apresentar sintomas graves como falta de ar ou dor no peito.",
+    )),
+)
+
 # Gera recomendações de saúde com base no nível de poluição (AQI)
 def get_health_recommendations(aqi):
     """
@@ -33,50 +248,13 @@ def get_health_recommendations(aqi):
       151-200  Unhealthy (Ruim)
       201-300  Very Unhealthy (Muito ruim)
       301+     Hazardous (Perigoso)
-    Retorna uma lista de recomendações adequadas à faixa.
+    Retorna a tupla (imutável) de recomendações adequadas à faixa.
     """
     try:
         aqi_value = int(aqi)
     except Exception:
         aqi_value = 0
 
-    if aqi_value <= 50:
-        return [
-            "Qualidade do ar boa — atividades ao ar livre são seguras.",
-            "Continue ventilando ambientes quando apropriado.",
-            "Mantenha hábitos saudáveis."
-        ]
-    elif aqi_value <= 100:
-        return [
-            "Qualidade do ar moderada — pessoas sensíveis podem notar sintomas leves.",
-            "Se você tem problemas respiratórios, evite exercícios extenuantes ao ar livre.",
-            "Considere monitorar sintomas e reduzir exposição prolongada."
-        ]
-    elif aqi_value <= 150:
-        return [
-            "Ruim para grupos sensíveis — crianças, idosos e pessoas com doenças respiratórias devem ter cuidado.",
-            "Evite exercícios vigorosos ao ar livre.",
-            "Mantenha portas e janelas fechadas quando possível.",
-            "Considere o uso de máscara PFF2 em saídas necessárias."
-        ]
-    elif aqi_value <= 200:
-        return [
-            "Ruim — sintomas mais prováveis em indivíduos sensíveis e também em pessoas saudáveis.",
-            "Minimize atividades físicas ao ar livre.",
-            "Use máscara PFF2 ou equivalente se precisar sair.",
-            "Mantenha ambientes internos com ar mais puro (purificador, ar-condicionado com filtros)."
-        ]
-    elif aqi_value <= 300:
-        return [
-            "Muito ruim — risco elevado para toda a população.",
-            "Evite sair de casa, especialmente crianças, idosos e pessoas com doenças respiratórias ou cardíacas.",
-            "Se precisar sair, use proteção respiratória adequada e reduza o tempo de exposição.",
-            "Considere procurar locais com ar filtrado e consulte um profissional de saúde se surgir piora."
-        ]
-    else:  # aqi_value > 300
-        return [
-            "Perigoso — condições ameaçam a saúde de todos.",
-            "Permanecer em ambientes fechados com ar limpo é altamente recomendado.",
-            "Se houver necessidade de sair, utilize equipamento de proteção respiratória certificado (máscara PFF2/N95).",
-            "Procure atendimento médico se apresentar sintomas graves como falta de ar ou dor no peito."
-        ]
+    for upper, recommendations in HEALTH_RECOMMENDATIONS:
+        if upper is None or aqi_value <= upper:
+            return recommendations
@@ -0,0 +1,238 @@
+# services/outbox.py
+# Fila de jobs persistente (outbox) em SQLite, atendida por um pool de threads.
+# O job é gravado na mesma transação da mudança que o originou (ex.: INSERT do
+# alerta), então nada se perde entre o commit e o processamento. Entrega "ao
+# menos uma vez": o job reservado tem um prazo (visibility timeout); se o
+# worker morrer antes de concluir, outro o reserva de novo quando o prazo
+# vence. Falhas voltam para a fila com backoff exponencial até max_attempts;
+# depois disso o job fica como 'dead' para inspeção.
+import json
+import os
+import time
+import random
+import logging
+import sqlite3
+import threading
+
+from services.metrics import OUTBOX_JOBS, OUTBOX_DEPTH, OUTBOX_OLDEST_AGE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VISIBILITY_TIMEOUT = 120     # segundos de reserva de um job
+DEFAULT_MAX_ATTEMPTS = 6
+DEFAULT_BACKOFF_BASE = 5             # segundos; dobra a cada tentativa
+DEFAULT_BACKOFF_MAX = 15 * 60
+DEFAULT_WORKERS = 2
+DEFAULT_POLL_INTERVAL = 1.0
+METRICS_INTERVAL = 10.0              # segundos entre atualizações das métricas da fila
+
+
+class Outbox:
+    def __init__(self, path, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX, busy_timeout=30):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._generation = 0
+        self._wakeup = threading.Event()
+
+    def reset(self, path=None):
+        """Troca o arquivo (opcional) e força novas conexões em todas as threads."""
+        if path is not None:
+            self.path = path
+        self._generation += 1
+
+    def connection(self):
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is None or local.generation != self._generation:
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            local.conn = conn
+            local.generation = self._generation
+        return conn
+
+    def init_schema(self, conn=None):
+        conn = conn or self.connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                locked_by TEXT,
+                last_error TEXT
+            )
+        ''')
+        # 'pending' e 'running' com prazo vencido são candidatos a reserva
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_status_available ON outbox (status, available_at)')
+
+    def enqueue(self, kind, payload, conn=None, delay=0.0):
+        """
+        Grava um job. Com `conn`, o INSERT entra na transação aberta do
+        chamador (commit/rollback junto com a mudança que originou o job).
+        """
+        now = time.time()
+        params = (kind, json.dumps(payload), now + delay, now)
+        sql = 'INSERT INTO outbox (kind, payload, available_at, created_at) VALUES (?, ?, ?, ?)'
+        if conn is not None:
+            return conn.execute(sql, params).lastrowid
+        job_id = self.connection().execute(sql, params).lastrowid
+        self.wakeup()
+        return job_id
+
+    def wakeup(self):
+        """Acorda os workers deste processo (job novo já commitado)."""
+        self._wakeup.set()
+
+    def wait(self, timeout):
+        woke = self._wakeup.wait(timeout)
+        self._wakeup.clear()
+        return woke
+
+    def claim(self, worker_id, now=None):
+        """
+        Reserva o próximo job disponível; retorna (id, kind, payload, tentativa) ou None.
+        Um job 'running' com prazo vencido que já usou as max_attempts (o
+        worker travou ou morreu em todas) vira 'dead' em vez de ser reservado.
+        """
+        now = now if now is not None else time.time()
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            dead = conn.execute('''
+                UPDATE outbox SET status = 'dead', locked_by = NULL,
+                                  last_error = 'prazo de reserva vencido na última tentativa'
+                WHERE status = 'running' AND available_at <= ? AND attempts >= ?
+                RETURNING kind
+            ''', (now, self.max_attempts)).fetchall()
+            row = conn.execute('''
+                UPDATE outbox SET status = 'running', attempts = attempts + 1, locked_by = ?, available_at = ?
+                WHERE id = (
+                    SELECT id FROM outbox
+                    WHERE status IN ('pending', 'running') AND available_at <= ? AND attempts < ?
+                    ORDER BY available_at, id LIMIT 1
+                )
+                RETURNING id, kind, payload, attempts
+            ''', (worker_id, now + self.visibility_timeout, now, self.max_attempts)).fetchone()
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+        for (kind,) in dead:
+            OUTBOX_JOBS.inc(kind=kind, outcome='dead')
+        if dead:
+            logger.error(f"{len(dead)} job(s) do outbox marcados como 'dead': prazo vencido na última tentativa")
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2]), row[3]
+
+    def complete(self, job_id):
+        self.connection().execute('DELETE FROM outbox WHERE id = ?', (job_id,))
+
+    def fail(self, job_id, attempt, error, now=None):
+        """Devolve o job à fila com backoff; na última tentativa, marca como 'dead'. Retorna o status."""
+        now = now if now is not None else time.time()
+        if attempt >= self.max_attempts:
+            status, available_at = 'dead', now
+        else:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+            status, available_at = 'pending', now + random.uniform(delay / 2, delay)
+        self.connection().execute(
+            'UPDATE outbox SET status = ?, available_at = ?, locked_by = NULL, last_error = ? WHERE id = ?',
+            (status, available_at, str(error)[:500], job_id))
+        return status
+
+    def stats(self, now=None):
+        """Profundidade da fila e idade do job mais antigo (para detectar acúmulo)."""
+        now = now if now is not None else time.time()
+        result = {'pending': 0, 'running': 0, 'dead': 0, 'by_kind': {}}
+        oldest = None
+        for kind, status, count, created in self.connection().execute(
+                'SELECT kind, status, COUNT(*), MIN(created_at) FROM outbox GROUP BY kind, status'):
+            result[status] = result.get(status, 0) + count
+            result['by_kind'].setdefault(kind, {})[status] = count
+            if status != 'dead' and (oldest is None or created < oldest):
+                oldest = created
+        result['depth'] = result['pending'] + result['running']
+        result['oldest_age_seconds'] = round(now - oldest, 1) if oldest is not None else 0.0
+        OUTBOX_DEPTH.set(result['pending'], status='pending')
+        OUTBOX_DEPTH.set(result['running'], status='running')
+        OUTBOX_DEPTH.set(result['dead'], status='dead')
+        OUTBOX_OLDEST_AGE.set(result['oldest_age_seconds'])
+        return result
+
+
+class OutboxWorkers:
+    """
+    `workers` threads que reservam e executam jobs. handlers[kind](payload)
+    conclui o job retornando normalmente; qualquer exceção agenda nova tentativa.
+    """
+
+    def __init__(self, outbox, handlers, workers=DEFAULT_WORKERS, poll_interval=DEFAULT_POLL_INTERVAL,
+                 worker_id=None):
+        self.outbox = outbox
+        self.handlers = handlers
+        self.workers = max(1, int(workers))
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f'{os.getpid()}'
+        self._stop = threading.Event()
+        self._threads = []
+        self._metrics_at = 0.0
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, args=(f'{self.worker_id}-{i}',),
+                                      name=f'outbox-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self.outbox.wakeup()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_once(self, worker_id=None):
+        """Processa um job, se houver; retorna True se processou."""
+        job = self.outbox.claim(worker_id or self.worker_id)
+        if job is None:
+            return False
+        job_id, kind, payload, attempt = job
+        handler = self.handlers.get(kind)
+        try:
+            if handler is None:
+                raise LookupError(f'sem handler para jobs {kind!r}')
+            handler(payload)
+        except Exception as e:
+            status = self.outbox.fail(job_id, attempt, e)
+            OUTBOX_JOBS.inc(kind=kind, outcome='dead' if status == 'dead' else 'retry')
+            log = logger.error if status == 'dead' else logger.warning
+            log(f"Job {kind} id={job_id} falhou (tentativa {attempt}): {e}")
+        else:
+            self.outbox.complete(job_id)
+            OUTBOX_JOBS.inc(kind=kind, outcome='done')
+        return True
+
+    def _loop(self, worker_id):
+        while not self._stop.is_set():
+            try:
+                if self.run_once(worker_id):
+                    continue
+                if time.monotonic() - self._metrics_at >= METRICS_INTERVAL:
+                    self._metrics_at = time.monotonic()
+                    self.outbox.stats()   # atualiza as métricas de profundidade/idade
+            except Exception as e:
+                logger.exception(f"Erro no worker do outbox {worker_id}: {e}")
+            self.outbox.wait(self.poll_interval)
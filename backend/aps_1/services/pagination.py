@@ -0,0 +1,49 @@
+# services/pagination.py
+# Paginação por cursor (limit + after_id) e resposta NDJSON em streaming,
+# usadas pelas listagens de /alerts e /enderecos.
+import json
+from flask import Response, stream_with_context
+
+MAX_PAGE_SIZE = 1000
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def parse_page_args(args):
+    """
+    Lê `limit` e `after_id` da query string.
+    Retorna (limit, after_id); limit=None significa sem paginação.
+    """
+    limit = args.get('limit')
+    after_id = args.get('after_id')
+    try:
+        limit = int(limit) if limit is not None else None
+        after_id = int(after_id) if after_id is not None else None
+    except ValueError:
+        raise PaginationError('limit e after_id devem ser inteiros')
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise PaginationError(f'limit deve estar entre 1 e {MAX_PAGE_SIZE}')
+    return limit, after_id
+
+
+def wants_ndjson(request):
+    return (request.args.get('format') == 'ndjson'
+            or request.accept_mimetypes.best == NDJSON_MIMETYPE)
+
+
+def ndjson_response(rows):
+    """Serializa as linhas uma a uma, sem montar a lista completa em memória."""
+    def generate():
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def page_headers(rows, limit, key):
+    """Header X-Next-After-Id quando a página veio cheia (pode haver mais)."""
+    if limit is not None and len(rows) == limit:
+        return {'X-Next-After-Id': str(rows[-1][key])}
+    return {}
@@ -0,0 +1,220 @@
+# services/reading_cache.py
+# Cache em memória (TTL + LRU) das leituras do WAQI, compartilhado por todas as
+# rotas e pelo scheduler.
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_WORKERS = 4
+DEFAULT_MAX_PENDING_REFRESHES = 256
+
+
+class _Entry:
+    __slots__ = ('value', 'fetched_at', 'fresh_until', 'stale_until')
+
+    def __init__(self, value, fetched_at, ttl, stale_ttl):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.fresh_until = fetched_at + ttl
+        self.stale_until = fetched_at + ttl + stale_ttl
+
+
+class _Flight:
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def _flight_key(key, background):
+    return key, bool(background)
+
+
+class ReadingCache:
+    """
+    Cache chave -> valor com:
+      - TTL: entradas com menos de `ttl` segundos são servidas direto;
+      - stale-while-revalidate: até `stale_ttl` segundos após expirar, a entrada
+        antiga é servida e uma atualização roda em segundo plano, num pool
+        único de `refresh_workers` threads (no máximo `max_pending_refreshes`
+        na fila; além disso, e para chaves já em carga, a atualização é
+        descartada e a entrada velha continua até o próximo acesso);
+      - LRU: no máximo `max_entries` entradas;
+      - single-flight: misses concorrentes da mesma chave disparam uma única carga.
+        Cargas de segundo plano (scheduler) e interativas não se misturam:
+        a de segundo plano pode esperar o orçamento do provedor atrás da
+        reserva, então um chamador interativo nunca fica preso a ela e faz
+        a própria carga (contada em 'bypassed'); o de segundo plano, por sua
+        vez, aproveita uma carga interativa em andamento.
+    `should_cache(valor)` decide se um resultado carregado pode ser guardado.
+    """
+
+    def __init__(self, ttl=600, stale_ttl=1800, max_entries=10000, should_cache=None,
+                 refresh_workers=DEFAULT_REFRESH_WORKERS, max_pending_refreshes=DEFAULT_MAX_PENDING_REFRESHES):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.should_cache = should_cache or (lambda value: value is not None)
+        self.refresh_workers = refresh_workers
+        self.max_pending_refreshes = max_pending_refreshes
+        self._data = OrderedDict()
+        self._inflight = {}   # (chave, background) -> _Flight
+        self._refresh_pool = None
+        self._pending_refreshes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'collapsed': 0,
+            'bypassed': 0,
+            'refreshes': 0,
+            'refreshes_dropped': 0,
+            'load_errors': 0,
+            'evictions': 0,
+        }
+
+    def configure(self, ttl=None, stale_ttl=None, max_entries=None):
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if stale_ttl is not None:
+                self.stale_ttl = stale_ttl
+            if max_entries is not None:
+                self.max_entries = max_entries
+                self._evict()
+
+    def _evict(self):
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def _store(self, key, value):
+        with self._lock:
+            self._data[key] = _Entry(value, time.time(), self.ttl, self.stale_ttl)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def _load(self, key, loader, flight, background=False):
+        try:
+            value = loader()
+            if self.should_cache(value):
+                self._store(key, value)
+            flight.value = value
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._counters['load_errors'] += 1
+        finally:
+            with self._lock:
+                self._inflight.pop(_flight_key(key, background), None)
+            flight.event.set()
+
+    def _refresh(self, key, loader, flight, background):
+        try:
+            self._load(key, loader, flight, background)
+        finally:
+            with self._lock:
+                self._pending_refreshes -= 1
+
+    def _refresh_in_background(self, key, loader, background=False):
+        with self._lock:
+            if _flight_key(key, False) in self._inflight or _flight_key(key, True) in self._inflight:
+                return
+            if self._pending_refreshes >= self.max_pending_refreshes:
+                self._counters['refreshes_dropped'] += 1
+                return
+            flight = self._inflight[_flight_key(key, background)] = _Flight()
+            self._pending_refreshes += 1
+            self._counters['refreshes'] += 1
+            if self._refresh_pool is None:
+                self._refresh_pool = ThreadPoolExecutor(max_workers=self.refresh_workers,
+                                                        thread_name_prefix='reading-refresh')
+            pool = self._refresh_pool
+        pool.submit(self._refresh, key, loader, flight, background)
+
+    def get(self, key, loader, allow_stale=True, background=False):
+        """
+        Retorna o valor da chave, chamando `loader()` em caso de miss.
+        Exceções do loader são propagadas a todos os chamadores que aguardavam.
+        Com `allow_stale=False` (checagem de alertas) uma entrada vencida não
+        é servida: o chamador espera a carga, como num miss.
+        `background=True` marca o chamador do scheduler (ver single-flight).
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if now < entry.fresh_until:
+                    self._data.move_to_end(key)
+                    self._counters['hits'] += 1
+                    return entry.value
+                if not allow_stale:
+                    # a entrada velha fica para quem aceita stale-while-revalidate
+                    entry = None
+                elif now < entry.stale_until:
+                    self._data.move_to_end(key)
+                    self._counters['stale_hits'] += 1
+                    stale = entry.value
+                else:
+                    del self._data[key]
+                    stale = None
+                    entry = None
+            if entry is None:
+                flight = self._inflight.get(_flight_key(key, False))
+                if flight is None and background:
+                    flight = self._inflight.get(_flight_key(key, True))
+                if flight is None:
+                    flight = self._inflight[_flight_key(key, background)] = _Flight()
+                    if not background and _flight_key(key, True) in self._inflight:
+                        self._counters['bypassed'] += 1
+                    self._counters['misses'] += 1
+                    owner = True
+                else:
+                    self._counters['collapsed'] += 1
+                    owner = False
+
+        if entry is not None:
+            self._refresh_in_background(key, loader, background)
+            return stale
+
+        if owner:
+            self._load(key, loader, flight, background)
+        else:
+            flight.event.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def peek(self, key):
+        """Entrada atual (valor, fetched_at) sem disparar carga; None se ausente."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or time.time() >= entry.stale_until:
+                return None
+            return entry.value, entry.fetched_at
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._data)
+            stats['pending_refreshes'] = self._pending_refreshes
+            stats['max_entries'] = self.max_entries
+            stats['ttl_seconds'] = self.ttl
+            stats['stale_ttl_seconds'] = self.stale_ttl
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses'] + stats['collapsed']
+        stats['hit_ratio'] = round((stats['hits'] + stats['stale_hits']) / lookups, 4) if lookups else 0.0
+        return stats
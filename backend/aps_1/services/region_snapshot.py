@@ -0,0 +1,257 @@
+# services/region_snapshot.py
+# Snapshot regional das estações do WAQI: em vez de um feed/geo: por
+# coordenada consultada, o endpoint map/bounds traz de uma vez todas as
+# estações de cada região configurada. As estações ficam numa KD-tree em
+# memória e as consultas por coordenada são respondidas localmente (estação
+# mais próxima ou interpolação por inverso da distância). As chamadas ao
+# upstream passam a crescer com o número de regiões, não com o de usuários.
+import math
+import time
+import logging
+import threading
+from heapq import heappush, heapreplace
+
+from services.geo import EARTH_RADIUS_KM
+from services.metrics import SNAPSHOT_LOOKUPS, SNAPSHOT_STATIONS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_SECONDS = 10 * 60
+DEFAULT_MAX_DISTANCE_KM = 10.0
+DEFAULT_NEIGHBORS = 4
+SNAPSHOT_MODES = ('nearest', 'idw')
+SAME_POINT_KM = 0.05   # abaixo disso a interpolação usa só a estação
+
+
+def parse_regions(spec):
+    """
+    "lat1,lon1,lat2,lon2;..." (cantos opostos de cada retângulo, como o
+    latlng do map/bounds) -> [(min_lat, min_lon, max_lat, max_lon)].
+    Levanta ValueError para regiões mal formadas.
+    """
+    regions = []
+    for part in (spec or '').split(';'):
+        if not part.strip():
+            continue
+        try:
+            lat1, lon1, lat2, lon2 = (float(v) for v in part.split(','))
+        except ValueError:
+            raise ValueError(f'região inválida: {part.strip()!r} (esperado lat1,lon1,lat2,lon2)')
+        if not (-90 <= lat1 <= 90 and -90 <= lat2 <= 90 and -180 <= lon1 <= 180 and -180 <= lon2 <= 180):
+            raise ValueError(f'região fora dos limites de latitude/longitude: {part.strip()!r}')
+        regions.append((min(lat1, lat2), min(lon1, lon2), max(lat1, lat2), max(lon1, lon2)))
+    return regions
+
+
+def parse_bounds_stations(payload, fetched_at):
+    """Estações com leitura numérica do JSON do map/bounds; ValueError se status != ok."""
+    if not isinstance(payload, dict) or payload.get('status') != 'ok':
+        data = payload.get('data') if isinstance(payload, dict) else payload
+        raise ValueError(f'resposta inválida do WAQI map/bounds: {data}')
+    stations = []
+    for item in payload.get('data') or []:
+        try:
+            aqi = int(item['aqi'])
+            lat = float(item['lat'])
+            lon = float(item['lon'])
+        except (KeyError, TypeError, ValueError):
+            # '-' = estação sem leitura no momento
+            continue
+        station = item.get('station') if isinstance(item.get('station'), dict) else {}
+        stations.append({
+            'uid': item.get('uid'),
+            'lat': lat,
+            'lon': lon,
+            'aqi': aqi,
+            'name': station.get('name'),
+            'time': station.get('time'),
+            'fetched_at': fetched_at,
+        })
+    return stations
+
+
+def _unit_vector(lat, lon):
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def _km_to_chord(km):
+    return 2 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2)
+
+
+def _chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+class StationTree:
+    """
+    KD-tree 3-D sobre os vetores unitários das estações. A distância
+    euclidiana (corda) cresce junto com a distância na superfície, então a
+    busca é exata em qualquer latitude e também perto do antimeridiano.
+    """
+
+    def __init__(self, stations):
+        self.stations = list(stations)
+        points = [(_unit_vector(s['lat'], s['lon']), i) for i, s in enumerate(self.stations)]
+        self._root = self._build(points, 0)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        point, index = points[mid]
+        return (point, index, axis, self._build(points[:mid], depth + 1), self._build(points[mid + 1:], depth + 1))
+
+    def nearest(self, lat, lon, k=1, max_km=None):
+        """Até `k` estações a no máximo `max_km`, como [(distância_km, estação)] da mais próxima."""
+        target = _unit_vector(lat, lon)
+        limit = _km_to_chord(max_km) ** 2 if max_km is not None else float('inf')
+        best = []   # heap de (-distância², índice): o pior candidato fica no topo
+
+        def bound():
+            return -best[0][0] if len(best) == k else limit
+
+        def visit(node):
+            if node is None:
+                return
+            point, index, axis, left, right = node
+            d2 = sum((a - b) ** 2 for a, b in zip(point, target))
+            if d2 <= bound():
+                if len(best) < k:
+                    heappush(best, (-d2, index))
+                else:
+                    heapreplace(best, (-d2, index))
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            if diff * diff <= bound():
+                visit(far)
+
+        visit(self._root)
+        found = sorted((-d2, index) for d2, index in best)
+        return [(_chord_to_km(math.sqrt(d2)), self.stations[index]) for d2, index in found]
+
+
+class RegionSnapshot:
+    """
+    refresh(fetch_bounds)  busca as regiões e reconstrói a árvore
+    lookup(lat, lon)       payload no formato do feed/geo: do WAQI, ou None
+                           (fora das regiões, sem estação próxima o bastante
+                           ou snapshot velho) para o chamador buscar o feed
+    """
+
+    def __init__(self, regions=(), max_distance_km=DEFAULT_MAX_DISTANCE_KM, mode='nearest',
+                 neighbors=DEFAULT_NEIGHBORS, max_age=3 * DEFAULT_INTERVAL_SECONDS):
+        if mode not in SNAPSHOT_MODES:
+            raise ValueError(f"modo de snapshot inválido: {mode!r} (use {' ou '.join(SNAPSHOT_MODES)})")
+        self.regions = list(regions)
+        self.max_distance_km = max_distance_km
+        self.mode = mode
+        self.neighbors = max(1, int(neighbors))
+        self.max_age = max_age
+        self._stations = {}     # região -> estações da última busca bem-sucedida
+        self._fetched_at = {}   # região -> epoch da última busca bem-sucedida
+        self._tree = None
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.failed_refreshes = 0
+
+    def covers(self, lat, lon):
+        return any(min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+                   for min_lat, min_lon, max_lat, max_lon in self.regions)
+
+    def refresh(self, fetch_bounds, now=None):
+        """
+        fetch_bounds(região) -> JSON do map/bounds. Uma região que falha
+        mantém as estações da busca anterior (até passarem de max_age).
+        """
+        now = now if now is not None else time.time()
+        refreshed = failed = 0
+        for region in self.regions:
+            try:
+                stations = parse_bounds_stations(fetch_bounds(region), now)
+            except Exception as e:
+                failed += 1
+                logger.warning(f"Falha ao atualizar o snapshot da região {region}: {e}")
+                continue
+            with self._lock:
+                self._stations[region] = stations
+                self._fetched_at[region] = now
+            refreshed += 1
+        if refreshed:
+            with self._lock:
+                # uma estação na interseção de duas regiões entra uma vez só
+                merged = {}
+                for stations in self._stations.values():
+                    for station in stations:
+                        merged[station['uid'] if station['uid'] is not None else (station['lat'], station['lon'])] = station
+                tree = StationTree(merged.values())
+                self._tree = tree
+            SNAPSHOT_STATIONS.set(len(tree))
+        with self._lock:
+            self.refreshes += refreshed
+            self.failed_refreshes += failed
+        return {
+            'regions': len(self.regions),
+            'refreshed': refreshed,
+            'failed': failed,
+            'stations': len(self._tree) if self._tree is not None else 0,
+        }
+
+    def lookup(self, lat, lon, now=None):
+        now = now if now is not None else time.time()
+        tree = self._tree
+        if tree is None or not self.covers(lat, lon):
+            SNAPSHOT_LOOKUPS.inc(outcome='outside')
+            return None
+        k = 1 if self.mode == 'nearest' else self.neighbors
+        found = [(km, s) for km, s in tree.nearest(lat, lon, k, self.max_distance_km)
+                 if now - s['fetched_at'] <= self.max_age]
+        if not found:
+            SNAPSHOT_LOOKUPS.inc(outcome='no_station')
+            return None
+        SNAPSHOT_LOOKUPS.inc(outcome='hit')
+
+        nearest_km, nearest = found[0]
+        if self.mode == 'nearest' or nearest_km < SAME_POINT_KM:
+            aqi = nearest['aqi']
+        else:
+            weights = [1.0 / km ** 2 for km, _ in found]
+            aqi = round(sum(w * s['aqi'] for w, (_, s) in zip(weights, found)) / sum(weights))
+        return {'status': 'ok', 'data': {
+            'aqi': aqi,
+            'idx': nearest['uid'],
+            'city': {'name': nearest['name'], 'geo': [nearest['lat'], nearest['lon']]},
+            'dominentpol': None,
+            'iaqi': {},
+            # station.time do map/bounds já vem em ISO 8601 com fuso
+            'time': {'s': nearest['time'], 'iso': nearest['time']},
+            'snapshot': {
+                'mode': self.mode,
+                'stations': len(found),
+                'distance_km': round(nearest_km, 2),
+                'fetched_at': round(nearest['fetched_at']),
+            },
+        }}
+
+    def stats(self, now=None):
+        now = now if now is not None else time.time()
+        with self._lock:
+            regions = [{
+                'bounds': list(region),
+                'stations': len(self._stations.get(region, ())),
+                'age_seconds': round(now - self._fetched_at[region]) if region in self._fetched_at else None,
+            } for region in self.regions]
+            return {
+                'mode': self.mode,
+                'stations': len(self._tree) if self._tree is not None else 0,
+                'max_distance_km': self.max_distance_km,
+                'refreshes': self.refreshes,
+                'failed_refreshes': self.failed_refreshes,
+                'regions': regions,
+            }
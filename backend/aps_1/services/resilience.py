@@ -0,0 +1,137 @@
+# services/resilience.py
+# Proteções por provedor usadas pelo UpstreamClient (services/external_api.py):
+#   - CircuitBreaker: depois de `failure_threshold` falhas seguidas o circuito
+#     abre e as chamadas falham na hora (o chamador segue para o fallback) em
+#     vez de esperar o timeout; após `reset_timeout` uma única chamada de teste
+#     (half-open) decide se fecha de novo ou continua aberto;
+#   - TokenBucket: orçamento de requisições igual à cota do provedor, comum às
+#     rotas e ao scheduler. O tráfego de segundo plano (scheduler) só consome
+#     acima de uma reserva, deixando a folga para as requisições interativas.
+import threading
+import time
+
+import requests
+
+
+class CircuitOpenError(requests.RequestException):
+    """Circuito aberto: a chamada nem foi feita."""
+
+
+class BudgetExhaustedError(requests.RequestException):
+    """Sem orçamento de requisições para o provedor dentro do tempo de espera."""
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0          # quantas vezes abriu
+        self.short_circuited = 0  # chamadas recusadas com o circuito aberto
+
+    def allow(self):
+        """True se a chamada pode seguir; no half-open só uma chamada de teste por vez."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() >= self._opened_at + self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def cancel(self):
+        """A chamada liberada por allow() não aconteceu (ex.: sem orçamento)."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = self._opened_at + self.reset_timeout - time.monotonic() if self.state == self.OPEN else None
+            return {
+                'state': self.state,
+                'consecutive_failures': self._failures,
+                'opened': self.opened,
+                'short_circuited': self.short_circuited,
+                'retry_in_seconds': round(max(0.0, retry_in), 1) if retry_in is not None else None,
+            }
+
+
+class TokenBucket:
+    """
+    `rate` fichas por segundo, até `burst` acumuladas. Interativo consome até
+    zerar; segundo plano só consome enquanto sobrarem mais de
+    `background_reserve` (fração do burst) fichas. Quem não tem ficha espera
+    até `max_wait` segundos e então recebe BudgetExhaustedError.
+    """
+
+    def __init__(self, rate, burst, background_reserve=0.2):
+        if rate <= 0 or burst < 1:
+            raise ValueError('orçamento inválido: é preciso rate > 0 e burst >= 1')
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.reserve = self.burst * background_reserve
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+        self.rejected = {'interactive': 0, 'background': 0}
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, background=False, max_wait=2.0):
+        floor = self.reserve if background else 0.0
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens - 1 >= floor:
+                    self._tokens -= 1
+                    return
+                wait = (floor + 1 - self._tokens) / self.rate
+                if now + wait > deadline:
+                    self.rejected['background' if background else 'interactive'] += 1
+                    raise BudgetExhaustedError(
+                        f"orçamento de requisições esgotado ({'segundo plano' if background else 'interativo'})")
+                self.waited_seconds += wait
+            time.sleep(wait)
+
+    def snapshot(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                'tokens': round(self._tokens, 1),
+                'burst': self.burst,
+                'per_minute': round(self.rate * 60, 1),
+                'background_reserve': round(self.reserve, 1),
+                'waited_seconds': round(self.waited_seconds, 3),
+                'rejected': dict(self.rejected),
+            }
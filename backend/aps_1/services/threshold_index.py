@@ -0,0 +1,340 @@
+# services/threshold_index.py
+# Avaliação "invertida" dirigida por leituras: para cada célula, os alertas
+# ficam ordenados por limite; uma leitura nova encontra os alertas disparados
+# com uma busca binária (O(log n + disparados)), sem varrer a tabela.
+# O índice também guarda, por célula, a última observação avaliada (instante
+# informado pelo WAQI + AQI): enquanto a estação não publica leitura nova, só
+# os alertas "sujos" (novos, alterados, com cooldown recém-terminado ou cujo
+# envio falhou) são avaliados.
+import time
+import heapq
+import logging
+import threading
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from services.geo import cell_key, cell_center, DEFAULT_CELL_PRECISION, DEFAULT_CELL_MODE
+from services.check_engine import DEFAULT_MAX_WORKERS
+from services.metrics import NOTIFICATIONS
+
+logger = logging.getLogger(__name__)
+
+
+def iso_to_epoch(value):
+    """Converte o last_notified_at (ISO, UTC ingênuo) em segundos epoch; None se vazio/inválido."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class ThresholdIndex:
+    """
+    Índice em memória: célula -> lista de (limite, id) ordenada por limite.
+    Guarda também, por alerta, o instante (epoch) em que o cooldown termina,
+    calculado uma única vez na carga, e por célula os alertas que ainda
+    precisam de avaliação mesmo sem leitura nova (ver matches_changed).
+    """
+
+    def __init__(self, cooldown_seconds, precision=DEFAULT_CELL_PRECISION, mode=DEFAULT_CELL_MODE):
+        self.cooldown_seconds = cooldown_seconds
+        self.precision = precision
+        self.mode = mode
+        self._cells = {}      # cell -> [(limit, id), ...] ordenado
+        self._alerts = {}     # id -> (alert, cell, limit)
+        self._cooldown_until = {}
+        self._dirty = {}      # cell -> {id}: avaliar no próximo ciclo mesmo sem leitura nova
+        self._expiries = []   # heap (fim do cooldown, id); entradas antigas são ignoradas
+        self._observed = {}   # cell -> (instante da observação, aqi) da última avaliação
+        self.version = None   # marca do conteúdo do banco usada no rebuild
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def cells(self):
+        with self._lock:
+            return list(self._cells)
+
+    def add(self, alert):
+        with self._lock:
+            self._add(alert)
+
+    def _add(self, alert):
+        try:
+            limit = float(alert['aqi_limit'])
+            cell = cell_key(alert['lat'], alert['lon'], self.precision, self.mode)
+        except (KeyError, TypeError, ValueError):
+            return
+        alert_id = alert['id']
+        last = iso_to_epoch(alert.get('last_notified_at'))
+        until = last + self.cooldown_seconds if last is not None else 0.0
+        previous = self._alerts.get(alert_id)
+        # novo, com outra célula/limite ou com cooldown antecipado: precisa de
+        # uma primeira avaliação; só o cooldown renovado (notificação) não
+        # (o ISO do banco tem resolução de segundos; mark_notified, não)
+        dirty = (previous is None or previous[1:] != (cell, limit)
+                 or until + 1.0 < self._cooldown_until[alert_id])
+        if previous is not None:
+            # reinserção: a última observação da célula continua valendo
+            self._remove(alert_id, forget_observation=False)
+        self._alerts[alert_id] = (alert, cell, limit)
+        insort(self._cells.setdefault(cell, []), (limit, alert_id))
+        self._cooldown_until[alert_id] = until
+        if until:
+            self._push_expiry(until, alert_id)
+        if dirty:
+            self._dirty.setdefault(cell, set()).add(alert_id)
+
+    def remove(self, alert_id):
+        with self._lock:
+            self._remove(alert_id)
+
+    def _remove(self, alert_id, forget_observation=True):
+        entry = self._alerts.pop(alert_id, None)
+        self._cooldown_until.pop(alert_id, None)
+        if entry is None:
+            return
+        _, cell, limit = entry
+        bucket = self._cells.get(cell, [])
+        i = bisect_left(bucket, (limit, alert_id))
+        if i < len(bucket) and bucket[i] == (limit, alert_id):
+            del bucket[i]
+        self._dirty.get(cell, set()).discard(alert_id)
+        if not bucket:
+            self._cells.pop(cell, None)
+            self._dirty.pop(cell, None)
+            if forget_observation:
+                self._observed.pop(cell, None)
+
+    def rebuild(self, alerts, version=None):
+        """Recarga completa: todos os alertas voltam a ter a primeira avaliação."""
+        with self._lock:
+            self._cells.clear()
+            self._alerts.clear()
+            self._cooldown_until.clear()
+            self._dirty.clear()
+            self._expiries = []
+            self._observed.clear()
+            for alert in alerts:
+                self._add(alert)
+            self.version = version
+
+    def _push_expiry(self, until, alert_id):
+        heapq.heappush(self._expiries, (until, alert_id))
+        if len(self._expiries) > 2 * len(self._alerts) + 64:
+            self._expiries = [(u, i) for i, u in self._cooldown_until.items() if u]
+            heapq.heapify(self._expiries)
+
+    def _collect_expired(self, now):
+        """Cooldowns que terminaram desde a última coleta tornam o alerta sujo."""
+        while self._expiries and self._expiries[0][0] <= now:
+            until, alert_id = heapq.heappop(self._expiries)
+            entry = self._alerts.get(alert_id)
+            if entry is not None and self._cooldown_until[alert_id] == until:
+                self._dirty.setdefault(entry[1], set()).add(alert_id)
+
+    def mark_dirty(self, alert_ids):
+        """Reavalia estes alertas no próximo ciclo (ex.: envio que falhou)."""
+        with self._lock:
+            for alert_id in alert_ids:
+                entry = self._alerts.get(alert_id)
+                if entry is not None:
+                    self._dirty.setdefault(entry[1], set()).add(alert_id)
+
+    def observe(self, cell, aqi, observed_at):
+        """
+        Registra a leitura da célula; False se for a mesma observação já
+        avaliada (mesmo instante informado pela estação e mesmo AQI).
+        Sem instante (OpenAQ, feed sem data) a leitura conta sempre como nova.
+        """
+        with self._lock:
+            previous = self._observed.get(cell)
+            if observed_at is None:
+                self._observed.pop(cell, None)
+                return True
+            self._observed[cell] = (observed_at, aqi)
+            return previous != (observed_at, aqi)
+
+    def dirty_count(self):
+        with self._lock:
+            return sum(len(ids) for ids in self._dirty.values())
+
+    def cell_size(self, cell):
+        with self._lock:
+            return len(self._cells.get(cell, ()))
+
+    def outlook(self, cell, now=None):
+        """
+        (menor limite entre os alertas fora do cooldown, fim do cooldown mais
+        próximo) da célula, para o agendamento adaptativo; None quando não há.
+        """
+        now = now if now is not None else time.time()
+        lowest = next_end = None
+        with self._lock:
+            for limit, alert_id in self._cells.get(cell, ()):
+                until = self._cooldown_until[alert_id]
+                if until <= now:
+                    if lowest is None:
+                        lowest = limit
+                elif next_end is None or until < next_end:
+                    next_end = until
+        return lowest, next_end
+
+    def mark_notified(self, alert_ids, when=None):
+        until = (when if when is not None else time.time()) + self.cooldown_seconds
+        with self._lock:
+            for alert_id in alert_ids:
+                if alert_id in self._cooldown_until:
+                    self._cooldown_until[alert_id] = until
+                    self._push_expiry(until, alert_id)
+
+    def matches(self, cell, aqi, now=None):
+        """
+        Alertas da célula com limite < aqi e fora do cooldown.
+        Retorna (disparados, suprimidos_por_cooldown).
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            # avaliação completa da célula: nada dela fica pendente
+            self._collect_expired(now)
+            self._dirty.pop(cell, None)
+            bucket = self._cells.get(cell)
+            if not bucket:
+                return [], 0
+            # (aqi, -inf) fica antes de qualquer (aqi, id): pega só limites estritamente menores
+            end = bisect_left(bucket, (aqi, float('-inf')))
+            fired, suppressed = [], 0
+            for _, alert_id in bucket[:end]:
+                if self._cooldown_until[alert_id] <= now:
+                    fired.append(self._alerts[alert_id][0])
+                else:
+                    suppressed += 1
+        return fired, suppressed
+
+    def matches_changed(self, cell, aqi, now=None):
+        """
+        Como matches(), mas só entre os alertas sujos da célula: para uma
+        observação que já foi avaliada, os demais não mudaram de situação.
+        Retorna (disparados, suprimidos_por_cooldown, avaliados); os
+        suprimidos também são só os sujos (os demais já foram contados
+        quando a observação chegou).
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            self._collect_expired(now)
+            ids = self._dirty.pop(cell, ())
+            fired, suppressed = [], 0
+            for alert_id in ids:
+                alert, _, limit = self._alerts[alert_id]
+                if limit >= aqi:
+                    continue
+                if self._cooldown_until[alert_id] <= now:
+                    fired.append(alert)
+                else:
+                    suppressed += 1
+        return fired, suppressed, len(ids)
+
+
+class ReadingEngine:
+    """
+    Ciclo dirigido por leituras: busca o AQI de cada célula do índice (em
+    paralelo) e notifica apenas os alertas retornados por index.matches().
+    fetch(lat, lon) -> AQI ou (AQI, instante da observação); com o instante,
+    uma observação já avaliada só passa pelos alertas sujos da célula.
+    notify(alert, aqi) -> True se a notificação foi enviada/enfileirada.
+    Em stats, 'suppressed_by_cooldown' (e a métrica suppressed_cooldown)
+    conta só os alertas avaliados: numa célula sem leitura nova, os que
+    continuam em cooldown não entram de novo.
+    """
+
+    def __init__(self, index, fetch, notify, max_workers=DEFAULT_MAX_WORKERS):
+        self.index = index
+        self.fetch = fetch
+        self.notify = notify
+        self.max_workers = max(1, int(max_workers))
+        self.last_stats = None
+        self.last_readings = {}
+
+    def evaluate_reading(self, cell, aqi, now=None, changed_only=False):
+        """
+        Aplica uma leitura já conhecida a uma célula (com `changed_only`, só
+        aos alertas sujos); retorna (notificados, suprimidos, avaliados).
+        """
+        if changed_only:
+            fired, suppressed, evaluated = self.index.matches_changed(cell, aqi, now)
+        else:
+            evaluated = self.index.cell_size(cell)
+            fired, suppressed = self.index.matches(cell, aqi, now)
+        if suppressed:
+            NOTIFICATIONS.inc(suppressed, outcome='suppressed_cooldown')
+        notified = 0
+        failed = []
+        for alert in fired:
+            try:
+                if self.notify(alert, aqi):
+                    notified += 1
+                    continue
+            except Exception as e:
+                logger.exception(f"Erro notificando alert id={alert.get('id')}: {e}")
+            failed.append(alert['id'])
+        if failed:
+            # a mesma observação volta a valer para eles no próximo ciclo
+            self.index.mark_dirty(failed)
+        return notified, suppressed, evaluated
+
+    def _fetch_cell(self, cell):
+        lat, lon = cell_center(cell)
+        try:
+            result = self.fetch(lat, lon)
+        except Exception as e:
+            logger.debug(f"Erro ao buscar AQI da célula {cell}: {e}")
+            return cell, None, None
+        if isinstance(result, tuple):
+            return (cell,) + result
+        return cell, result, None
+
+    def run(self, cells=None):
+        """Um ciclo sobre `cells` (padrão: todas as células do índice)."""
+        started = time.monotonic()
+        subset = cells is not None
+        cells = list(cells) if subset else self.index.cells()
+        alerts = sum(self.index.cell_size(cell) for cell in cells) if subset else len(self.index)
+        readings = {}
+        fetched = failed = notified = suppressed = evaluated = unchanged = 0
+        if cells:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(cells)),
+                                    thread_name_prefix='aqi-reading') as pool:
+                futures = [pool.submit(self._fetch_cell, cell) for cell in cells]
+                for fut in as_completed(futures):
+                    cell, aqi, observed_at = fut.result()
+                    readings[cell] = aqi
+                    fetched += 1
+                    if aqi is None:
+                        failed += 1
+                        continue
+                    changed_only = not self.index.observe(cell, aqi, observed_at)
+                    unchanged += changed_only
+                    n, s, e = self.evaluate_reading(cell, aqi, changed_only=changed_only)
+                    notified += n
+                    suppressed += s
+                    evaluated += e
+
+        stats = {
+            'alerts': alerts,
+            'cells': len(cells),
+            'fetches': fetched,
+            'fetches_saved': alerts - fetched,
+            'failed_fetches': failed,
+            'unchanged_cells': unchanged,
+            'evaluated': evaluated,
+            'notified': notified,
+            'suppressed_by_cooldown': suppressed,
+            'duration_seconds': round(time.monotonic() - started, 3),
+        }
+        self.last_stats = stats
+        self.last_readings = readings
+        return stats
@@ -0,0 +1,197 @@
+# services/vector_eval.py
+# Avaliação vetorizada (NumPy) de limite + cooldown para a tabela inteira de
+# alertas: uma única passada produz a máscara "passou do limite e fora do
+# cooldown". A versão em Python puro (evaluate_reference) é a referência.
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from services.geo import cell_key, cell_center, DEFAULT_CELL_PRECISION, DEFAULT_CELL_MODE
+from services.check_engine import DEFAULT_MAX_WORKERS
+from services.metrics import NOTIFICATIONS
+
+logger = logging.getLogger(__name__)
+
+
+def _round_scaled(values, precision):
+    """
+    round(v, precision) * 10**precision como int64, igual ao cell_key. O
+    np.rint do produto desempata para o par e o produto em ponto flutuante
+    pode cair exatamente em .5 quando o valor decimal não cai (-7.45 * 10);
+    só esses casos, perto do empate, passam pelo round() do Python.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scale = 10 ** precision
+    scaled = values * scale
+    result = np.rint(scaled)
+    near_tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) <= 4 * np.spacing(np.abs(scaled))
+    for i in np.flatnonzero(near_tie).tolist():
+        result[i] = round(round(float(values[i]), precision) * scale)
+    return result.astype(np.int64)
+
+
+class AlertColumns:
+    """
+    Alertas em formato colunar:
+      ids        int64   id do alerta
+      cell_idx   int32   índice em `cells`
+      limits     float64 aqi_limit
+      last_epoch float64 last_notified_at em epoch (-inf se nunca notificado)
+    """
+
+    def __init__(self, ids, cell_idx, limits, last_epoch, cells):
+        self.ids = ids
+        self.cell_idx = cell_idx
+        self.limits = limits
+        self.last_epoch = last_epoch
+        self.cells = cells
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_arrays(cls, ids, lats, lons, limits, last_epoch,
+                    precision=DEFAULT_CELL_PRECISION, mode=DEFAULT_CELL_MODE):
+        ids = np.asarray(ids, dtype=np.int64)
+        limits = np.asarray(limits, dtype=np.float64)
+        last_epoch = np.nan_to_num(np.asarray(last_epoch, dtype=np.float64), nan=-np.inf)
+        if mode == 'round':
+            # arredonda e agrupa as coordenadas sem sair do NumPy: cada par
+            # (lat, lon) arredondado vira um inteiro único
+            scale = 10 ** precision
+            ilat = _round_scaled(lats, precision) + 90 * scale
+            ilon = _round_scaled(lons, precision) + 180 * scale
+            width = 360 * scale + 1
+            unique, inverse = np.unique(ilat * width + ilon, return_inverse=True)
+            cells = [(round(lat / scale - 90, precision), round(lon / scale - 180, precision))
+                     for lat, lon in zip((unique // width).tolist(), (unique % width).tolist())]
+            cell_idx = inverse.reshape(-1).astype(np.int32)
+        else:
+            positions = {}
+            cell_idx = np.empty(len(ids), dtype=np.int32)
+            for i, (lat, lon) in enumerate(zip(lats, lons)):
+                key = cell_key(lat, lon, precision, mode)
+                cell_idx[i] = positions.setdefault(key, len(positions))
+            cells = list(positions)
+        return cls(ids, cell_idx, limits, last_epoch, cells)
+
+    def select_cells(self, keep):
+        """Só os alertas das células com keep[i] verdadeiro (ex.: shards deste worker)."""
+        keep = np.asarray(keep, dtype=bool).reshape(-1)
+        rows = keep[self.cell_idx]
+        remap = (np.cumsum(keep) - 1).astype(np.int32)
+        return AlertColumns(self.ids[rows], remap[self.cell_idx[rows]], self.limits[rows],
+                            self.last_epoch[rows], [cell for cell, k in zip(self.cells, keep) if k])
+
+
+def evaluate_mask(columns, cell_aqi, now, cooldown_seconds):
+    """
+    cell_aqi: float64 alinhado a columns.cells (NaN = sem leitura).
+    Retorna a máscara booleana dos alertas a notificar.
+    """
+    aqi = np.asarray(cell_aqi, dtype=np.float64)[columns.cell_idx]
+    # comparações com NaN resultam em False: células sem leitura não disparam
+    return (aqi > columns.limits) & (columns.last_epoch <= now - cooldown_seconds)
+
+
+def evaluate_reference(alerts, aqi_for_alert, now, cooldown_seconds):
+    """
+    Referência em Python puro, linha a linha, com a mesma regra de
+    apply_aqi_to_alert. `now` é um datetime UTC ingênuo.
+    Retorna a lista de ids a notificar.
+    """
+    fired = []
+    for alert in alerts:
+        aqi = aqi_for_alert(alert)
+        if aqi is None:
+            continue
+        try:
+            limit = float(alert['aqi_limit'])
+        except (TypeError, ValueError):
+            continue
+        last = alert.get('last_notified_at')
+        if last:
+            try:
+                if now - datetime.fromisoformat(last) < timedelta(seconds=cooldown_seconds):
+                    continue
+            except Exception:
+                pass
+        if aqi > limit:
+            fired.append(alert['id'])
+    return fired
+
+
+class VectorEngine:
+    """
+    Ciclo vetorizado: carrega as colunas, busca uma leitura por célula (em
+    paralelo), calcula a máscara de uma vez e só então carrega os alertas
+    disparados para notificar.
+    load_columns() -> AlertColumns
+    load_alerts(ids) -> lista de dicts dos alertas
+    notify(alert, aqi) -> True se enviado/enfileirado
+    """
+
+    def __init__(self, load_columns, load_alerts, fetch, notify, cooldown_seconds,
+                 max_workers=DEFAULT_MAX_WORKERS):
+        self.load_columns = load_columns
+        self.load_alerts = load_alerts
+        self.fetch = fetch
+        self.notify = notify
+        self.cooldown_seconds = cooldown_seconds
+        self.max_workers = max(1, int(max_workers))
+        self.last_stats = None
+
+    def _fetch_cell(self, cell):
+        lat, lon = cell_center(cell)
+        try:
+            aqi = self.fetch(lat, lon)
+        except Exception as e:
+            logger.debug(f"Erro ao buscar AQI da célula {cell}: {e}")
+            return np.nan
+        return np.nan if aqi is None else float(aqi)
+
+    def run(self):
+        started = time.monotonic()
+        columns = self.load_columns()
+        cell_aqi = np.full(len(columns.cells), np.nan)
+        if columns.cells:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(columns.cells)),
+                                    thread_name_prefix='aqi-vector') as pool:
+                cell_aqi[:] = list(pool.map(self._fetch_cell, columns.cells))
+        evaluated_at = time.monotonic()
+        mask = evaluate_mask(columns, cell_aqi, time.time(), self.cooldown_seconds)
+        fired_idx = np.flatnonzero(mask)
+        # acima do limite mas ainda em cooldown
+        suppressed = int(np.count_nonzero(cell_aqi[columns.cell_idx] > columns.limits)) - len(fired_idx)
+        eval_seconds = time.monotonic() - evaluated_at
+        if suppressed:
+            NOTIFICATIONS.inc(suppressed, outcome='suppressed_cooldown')
+
+        aqi_by_id = dict(zip(columns.ids[fired_idx].tolist(), cell_aqi[columns.cell_idx[fired_idx]].tolist()))
+        notified = 0
+        for alert in self.load_alerts(list(aqi_by_id)):
+            aqi = aqi_by_id[alert['id']]
+            aqi = int(aqi) if aqi.is_integer() else aqi
+            try:
+                if self.notify(alert, aqi):
+                    notified += 1
+            except Exception as e:
+                logger.exception(f"Erro notificando alert id={alert.get('id')}: {e}")
+
+        stats = {
+            'alerts': len(columns),
+            'cells': len(columns.cells),
+            'fetches': len(columns.cells),
+            'fetches_saved': len(columns) - len(columns.cells),
+            'failed_fetches': int(np.isnan(cell_aqi).sum()),
+            'fired': int(len(fired_idx)),
+            'notified': notified,
+            'suppressed_by_cooldown': suppressed,
+            'eval_seconds': round(eval_seconds, 4),
+            'duration_seconds': round(time.monotonic() - started, 3),
+        }
+        self.last_stats = stats
+        return stats
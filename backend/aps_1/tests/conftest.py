@@ -0,0 +1,44 @@
+# tests/conftest.py
+# Os módulos do app importam uns aos outros como pacotes de topo
+# (services.*, routes.*, models): a raiz do backend entra no sys.path.
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# bancos auxiliares lidos no import dos módulos: fora da árvore do repositório
+_TMP = tempfile.mkdtemp(prefix='aps-tests-')
+for _name, _file in (('GEOCODE_DB_PATH', 'geocode_cache.sqlite'),
+                     ('AQI_HISTORY_DB_PATH', 'aqi_history.sqlite'),
+                     ('COORDINATION_DB_PATH', 'coordination.sqlite')):
+    os.environ.setdefault(_name, os.path.join(_TMP, _file))
+# nenhuma chamada real às APIs externas
+os.environ.setdefault('WAQI_BASE_URL', 'http://127.0.0.1:9')
+os.environ.setdefault('OPENAQ_BASE_URL', 'http://127.0.0.1:9')
+os.environ.setdefault('NOMINATIM_URL', 'http://127.0.0.1:9/search')
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App de create_app num site.db temporário, sem scheduler nem workers do outbox."""
+    from app import create_app
+    from services.http_cache import response_cache
+    from services.external_api import reading_cache
+
+    # as versões recomeçam do zero num banco novo: nada de bytes de outro teste
+    response_cache.clear()
+    reading_cache.invalidate()
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'site.db'),
+        'TESTING': True,
+        'START_SCHEDULER': False,
+        'START_OUTBOX_WORKERS': False,
+    })
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
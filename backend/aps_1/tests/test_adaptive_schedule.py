@@ -0,0 +1,116 @@
+import pytest
+
+from services.adaptive_schedule import AdaptiveSchedule
+
+BASE = 600
+MIN = 300
+MAX = 3600
+T0 = 1_000_000.0
+
+
+@pytest.fixture
+def schedule():
+    return AdaptiveSchedule(BASE, min_interval=MIN, max_interval=MAX)
+
+
+def test_invalid_bounds():
+    with pytest.raises(ValueError):
+        AdaptiveSchedule(BASE, min_interval=0, max_interval=MAX)
+    with pytest.raises(ValueError):
+        AdaptiveSchedule(BASE, min_interval=MAX, max_interval=MIN)
+
+
+def test_new_cells_are_due_immediately(schedule):
+    schedule.sync(['a', 'b'], T0)
+    assert sorted(schedule.due(T0)) == ['a', 'b']
+    # saem do heap até serem reagendadas
+    assert schedule.due(T0 + 1) == []
+
+
+def test_failed_fetch_uses_base_interval(schedule):
+    schedule.sync(['a'], T0)
+    schedule.due(T0)
+    assert schedule.reschedule('a', None, 100, None, T0) == BASE
+
+
+def test_interval_follows_headroom(schedule):
+    schedule.sync(['near', 'mid', 'far', 'over'], T0)
+    schedule.due(T0)
+    # no limite ou acima: intervalo mínimo
+    assert schedule.reschedule('over', 120, 100, None, T0) == MIN
+    # folga de 25% do limite = metade de FULL_HEADROOM_RATIO
+    assert schedule.reschedule('mid', 75, 100, None, T0) == pytest.approx(MIN + (MAX - MIN) * 0.5)
+    # folga >= 50% do limite: intervalo máximo
+    assert schedule.reschedule('far', 40, 100, None, T0) == MAX
+    near = schedule.reschedule('near', 99, 100, None, T0)
+    assert MIN <= near < schedule.reschedule('mid', 75, 100, None, T0 + 1)
+
+
+def test_rising_trend_shortens_interval(schedule):
+    schedule.sync(['a'], T0)
+    schedule.due(T0)
+    assert schedule.reschedule('a', 40, 100, None, T0) == MAX
+    # subiu 30 em 1000 s: cruza o limite em 1000 s, checa na metade
+    assert schedule.reschedule('a', 70, 100, None, T0 + 1000) == pytest.approx(500)
+    # queda não encurta: volta ao valor pela folga
+    stable = schedule.reschedule('a', 60, 100, None, T0 + 2000)
+    assert stable == pytest.approx(MIN + (MAX - MIN) * 0.8)
+
+
+def test_all_in_cooldown_waits_for_first_cooldown(schedule):
+    schedule.sync(['a', 'b', 'c'], T0)
+    schedule.due(T0)
+    assert schedule.reschedule('a', 150, None, T0 + 1800, T0) == 1800
+    assert schedule.reschedule('b', 150, None, None, T0) == MAX
+    # limitado aos extremos
+    assert schedule.reschedule('c', 150, None, T0 + 10, T0) == MIN
+
+
+def test_cooldown_end_caps_headroom_interval(schedule):
+    schedule.sync(['a'], T0)
+    schedule.due(T0)
+    assert schedule.reschedule('a', 10, 100, T0 + 900, T0) == 900
+
+
+def test_due_returns_cells_in_order(schedule):
+    schedule.sync(['a', 'b'], T0)
+    schedule.due(T0)
+    schedule.reschedule('a', 40, 100, None, T0)     # MAX
+    schedule.reschedule('b', 100, 100, None, T0)    # MIN
+    assert schedule.due(T0 + MIN - 1) == []
+    assert schedule.due(T0 + MIN) == ['b']
+    assert schedule.due(T0 + MAX) == ['a']
+
+
+def test_expedite_and_stale_heap_entries(schedule):
+    schedule.sync(['a'], T0)
+    schedule.due(T0)
+    schedule.reschedule('a', 40, 100, None, T0)
+    schedule.expedite('a', T0 + 10)
+    assert schedule.due(T0 + 10) == ['a']
+    schedule.reschedule('a', 40, 100, None, T0 + 10)
+    # a entrada antiga (T0 + MAX) é ignorada; só a nova vence
+    assert schedule.due(T0 + MAX) == []
+    assert schedule.due(T0 + 10 + MAX) == ['a']
+
+
+def test_removed_cells_are_forgotten(schedule):
+    schedule.sync(['a', 'b'], T0)
+    schedule.sync(['b'], T0 + 1)
+    assert len(schedule) == 1
+    assert schedule.due(T0 + 1) == ['b']
+    assert schedule.reschedule('a', 40, 100, None, T0 + 1) is None
+
+
+def test_stats_counts_saved_fetches(schedule):
+    schedule.sync(['a', 'b'], T0)
+    for cell in schedule.due(T0):
+        schedule.reschedule(cell, 10, 100, None, T0)
+    schedule.sync(['a', 'b'], T0 + MAX)
+    stats = schedule.stats(T0 + MAX)
+    # intervalo fixo: 2 buscas iniciais + 2 células * MAX / BASE
+    assert stats['fixed_interval_fetches'] == 2 + 2 * MAX // BASE
+    assert stats['fetches'] == 2
+    assert stats['fetches_saved'] == stats['fixed_interval_fetches'] - 2
+    assert stats['interval_seconds'] == {'min': MAX, 'median': MAX, 'max': MAX}
+    assert stats['next_due_in_seconds'] == 0.0
@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from routes import alerts
+from services.alerts_store import AlertStore
+from services.coordination import exclusive_lock
+
+
+def _alert(i, **extra):
+    return dict({'user_id': 1, 'location': f'l{i}', 'lat': -23.5, 'lon': -46.6, 'aqi_limit': 100,
+                 'device_token': f't{i}'}, **extra)
+
+
+def _legacy_db(path, rows):
+    legacy = AlertStore(str(path))
+    legacy.init_schema()
+    ids = [legacy.insert(row) for row in rows]
+    legacy.connection().close()
+    return ids
+
+
+def test_merge_keeps_free_ids_and_remaps_collisions(tmp_path):
+    legacy_ids = _legacy_db(tmp_path / 'legacy.sqlite', [_alert(i) for i in range(3)])
+    store = AlertStore(str(tmp_path / 'main.sqlite'))
+    store.init_schema()
+    existing = store.insert(_alert(99, location='outro'))   # ocupa o id 1
+    merged, remapped = store.merge_from(str(tmp_path / 'legacy.sqlite'))
+    assert merged == 3
+    assert list(remapped) == [existing]
+    rows = {a['id']: a['location'] for a in store.fetch_all()}
+    assert rows[existing] == 'outro'
+    assert rows[remapped[existing]] == 'l0'
+    assert rows[legacy_ids[1]] == 'l1' and rows[legacy_ids[2]] == 'l2'
+    # repetir a migração não duplica nada
+    assert store.merge_from(str(tmp_path / 'legacy.sqlite')) == (0, {})
+    assert len(store.fetch_all()) == 4
+
+
+def test_merge_refuses_missing_file(tmp_path):
+    store = AlertStore(str(tmp_path / 'main.sqlite'))
+    store.init_schema()
+    with pytest.raises(FileNotFoundError):
+        store.merge_from(str(tmp_path / 'sumiu.sqlite'))
+    assert not (tmp_path / 'sumiu.sqlite').exists()
+
+
+def test_init_alerts_migrates_once_and_keeps_backup(app, tmp_path, monkeypatch):
+    legacy = tmp_path / 'alerts.sqlite'
+    monkeypatch.setattr(alerts, 'DB_PATH', str(legacy))
+    _legacy_db(legacy, [_alert(0)])
+    (tmp_path / 'alerts.sqlite.migrated').write_bytes(b'backup anterior')
+    alerts.init_alerts(app, start_scheduler=False)
+    assert not legacy.exists()
+    assert (tmp_path / 'alerts.sqlite.migrated').read_bytes() == b'backup anterior'
+    assert len(list(tmp_path.glob('alerts.sqlite.migrated.*'))) == 1
+    assert [a['location'] for a in alerts.store.fetch_all()] == ['l0']
+    # segundo boot: nada a migrar
+    alerts.init_alerts(app, start_scheduler=False)
+    assert len(alerts.store.fetch_all()) == 1
+
+
+def test_fetch_by_ids_uses_primary_keys(client):
+    client.post('/usuarios', json={'nome': 'u', 'device_token': 'tok'})
+    loc = client.post('/enderecos', json={'id_usuario': 1, 'nome_local': 'casa',
+                                          'latitude': -23.5, 'longitude': -46.6}).get_json()['id_localizacao']
+    alert_id = alerts.insert_alert(_alert(0))
+    store = alerts.store
+    assert store.unified
+    found = {a['id']: a for a in store.fetch_by_ids([alert_id, -loc, 12345])}
+    assert set(found) == {alert_id, -loc}
+    assert found[-loc]['device_token'] == 'tok'
+    # token invalidado: fetch_by_ids ainda acha, fetch_active_by_ids não
+    store.mark_tokens_invalid(['tok'])
+    assert [a['id'] for a in store.fetch_by_ids([-loc])] == [-loc]
+    assert store.fetch_active_by_ids([-loc]) == []
+
+    # as consultas geradas usam as chaves primárias, sem varrer a view
+    conn = store.connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        store.fetch_by_ids([alert_id, -loc])
+    finally:
+        conn.set_trace_callback(None)
+    assert len(statements) == 2
+    for sql in statements:
+        plan = ' '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql))
+        assert 'alert_sources' not in sql
+        assert 'SCAN' not in plan, plan
+
+def test_exclusive_lock_serializes(tmp_path):
+    path = str(tmp_path / 'boot.lock')
+    inside, overlaps = [], []
+
+    def boot():
+        with exclusive_lock(path, timeout=10):
+            if inside:
+                overlaps.append(1)
+            inside.append(1)
+            time.sleep(0.05)
+            inside.pop()
+
+    threads = [threading.Thread(target=boot) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not overlaps
+    # a trava não deixa transação aberta no arquivo
+    sqlite3.connect(path, timeout=0).execute('BEGIN EXCLUSIVE').execute('ROLLBACK')
@@ -0,0 +1,50 @@
+import threading
+import time
+
+from services.async_engine import AsyncCheckEngine
+
+
+def _alerts(n, cells=1):
+    return [{'id': i, 'lat': -23.5 + (i % cells), 'lon': -46.6} for i in range(n)]
+
+
+def test_cycle_applies_reading_to_every_alert():
+    applied = []
+    engine = AsyncCheckEngine(fetch=lambda lat, lon: 120, apply=lambda a, aqi: applied.append(a['id']) or True,
+                              concurrency=4)
+    stats = engine.run(_alerts(10, cells=3))
+    assert sorted(applied) == list(range(10))
+    assert stats['fetches'] == 3
+    assert stats['notified'] == stats['evaluated'] == 10
+    assert not stats['deadline_exceeded']
+
+
+def test_failed_fetch_skips_cell():
+    engine = AsyncCheckEngine(fetch=lambda lat, lon: None, apply=lambda a, aqi: True)
+    stats = engine.run(_alerts(3))
+    assert stats['failed_fetches'] == 1
+    assert stats['evaluated'] == 0
+
+
+def test_deadline_waits_for_started_applies_and_discards_the_rest():
+    started, finished = [], []
+    lock = threading.Lock()
+
+    def apply(alert, aqi):
+        with lock:
+            started.append(alert['id'])
+        time.sleep(0.2)
+        with lock:
+            finished.append(alert['id'])
+        return True
+
+    engine = AsyncCheckEngine(fetch=lambda lat, lon: 120, apply=apply, concurrency=2, deadline_seconds=0.05)
+    stats = engine.run(_alerts(10))
+    # nada fica rodando depois do retorno (o chamador faz o flush do lote)
+    with lock:
+        snapshot = (list(started), list(finished))
+    time.sleep(0.3)
+    assert started == snapshot[0]
+    assert sorted(snapshot[0]) == sorted(snapshot[1])
+    assert len(started) < 10
+    assert stats['deadline_exceeded']
@@ -0,0 +1,115 @@
+import json
+import sqlite3
+import uuid
+
+from sqlalchemy.exc import OperationalError
+
+from routes import alerts
+from services import geocoding
+from services.bulk import BULK_CHUNK_ERROR
+
+
+def _alert(i):
+    return {'user_id': 1, 'location': f'l{i}', 'lat': -23.5, 'lon': -46.6, 'aqi_limit': 100, 'device_token': 't'}
+
+
+def test_alerts_bulk_partial_failure(client):
+    records = [_alert(0), {'user_id': 1}, 'texto', _alert(3), dict(_alert(4), lat='norte')]
+    resp = client.post('/alerts/bulk', json={'records': records})
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert (body['total'], body['created'], body['failed']) == (5, 2, 3)
+    statuses = [item['status'] for item in body['results']]
+    assert statuses == ['created', 'error', 'error', 'created', 'error']
+    assert [item['index'] for item in body['results']] == list(range(5))
+    created = [item['id'] for item in body['results'] if item['status'] == 'created']
+    assert [a['location'] for a in alerts.store.fetch_by_ids(created)] == ['l0', 'l3']
+
+
+def test_alerts_bulk_ndjson_bad_line(client):
+    body = '\n'.join([json.dumps(_alert(0)), '{quebrado', '', json.dumps(_alert(2))])
+    resp = client.post('/alerts/bulk', data=body, content_type='application/x-ndjson')
+    result = resp.get_json()
+    assert (result['total'], result['created'], result['failed']) == (3, 2, 1)
+    assert result['results'][1]['error'].startswith('linha inválida')
+
+
+def test_bulk_rejects_empty_or_malformed_body(client):
+    assert client.post('/alerts/bulk', json=[]).status_code == 400
+    assert client.post('/alerts/bulk', json={'foo': 1}).status_code == 400
+
+
+def test_enderecos_bulk_geocodes_each_address_once(client, app, monkeypatch):
+    calls = []
+
+    def fake_query(address):
+        calls.append(address)
+        return ('-23.5', '-46.6') if 'existe' in address.lower() else (None, None)
+
+    monkeypatch.setattr(geocoding, '_query_nominatim', fake_query)
+    app.config['BULK_MAX_GEOCODE_LOOKUPS'] = 2
+    tag = uuid.uuid4().hex   # o cache de geocodificação é compartilhado entre testes
+    records = [
+        {'id_usuario': 1, 'nome_local': 'a', 'endereco': f'Rua Existe {tag}'},
+        {'id_usuario': 1, 'nome_local': 'b', 'endereco': f'rua existe {tag}'},      # mesma chave
+        {'id_usuario': 1, 'nome_local': 'c', 'endereco': f'Lugar Nenhum {tag}'},
+        {'id_usuario': 1, 'nome_local': 'd', 'endereco': f'Rua Existe Outra {tag}'},  # além do limite
+        {'id_usuario': 1, 'nome_local': 'e', 'latitude': -22.9, 'longitude': -43.2},
+        {'nome_local': 'f'},
+    ]
+    result = client.post('/enderecos/bulk', json=records).get_json()
+    statuses = [item['status'] for item in result['results']]
+    assert statuses == ['created', 'created', 'error', 'error', 'created', 'error']
+    assert len(calls) == 2
+    assert 'reenvie' in result['results'][3]['error']
+    assert result['results'][2]['error'] == 'Endereço inválido ou não encontrado'
+    listed = client.get('/enderecos?user_id=1').get_json()
+    assert sorted(e['nome_local'] for e in listed) == ['a', 'b', 'e']
+
+
+def test_alerts_bulk_failed_chunk_reports_its_records(client, monkeypatch):
+    monkeypatch.setattr(alerts, 'BULK_CHUNK_SIZE', 2)
+    insert_many = alerts.store.insert_many
+    calls = []
+
+    def flaky_insert(rows, chunk_size=1000):
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise sqlite3.OperationalError('database is locked')
+        return insert_many(rows, chunk_size=chunk_size)
+
+    monkeypatch.setattr(alerts.store, 'insert_many', flaky_insert)
+    resp = client.post('/alerts/bulk', json=[_alert(i) for i in range(5)])
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert calls == [2, 2, 1]
+    assert (body['created'], body['failed']) == (3, 2)
+    statuses = [item['status'] for item in body['results']]
+    assert statuses == ['created', 'created', 'error', 'error', 'created']
+    assert body['results'][2]['error'] == BULK_CHUNK_ERROR
+    # os blocos gravados continuam no banco, com os ids informados
+    created = [item['id'] for item in body['results'] if item['status'] == 'created']
+    assert [a['location'] for a in alerts.store.fetch_by_ids(created)] == ['l0', 'l1', 'l4']
+
+
+def test_enderecos_bulk_failed_chunk_reports_its_records(client, monkeypatch):
+    from models import db
+    from routes import enderecos
+
+    monkeypatch.setattr(enderecos, 'BULK_CHUNK_SIZE', 2)
+    commit = db.session.commit
+    calls = []
+
+    def flaky_commit():
+        calls.append(1)
+        if len(calls) == 2:
+            raise OperationalError('COMMIT', {}, sqlite3.OperationalError('database is locked'))
+        commit()
+
+    monkeypatch.setattr(db.session, 'commit', flaky_commit)
+    records = [{'id_usuario': 7, 'nome_local': f'n{i}', 'latitude': -22.9, 'longitude': -43.2} for i in range(5)]
+    body = client.post('/enderecos/bulk', json=records).get_json()
+    monkeypatch.undo()
+    assert [item['status'] for item in body['results']] == ['created', 'created', 'error', 'error', 'created']
+    listed = client.get('/enderecos?user_id=7').get_json()
+    assert sorted(e['nome_local'] for e in listed) == ['n0', 'n1', 'n4']
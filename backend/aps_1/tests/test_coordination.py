@@ -0,0 +1,72 @@
+import pytest
+
+from services.coordination import Coordinator, shard_of
+
+TTL = 60
+T0 = 1_000_000.0
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / 'coordination.sqlite')
+
+
+def _worker(db, name, mode='leader', shards=4):
+    return Coordinator(path=db, mode=mode, shards=shards, lease_ttl=TTL, worker_id=name)
+
+
+def test_single_leader(db):
+    a, b = _worker(db, 'a'), _worker(db, 'b')
+    assert a.heartbeat(now=T0) == {0}
+    assert b.heartbeat(now=T0 + 1) == frozenset()
+    # renovação mantém a liderança
+    assert a.heartbeat(now=T0 + 20) == {0}
+    assert b.heartbeat(now=T0 + 21) == frozenset()
+
+
+def test_expired_lease_is_taken_over(db):
+    a, b = _worker(db, 'a'), _worker(db, 'b')
+    a.heartbeat(now=T0)
+    # 'a' parou de renovar: a lease vence em T0 + TTL
+    assert b.heartbeat(now=T0 + TTL - 1) == frozenset()
+    assert b.heartbeat(now=T0 + TTL + 1) == {0}
+    # a posse local de 'a' também vence: não checa em dobro se voltar
+    assert a.owned_shards(now=T0 + TTL + 1) == frozenset()
+    assert a.heartbeat(now=T0 + TTL + 2) == frozenset()
+
+
+def test_release_hands_over_without_waiting(db):
+    a, b = _worker(db, 'a'), _worker(db, 'b')
+    a.heartbeat(now=T0)
+    a.release()
+    assert a.owned_shards(now=T0 + 1) == frozenset()
+    assert b.heartbeat(now=T0 + 1) == {0}
+
+
+def test_shards_split_fairly_and_rebalance(db):
+    a, b = _worker(db, 'a', 'shards'), _worker(db, 'b', 'shards')
+    assert a.heartbeat(now=T0) == {0, 1, 2, 3}
+    b.heartbeat(now=T0 + 1)
+    # 'a' devolve o excedente no heartbeat seguinte e 'b' assume
+    assert len(a.heartbeat(now=T0 + 2)) == 2
+    owned_b = b.heartbeat(now=T0 + 3)
+    assert len(owned_b) == 2
+    assert a.owned_shards(now=T0 + 3).isdisjoint(owned_b)
+    # 'b' morre: 'a' volta a ter todos depois do TTL
+    assert a.heartbeat(now=T0 + 3 + TTL + 1) == {0, 1, 2, 3}
+
+
+def test_off_mode_owns_everything(db):
+    c = _worker(db, 'c', 'off')
+    assert c.heartbeat() == {0, 1, 2, 3}
+    assert c.owns((-23.5, -46.6))
+
+
+def test_shard_of_is_stable():
+    assert shard_of((-23.5, -46.6), 8) == shard_of((-23.5, -46.6), 8)
+    assert 0 <= shard_of('6gycf', 8) < 8
+
+
+def test_invalid_mode(db):
+    with pytest.raises(ValueError):
+        Coordinator(path=db, mode='cluster')
@@ -0,0 +1,108 @@
+import pytest
+import requests
+
+from services.external_api import UpstreamClient, _HostStats
+
+URL = 'http://upstream.test/feed'
+HOST = 'upstream.test'
+
+
+def _response(status):
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = b'{}'
+    resp._content_consumed = True
+    resp.url = URL
+    return resp
+
+
+class _FakeSession:
+    """Devolve (ou levanta) os resultados programados, um por chamada."""
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return _response(result)
+
+
+def _client(results, max_retries=2):
+    # backoff zerado: as tentativas não dormem
+    client = UpstreamClient(max_retries=max_retries, backoff_base=0, backoff_max=0)
+    session = _FakeSession(results)
+    client._sessions[HOST] = session
+    client._stats[HOST] = _HostStats()
+    return client, session
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_retryable_status_then_success(status):
+    client, session = _client([status, 200])
+    assert client.get(URL).status_code == 200
+    assert session.calls == 2
+    stats = client.stats()[HOST]
+    assert (stats['requests'], stats['errors'], stats['retries']) == (2, 1, 1)
+
+
+def test_connection_error_is_retried():
+    client, session = _client([requests.ConnectionError('recusada'), requests.Timeout('lento'), 200])
+    assert client.get(URL).status_code == 200
+    assert session.calls == 3
+    assert client.stats()[HOST]['retries'] == 2
+
+
+def test_gives_up_after_retries():
+    client, session = _client([503, 503, 503])
+    with pytest.raises(requests.HTTPError) as info:
+        client.get(URL)
+    assert info.value.response.status_code == 503
+    assert session.calls == 3
+    stats = client.stats()[HOST]
+    # a última falha não conta como retry
+    assert (stats['requests'], stats['errors'], stats['retries']) == (3, 3, 2)
+
+
+def test_connection_error_after_retries_propagates():
+    client, session = _client([requests.ConnectionError('recusada')] * 2, max_retries=1)
+    with pytest.raises(requests.ConnectionError):
+        client.get(URL)
+    assert session.calls == 2
+
+
+def test_client_error_is_final():
+    client, session = _client([404, 200])
+    with pytest.raises(requests.HTTPError):
+        client.get(URL)
+    assert session.calls == 1
+    stats = client.stats()[HOST]
+    assert (stats['requests'], stats['errors'], stats['retries']) == (1, 1, 0)
+
+
+def test_latency_stats():
+    client, _ = _client([200, 200, 200])
+    for _ in range(3):
+        client.get(URL)
+    stats = client.stats()[HOST]
+    assert stats['requests'] == 3
+    assert stats['errors'] == 0
+    assert stats['mean_seconds'] is not None
+    assert stats['p50_seconds'] <= stats['p99_seconds'] <= stats['max_seconds']
+    assert stats['provider'] == HOST
+
+
+def test_registered_provider_opens_circuit():
+    client, session = _client([500, 500, 500])
+    client.failure_threshold = 1
+    client.register_provider(URL, 'teste')
+    with pytest.raises(requests.HTTPError):
+        client.get(URL)
+    assert client.stats()[HOST]['circuit']['state'] == 'open'
+    with pytest.raises(requests.RequestException):
+        client.get(URL)
+    # circuito aberto: nem chega à sessão
+    assert session.calls == 3
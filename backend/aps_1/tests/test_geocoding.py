@@ -0,0 +1,57 @@
+import sqlite3
+import time
+
+import pytest
+
+from services import geocoding
+
+
+@pytest.fixture
+def geocode_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(geocoding, 'GEOCODE_DB_PATH', str(tmp_path / 'geocode.sqlite'))
+    monkeypatch.setattr(geocoding, '_db_ready', False)
+    return tmp_path / 'geocode.sqlite'
+
+
+def test_rate_limiter_is_shared_through_the_database(geocode_db):
+    # duas instâncias = dois processos: o estado fica só no banco
+    first, second = geocoding.RateLimiter(0.1), geocoding.RateLimiter(0.1)
+    started = time.monotonic()
+    for limiter in (first, second, first, second):
+        limiter.acquire()
+    assert time.monotonic() - started >= 0.3 - 0.02
+
+
+def test_rate_limiter_disabled_with_zero_interval(geocode_db):
+    geocoding.RateLimiter(0).acquire()
+    assert not geocode_db.exists()
+
+
+def test_cache_roundtrip_closes_connections(geocode_db, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+
+    class Tracked(sqlite3.Connection):
+        closed = False
+
+        def close(self):
+            self.closed = True
+            super().close()
+
+    def tracked_connect(*args, **kwargs):
+        conn = connect(*args, factory=Tracked, **kwargs)
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(geocoding.sqlite3, 'connect', tracked_connect)
+    geocoding._cache_put('rua a, 1', '-23.5', '-46.6')
+    geocoding._cache_put('lugar nenhum', None, None)
+    assert geocoding._cache_get('rua a, 1') == ('-23.5', '-46.6')
+    assert geocoding._cache_get_many(['rua a, 1', 'lugar nenhum', 'outra']) == {
+        'rua a, 1': ('-23.5', '-46.6'), 'lugar nenhum': (None, None)}
+    assert geocoding.cache_stats()['entries'] == 2
+    assert opened and all(conn.closed for conn in opened)
+
+
+def test_normalize_address():
+    assert geocoding.normalize_address('  Avenida  Paulista ,1000, SÃO Paulo ') == 'avenida paulista, 1000, sao paulo'
@@ -0,0 +1,76 @@
+import gzip
+
+import pytest
+from flask import Flask
+
+from services.http_cache import ResponseCache, cached_json_response
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache()
+
+
+@pytest.fixture
+def client(cache):
+    app = Flask(__name__)
+    state = {'version': 1, 'builds': 0}
+
+    @app.route('/items/<int:size>')
+    def items(size):
+        def build():
+            state['builds'] += 1
+            return {'version': state['version'], 'items': ['x' * 10] * size}
+        return cached_json_response(('items', size), state['version'], build, cache=cache)
+
+    client = app.test_client()
+    client.state = state
+    return client
+
+
+def test_etag_and_not_modified(client, cache):
+    first = client.get('/items/1')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.headers['Vary'] == 'Accept-Encoding'
+    again = client.get('/items/1', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == etag
+    assert client.state['builds'] == 1
+    assert cache.stats()['not_modified'] == 1
+
+
+def test_new_version_changes_etag(client):
+    etag = client.get('/items/1').headers['ETag']
+    client.state['version'] = 2
+    resp = client.get('/items/1', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    assert resp.get_json()['version'] == 2
+
+
+def test_gzip_has_its_own_etag(client, cache):
+    plain = client.get('/items/100')
+    gz = client.get('/items/100', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in plain.headers
+    assert gz.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gz.data) == plain.data
+    assert gz.headers['ETag'] == plain.headers['ETag'][:-1] + '-gz"'
+    assert cache.stats()['gzip'] == 1
+
+
+def test_either_etag_revalidates(client):
+    plain_etag = client.get('/items/100').headers['ETag']
+    gz_etag = client.get('/items/100', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+    # o 304 leva o ETag da representação negociada na revalidação
+    resp = client.get('/items/100', headers={'If-None-Match': plain_etag, 'Accept-Encoding': 'gzip'})
+    assert (resp.status_code, resp.headers['ETag']) == (304, gz_etag)
+    resp = client.get('/items/100', headers={'If-None-Match': gz_etag})
+    assert (resp.status_code, resp.headers['ETag']) == (304, plain_etag)
+
+
+def test_small_body_is_not_compressed(client):
+    resp = client.get('/items/1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in resp.headers
+    assert not resp.headers['ETag'].endswith('-gz"')
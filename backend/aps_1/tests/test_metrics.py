@@ -0,0 +1,74 @@
+import pytest
+
+from services.metrics import Registry
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter_help_and_type_match_samples(registry):
+    counter = registry.counter('aps_teste', 'Contador de teste.', ('outcome',))
+    counter.inc(outcome='sent')
+    counter.inc(2, outcome='sent')
+    counter.inc(outcome='failed')
+    assert registry.render().splitlines() == [
+        '# HELP aps_teste_total Contador de teste.',
+        '# TYPE aps_teste_total counter',
+        'aps_teste_total{outcome="failed"} 1',
+        'aps_teste_total{outcome="sent"} 3',
+    ]
+    assert counter.value(outcome='sent') == 3
+    with pytest.raises(ValueError):
+        counter.inc(-1, outcome='sent')
+    with pytest.raises(ValueError):
+        counter.inc(kind='x')
+
+
+def test_gauge_and_label_escaping(registry):
+    gauge = registry.gauge('aps_nivel', 'Nível.', ('name',))
+    gauge.set(1.5, name='a"b\\c\nd')
+    gauge.set(2.0, name='x')
+    assert registry.render().splitlines() == [
+        '# HELP aps_nivel Nível.',
+        '# TYPE aps_nivel gauge',
+        'aps_nivel{name="a\\"b\\\\c\\nd"} 1.5',
+        'aps_nivel{name="x"} 2',
+    ]
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = registry.histogram('aps_duracao', 'Duração.', buckets=(1, 5))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value)
+    assert registry.render().splitlines() == [
+        '# HELP aps_duracao Duração.',
+        '# TYPE aps_duracao histogram',
+        'aps_duracao_bucket{le="1"} 2',
+        'aps_duracao_bucket{le="5"} 3',
+        'aps_duracao_bucket{le="+Inf"} 4',
+        'aps_duracao_sum 14.5',
+        'aps_duracao_count 4',
+    ]
+
+
+def test_register_is_idempotent(registry):
+    first = registry.counter('aps_x', 'X.')
+    assert registry.counter('aps_x', 'X.') is first
+
+
+def test_metrics_endpoint(client):
+    from services.metrics import NOTIFICATIONS
+
+    NOTIFICATIONS.inc(0, outcome='sent')
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    assert resp.content_type == 'text/plain; version=0.0.4; charset=utf-8'
+    text = resp.get_data(as_text=True)
+    assert '# TYPE aps_notifications_total counter' in text
+    assert 'aps_notifications_total{outcome="sent"}' in text
+    # toda linha TYPE nomeia uma família com amostras de mesmo prefixo
+    for line in text.splitlines():
+        if line.startswith('# TYPE') and line.endswith(' counter'):
+            assert line.split()[2].endswith('_total')
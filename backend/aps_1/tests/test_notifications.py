@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+from firebase_admin import messaging
+
+from routes import alerts
+from services import notifications
+from services.notifications import FCM_MAX_BATCH, NotificationBatch, _SendResponse
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """send_each falso: token 'gone' é permanente, 'flaky' é falha temporária."""
+    calls = []
+
+    def send_each(messages):
+        calls.append(len(messages))
+        responses = []
+        for message in messages:
+            if message.token == 'gone':
+                responses.append(_SendResponse(exception=messaging.UnregisteredError('app removido')))
+            elif message.token == 'flaky':
+                responses.append(_SendResponse(exception=RuntimeError('indisponível')))
+            else:
+                responses.append(_SendResponse(message_id=f'ok-{message.token}'))
+        return responses
+
+    monkeypatch.setattr(notifications, '_send_each', send_each)
+    return calls
+
+
+def test_chunks_of_fcm_max_batch(sent):
+    batch = NotificationBatch()
+    total = 2 * FCM_MAX_BATCH + 1
+    for i in range(total):
+        batch.add(i, f't{i}', 'titulo', 'corpo')
+    result = batch.flush()
+    assert sorted(sent) == [1, FCM_MAX_BATCH, FCM_MAX_BATCH]
+    assert sorted(result.sent) == list(range(total))
+    assert len(batch) == 0
+    # lote vazio não chama o FCM
+    assert batch.flush().stats() == {'sent': 0, 'failed': 0, 'invalid_tokens': 0}
+    assert len(sent) == 3
+
+
+def test_chunks_are_sent_in_parallel(monkeypatch):
+    barrier = threading.Barrier(3, timeout=2)
+
+    def send_each(messages):
+        barrier.wait()   # quebra (BrokenBarrierError) se os lotes forem sequenciais
+        return [_SendResponse(message_id='ok') for _ in messages]
+
+    monkeypatch.setattr(notifications, '_send_each', send_each)
+    batch = NotificationBatch(batch_size=2, flush_workers=3)
+    for i in range(6):
+        batch.add(i, f't{i}', 'titulo', 'corpo')
+    assert len(batch.flush().sent) == 6
+
+
+def test_results_split_per_token(sent):
+    batch = NotificationBatch()
+    for key, token in ((1, 'a'), (2, 'gone'), (3, 'flaky'), (4, 'b')):
+        batch.add(key, token, 'titulo', 'corpo')
+    result = batch.flush()
+    assert sorted(result.sent) == [1, 4]
+    assert sorted(result.failed) == [2, 3]
+    assert result.invalid_tokens == {'gone'}
+
+
+def test_chunk_error_fails_every_key(monkeypatch):
+    def send_each(messages):
+        raise RuntimeError('FCM fora do ar')
+
+    monkeypatch.setattr(notifications, '_send_each', send_each)
+    batch = NotificationBatch(batch_size=2)
+    for i in range(3):
+        batch.add(i, f't{i}', 'titulo', 'corpo')
+    result = batch.flush()
+    assert (result.sent, sorted(result.failed), result.invalid_tokens) == ([], [0, 1, 2], set())
+
+
+def test_cycle_marks_invalid_tokens(app, sent, monkeypatch):
+    monkeypatch.setattr(alerts, 'fetch_aqi_for_coords', lambda lat, lon, **kwargs: 200)
+    ids = {}
+    for token in ('ok', 'gone', 'flaky'):
+        ids[token] = alerts.insert_alert({'user_id': 1, 'location': token, 'lat': -23.5, 'lon': -46.6,
+                                          'aqi_limit': 100, 'device_token': token})
+    stats = alerts.run_periodic_check(app)
+    assert stats['notifications'] == {'sent': 1, 'failed': 2, 'invalid_tokens': 1}
+    rows = dict(((row[0], row[1:]) for row in alerts.store.connection().execute(
+        'SELECT id, last_notified_at, token_invalid FROM alerts')))
+    assert rows[ids['ok']][0] is not None
+    assert rows[ids['gone']] == (None, 1)
+    assert rows[ids['flaky']] == (None, 0)
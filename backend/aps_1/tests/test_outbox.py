@@ -0,0 +1,123 @@
+import logging
+
+import pytest
+
+from routes import alerts
+from services.outbox import Outbox, OutboxWorkers
+
+T0 = 1_000_000.0
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    box = Outbox(str(tmp_path / 'outbox.sqlite'), visibility_timeout=60, max_attempts=3,
+                 backoff_base=10, backoff_max=100)
+    box.init_schema()
+    return box
+
+
+def _enqueue(outbox, kind, payload, now):
+    conn = outbox.connection()
+    return conn.execute('INSERT INTO outbox (kind, payload, available_at, created_at) VALUES (?, ?, ?, ?)',
+                        (kind, '{"n": %d}' % payload, now, now)).lastrowid
+
+
+def test_claim_in_order_and_only_once(outbox):
+    first = _enqueue(outbox, 'a', 1, T0)
+    second = _enqueue(outbox, 'a', 2, T0 + 1)
+    assert outbox.claim('w1', now=T0 + 2) == (first, 'a', {'n': 1}, 1)
+    assert outbox.claim('w2', now=T0 + 2) == (second, 'a', {'n': 2}, 1)
+    assert outbox.claim('w3', now=T0 + 2) is None
+    outbox.complete(first)
+    assert outbox.stats(now=T0 + 2)['running'] == 1
+
+
+def test_expired_claim_is_reclaimed(outbox):
+    job = _enqueue(outbox, 'a', 1, T0)
+    outbox.claim('w1', now=T0)
+    # o worker morreu: o job volta a ser reservável quando o prazo vence
+    assert outbox.claim('w2', now=T0 + 59) is None
+    assert outbox.claim('w2', now=T0 + 60) == (job, 'a', {'n': 1}, 2)
+
+
+def test_expired_claims_stop_at_max_attempts(outbox):
+    job = _enqueue(outbox, 'a', 1, T0)
+    now = T0
+    # o worker trava em todas as tentativas: só o prazo de reserva vence
+    for attempt in (1, 2, 3):
+        assert outbox.claim('w', now=now) == (job, 'a', {'n': 1}, attempt)
+        now += 60
+    assert outbox.claim('w', now=now) is None
+    row = outbox.connection().execute('SELECT status, attempts, locked_by FROM outbox WHERE id = ?',
+                                      (job,)).fetchone()
+    assert row == ('dead', 3, None)
+    assert outbox.claim('w', now=now + 10_000) is None
+
+
+def test_retry_backoff_then_dead(outbox):
+    job = _enqueue(outbox, 'a', 1, T0)
+    now = T0
+    for attempt, delay in ((1, 10), (2, 20)):
+        assert outbox.claim('w', now=now)[3] == attempt
+        assert outbox.fail(job, attempt, RuntimeError('falhou'), now=now) == 'pending'
+        available_at = outbox.connection().execute(
+            'SELECT available_at FROM outbox WHERE id = ?', (job,)).fetchone()[0]
+        assert now + delay / 2 <= available_at <= now + delay
+        assert outbox.claim('w', now=available_at - 0.001) is None
+        now = available_at
+    assert outbox.claim('w', now=now)[3] == 3
+    assert outbox.fail(job, 3, RuntimeError('de novo'), now=now) == 'dead'
+    # job morto não é mais reservado, mas continua para inspeção
+    assert outbox.claim('w', now=now + 10_000) is None
+    stats = outbox.stats(now=now)
+    assert (stats['dead'], stats['depth']) == (1, 0)
+    assert outbox.connection().execute('SELECT last_error FROM outbox WHERE id = ?', (job,)).fetchone()[0] == 'de novo'
+
+
+def test_workers_run_once(outbox):
+    done = []
+
+    def boom(payload):
+        raise RuntimeError('upstream')
+
+    workers = OutboxWorkers(outbox, {'ok': done.append, 'boom': boom}, workers=1)
+    outbox.enqueue('ok', {'n': 1})
+    outbox.enqueue('boom', {'n': 2})
+    outbox.enqueue('desconhecido', {'n': 3})
+    assert workers.run_once()
+    assert done == [{'n': 1}]
+    assert workers.run_once()
+    assert workers.run_once()
+    assert not workers.run_once()
+    stats = outbox.stats()
+    assert stats['pending'] == 2
+    assert stats['by_kind']['boom'] == {'pending': 1}
+    assert stats['by_kind']['desconhecido'] == {'pending': 1}
+
+
+def test_create_app_starts_outbox_workers_on_request(tmp_path, monkeypatch):
+    import app as app_module
+
+    started = []
+    monkeypatch.setattr(app_module, 'start_outbox_workers', started.append)
+    monkeypatch.setitem(app_module.DEFAULT_CONFIG, 'START_OUTBOX_WORKERS', False)
+    uri = 'sqlite:///' + str(tmp_path / 'site.db')
+    # sem pedir, create_app não cria threads em segundo plano
+    app_module.create_app({'SQLALCHEMY_DATABASE_URI': uri})
+    assert started == []
+    # pedido explícito, mesmo sem START_SCHEDULER
+    flask_app = app_module.create_app({'SQLALCHEMY_DATABASE_URI': uri, 'START_SCHEDULER': False,
+                                       'START_OUTBOX_WORKERS': True})
+    assert started == [flask_app]
+
+
+def test_enqueue_without_consumer_warns(client, monkeypatch, caplog):
+    monkeypatch.setattr(alerts, '_outbox_workers', None)
+    monkeypatch.setattr(alerts, '_warned_no_outbox_consumer', False)
+    alert = {'user_id': 1, 'location': 'l', 'lat': -23.5, 'lon': -46.6, 'aqi_limit': 100, 'device_token': 't'}
+    with caplog.at_level(logging.WARNING):
+        assert client.post('/alerts', json=alert).status_code == 201
+        assert client.post('/alerts', json=alert).status_code == 201
+    warnings = [r for r in caplog.records if 'sem workers' in r.getMessage()]
+    assert len(warnings) == 1
+    assert alerts.outbox.stats()['by_kind']['alert_check'] == {'pending': 2}
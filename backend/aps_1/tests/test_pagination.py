@@ -0,0 +1,63 @@
+import json
+
+from routes import alerts
+
+
+def _add_alerts(n, user_id=1):
+    return [alerts.insert_alert({'user_id': user_id, 'location': f'l{i}', 'lat': -23.5, 'lon': -46.6,
+                                 'aqi_limit': 100, 'device_token': 't'}) for i in range(n)]
+
+
+def test_keyset_pages_cover_every_alert_once(client):
+    ids = _add_alerts(7)
+    seen, after = [], None
+    while True:
+        url = '/alerts?limit=3' + (f'&after_id={after}' if after is not None else '')
+        resp = client.get(url)
+        assert resp.status_code == 200
+        page = resp.get_json()
+        seen += [a['id'] for a in page]
+        after = resp.headers.get('X-Next-After-Id')
+        if after is None:
+            break
+        assert int(after) == page[-1]['id']
+    assert seen == ids
+
+
+def test_page_is_stable_under_inserts(client):
+    ids = _add_alerts(4)
+    first = client.get('/alerts?limit=2')
+    _add_alerts(1)
+    second = client.get(f"/alerts?limit=2&after_id={first.headers['X-Next-After-Id']}")
+    assert [a['id'] for a in second.get_json()] == ids[2:4]
+
+
+def test_filter_by_user(client):
+    _add_alerts(2, user_id=1)
+    mine = _add_alerts(2, user_id=2)
+    assert [a['id'] for a in client.get('/alerts?user_id=2').get_json()] == mine
+
+
+def test_invalid_page_args(client):
+    assert client.get('/alerts?limit=0').status_code == 400
+    assert client.get('/alerts?limit=abc').status_code == 400
+    assert client.get('/alerts?after_id=x').status_code == 400
+    assert client.get('/enderecos?user_id=1&limit=5000').status_code == 400
+
+
+def test_ndjson_stream(client):
+    ids = _add_alerts(3)
+    resp = client.get('/alerts?format=ndjson&after_id=%d' % ids[0])
+    assert resp.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)['id'] for line in resp.data.decode().splitlines()] == ids[1:]
+
+
+def test_enderecos_keyset(client):
+    created = [client.post('/enderecos', json={'id_usuario': 1, 'nome_local': f'n{i}',
+                                               'latitude': -23.5, 'longitude': -46.6}).get_json()['id_localizacao']
+               for i in range(3)]
+    resp = client.get('/enderecos?user_id=1&limit=2')
+    assert [e['id_localizacao'] for e in resp.get_json()] == created[:2]
+    rest = client.get(f"/enderecos?user_id=1&limit=2&after_id={resp.headers['X-Next-After-Id']}")
+    assert [e['id_localizacao'] for e in rest.get_json()] == created[2:]
+    assert 'X-Next-After-Id' not in rest.headers
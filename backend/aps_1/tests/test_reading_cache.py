@@ -0,0 +1,151 @@
+import threading
+import time
+
+from services.reading_cache import ReadingCache
+
+
+def _expire(cache, key, seconds):
+    entry = cache._data[key]
+    entry.fresh_until -= seconds
+    entry.stale_until -= seconds
+
+
+def test_hit_and_single_flight():
+    cache = ReadingCache(ttl=60, stale_ttl=60)
+    calls = []
+    release = threading.Event()
+
+    def loader():
+        calls.append(1)
+        release.wait(2)
+        return 'v'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('k', loader))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+    assert results == ['v'] * 5
+    assert len(calls) == 1
+    assert cache.get('k', loader) == 'v'
+    assert cache.stats()['hits'] == 1
+
+
+def test_stale_refresh_uses_bounded_pool():
+    cache = ReadingCache(ttl=10, stale_ttl=100, refresh_workers=2, max_pending_refreshes=4)
+    release = threading.Event()
+    for i in range(50):
+        cache.get(i, lambda: 'old')
+        _expire(cache, i, 20)
+    before = threading.active_count()
+
+    def slow():
+        release.wait(2)
+        return 'new'
+
+    served = [cache.get(i, slow) for i in range(50)]
+    assert served == ['old'] * 50
+    assert threading.active_count() - before <= 2
+    stats = cache.stats()
+    assert stats['refreshes'] == 4
+    assert stats['refreshes_dropped'] == 46
+    release.set()
+    deadline = time.time() + 2
+    while cache.stats()['pending_refreshes'] and time.time() < deadline:
+        time.sleep(0.01)
+    assert cache.stats()['pending_refreshes'] == 0
+    assert cache.peek(0)[0] == 'new'
+
+
+def test_refresh_dropped_for_key_already_loading():
+    cache = ReadingCache(ttl=10, stale_ttl=100)
+    cache.get('k', lambda: 'old')
+    _expire(cache, 'k', 20)
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(2)
+        return 'new'
+
+    assert cache.get('k', slow) == 'old'
+    assert cache.get('k', slow) == 'old'
+    release.set()
+    time.sleep(0.05)
+    assert len(calls) == 1
+
+
+def test_allow_stale_false_waits_for_fresh_value():
+    cache = ReadingCache(ttl=10, stale_ttl=100)
+    cache.get('k', lambda: 'old')
+    _expire(cache, 'k', 20)
+    assert cache.get('k', lambda: 'new', allow_stale=False) == 'new'
+    # a entrada atualizada vale para os demais chamadores
+    assert cache.get('k', lambda: 'newer') == 'new'
+
+
+def test_errors_are_not_cached():
+    cache = ReadingCache(ttl=60, stale_ttl=60)
+
+    def boom():
+        raise RuntimeError('upstream')
+
+    try:
+        cache.get('k', boom)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('esperava RuntimeError')
+    assert cache.get('k', lambda: 'v') == 'v'
+    assert cache.stats()['load_errors'] == 1
+
+
+def test_interactive_does_not_join_background_flight():
+    cache = ReadingCache(ttl=60, stale_ttl=60)
+    release = threading.Event()
+    results = {}
+
+    def budget_wait():
+        # carga do scheduler presa atrás da reserva do orçamento
+        release.wait(2)
+        return 'background'
+
+    worker = threading.Thread(target=lambda: results.update(bg=cache.get('k', budget_wait, background=True)))
+    worker.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    assert cache.get('k', lambda: 'interactive') == 'interactive'
+    assert time.monotonic() - started < 1
+    assert cache.stats()['bypassed'] == 1
+    release.set()
+    worker.join()
+    assert results['bg'] == 'background'
+
+
+def test_background_joins_interactive_flight():
+    cache = ReadingCache(ttl=60, stale_ttl=60)
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(2)
+        return 'v'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('k', loader))),
+               threading.Thread(target=lambda: results.append(cache.get('k', loader, background=True)))]
+    threads[0].start()
+    time.sleep(0.05)
+    threads[1].start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+    assert results == ['v', 'v']
+    assert len(calls) == 1
+    assert cache.stats()['collapsed'] == 1
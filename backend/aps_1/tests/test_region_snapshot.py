@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from services import external_api
+from services.aqi_history import history, history_key
+from services.geo import cell_key
+from services.region_snapshot import RegionSnapshot
+
+REGION = (-24.0, -47.0, -23.0, -46.0)
+NOW = int(time.time())
+
+
+def _bounds(region):
+    return {'status': 'ok', 'data': [
+        {'uid': 1, 'lat': -23.55, 'lon': -46.63, 'aqi': '57',
+         'station': {'name': 'Centro', 'time': '2026-10-17T10:00:00-03:00'}},
+        {'uid': 2, 'lat': -23.70, 'lon': -46.40, 'aqi': '-', 'station': {'name': 'Sem leitura'}},
+    ]}
+
+
+@pytest.fixture
+def snapshot(monkeypatch):
+    snap = RegionSnapshot([REGION])
+    monkeypatch.setattr(external_api, 'region_snapshot', snap)
+    monkeypatch.setattr(external_api, 'fetch_waqi_bounds', lambda region, token, background=False: _bounds(region))
+    monkeypatch.setattr(external_api, '_snapshot_recorded', type(external_api._snapshot_recorded)())
+    external_api.reading_cache.invalidate()
+    return snap
+
+
+def _feed(calls):
+    def feed(lat, lon, token, background=False):
+        calls.append((lat, lon))
+        return {'status': 'ok', 'data': {'aqi': 60, 'idx': 1, 'iaqi': {'pm25': {'v': 60}},
+                                         'time': {'iso': '2026-10-17T11:00:00-03:00'}}}
+    return feed
+
+
+def test_lookup_records_history_under_queried_cell(snapshot, monkeypatch):
+    stats = external_api.refresh_region_snapshot('token')
+    assert (stats['refreshed'], stats['stations']) == (1, 1)
+    writes = []
+    record = external_api.record_waqi_payload
+    monkeypatch.setattr(external_api, 'record_waqi_payload',
+                        lambda key, payload: writes.append(key) or record(key, payload))
+    # célula vizinha à da estação: o histórico fica onde /air-quality/history procura
+    queried = cell_key(-23.60, -46.70, external_api.READING_CACHE_PRECISION)
+    station = cell_key(-23.55, -46.63, external_api.READING_CACHE_PRECISION)
+    assert queried != station
+    for _ in range(3):
+        assert external_api.get_waqi_feed(-23.60, -46.70, 'token')['data']['aqi'] == 57
+    # a mesma observação é gravada uma vez só
+    assert writes == [history_key(queried)]
+    _, points = history.query(history_key(queried), 0, NOW + 86400, 'raw')
+    assert [p['aqi'] for p in points] == [57]
+    _, points = history.query(history_key(station), 0, NOW + 86400, 'raw')
+    assert points == []
+
+
+def test_snapshot_hit_has_no_pollutants(snapshot, monkeypatch):
+    external_api.refresh_region_snapshot('token')
+    calls = []
+    monkeypatch.setattr(external_api, 'fetch_waqi_feed', _feed(calls))
+    payload = external_api.get_waqi_feed(-23.55, -46.63, 'token')
+    assert payload['data']['iaqi'] == {}
+    assert payload['data']['snapshot']['stations'] == 1
+    assert calls == []
+    # quem mostra os poluentes vai ao feed (e a leitura entra no histórico da célula)
+    detailed = external_api.get_waqi_feed(-23.55, -46.63, 'token', detailed=True)
+    assert detailed['data']['iaqi'] == {'pm25': {'v': 60}}
+    assert len(calls) == 1
+
+
+def test_air_quality_route_uses_snapshot_unless_detailed(client, snapshot, monkeypatch):
+    external_api.refresh_region_snapshot('token')
+    calls = []
+    monkeypatch.setattr(external_api, 'fetch_waqi_feed', _feed(calls))
+    resp = client.get('/air-quality?lat=-23.55&lon=-46.63')
+    assert resp.status_code == 200
+    assert resp.get_json()['aqi'] == 57
+    assert resp.get_json()['snapshot']['stations'] == 1
+    assert calls == []
+    resp = client.get('/air-quality?lat=-23.55&lon=-46.63&detailed=1')
+    assert resp.get_json()['aqi'] == 60
+    assert 'snapshot' not in resp.get_json()
+    resp = client.post('/air-quality/batch', json=[{'lat': -23.55, 'lon': -46.63}])
+    assert resp.get_json()['results'][0]['aqi'] == 57
+    assert len(calls) == 1
@@ -0,0 +1,120 @@
+import pytest
+
+from services import resilience
+from services.resilience import BudgetExhaustedError, CircuitBreaker, TokenBucket
+
+
+class _Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(resilience, 'time', clock)
+    return clock
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    snapshot = breaker.snapshot()
+    assert snapshot['opened'] == 1
+    assert snapshot['short_circuited'] == 1
+    assert snapshot['retry_in_seconds'] == 30
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_allows_single_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # só uma chamada de teste por vez
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.snapshot()['opened'] == 2
+    # o novo período aberto conta a partir da falha do teste
+    clock.now += 29
+    assert not breaker.allow()
+
+
+def test_cancelled_probe_frees_the_slot(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.cancel()
+    assert breaker.allow()
+
+
+def test_invalid_budget():
+    with pytest.raises(ValueError):
+        TokenBucket(0, 10)
+    with pytest.raises(ValueError):
+        TokenBucket(1, 0.5)
+
+
+def test_background_keeps_the_reserve(clock):
+    bucket = TokenBucket(rate=1, burst=10, background_reserve=0.2)
+    for _ in range(8):
+        bucket.acquire(background=True, max_wait=0)
+    with pytest.raises(BudgetExhaustedError):
+        bucket.acquire(background=True, max_wait=0)
+    # a reserva continua disponível para o interativo
+    bucket.acquire(max_wait=0)
+    bucket.acquire(max_wait=0)
+    with pytest.raises(BudgetExhaustedError):
+        bucket.acquire(max_wait=0)
+    assert bucket.snapshot()['rejected'] == {'interactive': 1, 'background': 1}
+
+
+def test_acquire_waits_for_refill(clock):
+    bucket = TokenBucket(rate=2, burst=1)
+    bucket.acquire(max_wait=0)
+    started = clock.now
+    bucket.acquire(max_wait=1)
+    assert clock.now - started == pytest.approx(0.5)
+    assert bucket.snapshot()['waited_seconds'] == pytest.approx(0.5)
+
+
+def test_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket(rate=1, burst=5)
+    bucket.acquire(max_wait=0)
+    clock.now += 3600
+    assert bucket.snapshot()['tokens'] == 5
@@ -0,0 +1,231 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from routes import alerts as alerts_route
+from services.check_engine import CheckEngine
+from services.geo import cell_key
+from services.threshold_index import ReadingEngine, ThresholdIndex
+
+COOLDOWN = 3600
+PRECISION = 2
+T0 = 1_000_000.0
+CELL = (-23.5, -46.6)
+
+
+def _alert(alert_id, limit, lat=-23.5, lon=-46.6, last=None):
+    return {'id': alert_id, 'lat': lat, 'lon': lon, 'aqi_limit': limit,
+            'last_notified_at': last.isoformat() if last is not None else None, 'device_token': f't{alert_id}'}
+
+
+@pytest.fixture
+def index():
+    return ThresholdIndex(COOLDOWN, PRECISION, 'round')
+
+
+def _ids(fired):
+    return sorted(alert['id'] for alert in fired)
+
+
+def test_groups_by_cell(index):
+    index.rebuild([_alert(1, 50), _alert(2, 50, lat=-23.501), _alert(3, 50, lat=-22.9, lon=-43.2),
+                   {'id': 4, 'lat': 'norte', 'lon': 0, 'aqi_limit': 50}])
+    # -23.501 arredonda para a mesma célula; o alerta inválido fica de fora
+    assert sorted(index.cells()) == [(-23.5, -46.6), (-22.9, -43.2)]
+    assert index.cell_size(CELL) == 2
+    assert len(index) == 3
+    assert _ids(index.matches(CELL, 80, now=T0)[0]) == [1, 2]
+    assert _ids(index.matches((-22.9, -43.2), 80, now=T0)[0]) == [3]
+
+
+def test_only_limits_below_aqi_fire(index):
+    index.rebuild([_alert(i, limit) for i, limit in enumerate((10, 50, 99.5, 100, 100.5, 150))])
+    assert _ids(index.matches(CELL, 100, now=T0)[0]) == [0, 1, 2]
+    assert index.matches(CELL, 5, now=T0) == ([], 0)
+    assert _ids(index.matches(CELL, 1000, now=T0)[0]) == list(range(6))
+    assert index.matches((0.0, 0.0), 1000, now=T0) == ([], 0)
+
+
+def test_cooldown_suppresses(index):
+    now = datetime.utcnow()
+    index.rebuild([_alert(1, 50), _alert(2, 50, last=now - timedelta(minutes=10)),
+                   _alert(3, 50, last=now - timedelta(seconds=COOLDOWN + 60))])
+    fired, suppressed = index.matches(CELL, 80)
+    assert (_ids(fired), suppressed) == ([1, 3], 1)
+    index.mark_notified([1], when=T0)
+    fired, suppressed = index.matches(CELL, 80, now=T0 + COOLDOWN - 1)
+    assert 1 not in _ids(fired)
+    assert 1 in _ids(index.matches(CELL, 80, now=T0 + COOLDOWN)[0])
+
+
+def test_remove_and_readd(index):
+    index.rebuild([_alert(1, 50), _alert(2, 60)])
+    index.remove(1)
+    assert _ids(index.matches(CELL, 80, now=T0)[0]) == [2]
+    index.add(_alert(2, 90))
+    assert index.matches(CELL, 80, now=T0) == ([], 0)
+    index.remove(2)
+    assert index.cells() == []
+
+
+def test_repeated_observation_evaluates_only_dirty(index):
+    index.rebuild([_alert(1, 50), _alert(2, 60)])
+    notified = []
+    reading = {'value': (80, '2026-10-17T10:00:00')}
+    engine = ReadingEngine(index, lambda lat, lon: reading['value'],
+                           lambda alert, aqi: notified.append(alert['id']) or True)
+    stats = engine.run()
+    assert (stats['unchanged_cells'], stats['evaluated'], sorted(notified)) == (0, 2, [1, 2])
+    # mesma data.time: ninguém mudou de situação, nada é avaliado
+    notified.clear()
+    stats = engine.run()
+    assert (stats['unchanged_cells'], stats['evaluated'], notified) == (1, 0, [])
+    # alerta novo na célula: só ele passa pela observação repetida
+    index.add(_alert(3, 40))
+    stats = engine.run()
+    assert (stats['evaluated'], notified) == (1, [3])
+    # observação nova: a célula inteira é avaliada
+    notified.clear()
+    reading['value'] = (80, '2026-10-17T11:00:00')
+    stats = engine.run()
+    assert (stats['unchanged_cells'], stats['evaluated'], sorted(notified)) == (0, 3, [1, 2, 3])
+
+
+def test_expired_cooldown_is_dirty(index):
+    index.rebuild([_alert(1, 50), _alert(2, 50)])
+    assert _ids(index.matches(CELL, 80, now=T0)[0]) == [1, 2]
+    index.mark_notified([1, 2], when=T0)
+    index.observe(CELL, 80, 'T')
+    assert index.matches_changed(CELL, 80, now=T0 + 60) == ([], 0, 0)
+    index.mark_notified([2], when=T0 + 60)
+    # só o cooldown de 1 terminou: ele volta a valer para a mesma observação
+    fired, suppressed, evaluated = index.matches_changed(CELL, 80, now=T0 + COOLDOWN)
+    assert (_ids(fired), suppressed, evaluated) == ([1], 0, 1)
+    assert index.dirty_count() == 0
+
+
+def test_failed_send_is_evaluated_again(index):
+    index.rebuild([_alert(1, 50), _alert(2, 50)])
+    attempts = []
+    failures = {2: 1}   # o envio do alerta 2 falha uma vez
+
+    def notify(alert, aqi):
+        attempts.append(alert['id'])
+        if failures.get(alert['id']):
+            failures[alert['id']] -= 1
+            raise RuntimeError('FCM fora do ar')
+        return True
+
+    engine = ReadingEngine(index, lambda lat, lon: (80, 'T'), notify)
+    assert engine.run()['notified'] == 1
+    assert index.dirty_count() == 1
+    # mesma observação: só o envio que falhou é refeito
+    del attempts[:]
+    stats = engine.run()
+    assert (stats['unchanged_cells'], stats['evaluated'], stats['notified'], attempts) == (1, 1, 1, [2])
+
+
+@pytest.fixture
+def change_log(app, monkeypatch):
+    """Índice do modo 'reading' recomeçado do zero, com a carga completa espionada."""
+    monkeypatch.setattr(alerts_route, '_threshold_index', None)
+    rebuilds = []
+    rebuild = ThresholdIndex.rebuild
+
+    def spy(self, alerts, version=None):
+        rebuilds.append(version)
+        return rebuild(self, alerts, version)
+
+    monkeypatch.setattr(ThresholdIndex, 'rebuild', spy)
+    return app, rebuilds
+
+
+def _insert(limit, lat=-23.5, lon=-46.6):
+    return alerts_route.insert_alert({'user_id': 1, 'location': 'teste', 'lat': lat, 'lon': lon,
+                                      'aqi_limit': limit, 'device_token': f't{limit}'})
+
+
+def test_change_log_applies_edits_without_reload(change_log):
+    app, rebuilds = change_log
+    first = _insert(50)
+    index = alerts_route.get_threshold_index(app)
+    assert (len(index), len(rebuilds)) == (1, 1)
+    seq = index.version[0]
+
+    second = _insert(70)
+    assert alerts_route.get_threshold_index(app) is index
+    assert index.version[0] > seq
+    assert _ids(index.matches(CELL, 80, now=T0)[0]) == [first, second]
+
+    conn = alerts_route.store.connection()
+    with conn:
+        conn.execute('UPDATE alerts SET aqi_limit = 90 WHERE id = ?', (second,))
+    alerts_route.get_threshold_index(app)
+    assert _ids(index.matches(CELL, 80, now=T0)[0]) == [first]
+
+    alerts_route.delete_alert_row(first)
+    alerts_route.get_threshold_index(app)
+    assert len(index) == 1
+    assert _ids(index.matches(CELL, 100, now=T0)[0]) == [second]
+    # tudo pelo log: nenhuma carga completa além da primeira
+    assert len(rebuilds) == 1
+
+
+def test_pruned_change_log_forces_reload(change_log):
+    app, rebuilds = change_log
+    _insert(50)
+    index = alerts_route.get_threshold_index(app)
+    seq = index.version[0]
+    _insert(60)
+    _insert(70)
+    # a poda leva a mudança seguinte à aplicada: o log não basta mais
+    assert alerts_route.store.prune_changes(keep=1) > 0
+    assert alerts_route.store.changes_since(seq) is None
+    assert len(alerts_route.get_threshold_index(app)) == 3
+    assert len(rebuilds) == 2
+    assert rebuilds[-1][0] == alerts_route.store.last_change_seq()
+
+
+def _random_population(rnd, n):
+    now = datetime.utcnow()
+    cells = [(round(-24 + rnd.random(), 2), round(-47 + rnd.random(), 2)) for _ in range(20)]
+    population = []
+    for i in range(n):
+        lat, lon = rnd.choice(cells)
+        # longe da fronteira do cooldown: os dois motores leem o relógio em momentos diferentes
+        elapsed = rnd.choice((None, 60, 30 * 60, COOLDOWN + 600, 5 * COOLDOWN))
+        last = now - timedelta(seconds=elapsed) if elapsed is not None else None
+        population.append(_alert(i + 1, rnd.choice((25, 50, 75, 100, 100.5, 150)), lat, lon, last))
+    readings = {cell: rnd.choice((None, 20, 50, 80, 100, 101, 200)) for cell in cells}
+    return population, readings
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_agrees_with_threads_engine(seed):
+    population, readings = _random_population(random.Random(seed), 500)
+
+    def fetch(lat, lon):
+        return readings[cell_key(lat, lon, PRECISION)]
+
+    class _Collect:
+        def __init__(self):
+            self.ids = []
+
+        def add(self, key, token, title, body):
+            self.ids.append(key)
+
+    batch = _Collect()
+    apply = lambda alert, aqi: alerts_route.apply_aqi_to_alert(alert, aqi, batch=batch)
+    threads_stats = CheckEngine(fetch, apply, precision=PRECISION).run(population)
+
+    index = ThresholdIndex(alerts_route.COOLDOWN_SECONDS, PRECISION, 'round')
+    index.rebuild(population)
+    notified = []
+    reading_stats = ReadingEngine(index, fetch, lambda alert, aqi: notified.append(alert['id']) or True).run()
+
+    assert sorted(notified) == sorted(batch.ids)
+    assert notified  # a população sorteada dispara alguma coisa
+    assert reading_stats['notified'] == threads_stats['notified']
+    assert reading_stats['fetches'] == threads_stats['fetches']
+    assert reading_stats['failed_fetches'] == sum(1 for aqi in readings.values() if aqi is None)
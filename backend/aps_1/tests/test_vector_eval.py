@@ -0,0 +1,102 @@
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from services.geo import cell_key
+from services.threshold_index import iso_to_epoch
+from services.vector_eval import AlertColumns, evaluate_mask, evaluate_reference
+
+COOLDOWN = 3600
+NOW = datetime(2026, 3, 1, 12, 0, 0)
+NOW_EPOCH = iso_to_epoch(NOW.isoformat())
+
+
+def _columns(alerts, precision=2, mode='round'):
+    return AlertColumns.from_arrays(
+        [a['id'] for a in alerts], [a['lat'] for a in alerts], [a['lon'] for a in alerts],
+        [a['aqi_limit'] for a in alerts],
+        [iso_to_epoch(a['last_notified_at']) if a['last_notified_at'] else np.nan for a in alerts],
+        precision=precision, mode=mode)
+
+
+def _compare(alerts, readings, precision=2, mode='round'):
+    """readings: {célula: aqi ou None}; devolve (ids do NumPy, ids da referência)."""
+    columns = _columns(alerts, precision, mode)
+    cell_aqi = np.array([np.nan if readings.get(c) is None else readings[c] for c in columns.cells])
+    mask = evaluate_mask(columns, cell_aqi, NOW_EPOCH, COOLDOWN)
+    reference = evaluate_reference(
+        alerts, lambda a: readings.get(cell_key(a['lat'], a['lon'], precision, mode)), NOW, COOLDOWN)
+    return sorted(columns.ids[mask].tolist()), sorted(reference)
+
+
+def _alert(alert_id, limit, last=None, lat=-23.5, lon=-46.6):
+    return {'id': alert_id, 'lat': lat, 'lon': lon, 'aqi_limit': limit,
+            'last_notified_at': last.isoformat() if last is not None else None}
+
+
+def test_equal_to_limit_does_not_fire():
+    alerts = [_alert(1, 100), _alert(2, 99.5), _alert(3, 100.5)]
+    vectorized, reference = _compare(alerts, {(-23.5, -46.6): 100})
+    assert vectorized == reference == [2]
+
+
+def test_null_last_notified_is_outside_cooldown():
+    vectorized, reference = _compare([_alert(1, 50), _alert(2, 50, NOW)], {(-23.5, -46.6): 80})
+    assert vectorized == reference == [1]
+
+
+@pytest.mark.parametrize('elapsed, fires', [
+    (COOLDOWN, True),          # exatamente no fim do cooldown
+    (COOLDOWN - 1, False),
+    (COOLDOWN + 1, True),
+    (0, False),
+    (-60, False),              # relógio adiantado: ainda em cooldown
+])
+def test_cooldown_boundary(elapsed, fires):
+    alerts = [_alert(1, 50, NOW - timedelta(seconds=elapsed))]
+    vectorized, reference = _compare(alerts, {(-23.5, -46.6): 80})
+    assert vectorized == reference == ([1] if fires else [])
+
+
+def test_missing_reading_never_fires():
+    alerts = [_alert(1, 10), _alert(2, 10, lat=-22.0)]
+    vectorized, reference = _compare(alerts, {(-23.5, -46.6): None, (-22.0, -46.6): 50})
+    assert vectorized == reference == [2]
+
+
+@pytest.mark.parametrize('precision', [0, 1, 2, 3])
+def test_round_mode_cells_match_cell_key(precision):
+    # valores decimais em .5 cujo produto em ponto flutuante vira um empate exato
+    values = [-7.45, 58.55, 43.85, -50.445, -85.175, -1.835, 0.125, 2.5, -2.5, 0.0, -0.0, 89.995]
+    rnd = random.Random(7)
+    values += [round(rnd.uniform(-89, 89), precision + 1) for _ in range(2000)]
+    alerts = [_alert(i, 0, lat=v, lon=-v / 2) for i, v in enumerate(values)]
+    columns = _columns(alerts, precision)
+    for i, alert in enumerate(alerts):
+        assert columns.cells[columns.cell_idx[i]] == cell_key(alert['lat'], alert['lon'], precision)
+
+
+def test_geohash_mode_matches_reference():
+    alerts = [_alert(i, 40 + i, lat=-23.5 + i * 0.01) for i in range(20)]
+    readings = {cell_key(a['lat'], a['lon'], 5, 'geohash'): 50 for a in alerts}
+    vectorized, reference = _compare(alerts, readings, precision=5, mode='geohash')
+    assert vectorized == reference == list(range(10))
+
+
+def test_random_tables_match_reference():
+    rnd = random.Random(42)
+    cells = [(round(rnd.uniform(-24, -22), 2), round(rnd.uniform(-47, -45), 2)) for _ in range(50)]
+    readings = {c: (None if rnd.random() < 0.1 else float(rnd.randint(20, 250))) for c in cells}
+    alerts = []
+    for i in range(5000):
+        lat, lon = rnd.choice(cells)
+        last = NOW - timedelta(seconds=rnd.choice([rnd.randint(0, 3 * COOLDOWN), COOLDOWN])) \
+            if rnd.random() < 0.4 else None
+        limit = readings[(lat, lon)] if readings[(lat, lon)] is not None and rnd.random() < 0.1 \
+            else float(rnd.choice((50, 100, 150, 200)))
+        alerts.append(_alert(i, limit, last, lat, lon))
+    vectorized, reference = _compare(alerts, readings)
+    assert vectorized == reference
+    assert reference
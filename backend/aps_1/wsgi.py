@@ -0,0 +1,7 @@
+# wsgi.py
+# Ponto de entrada de produção: gunicorn wsgi:app (ver dockerfile, um único
+# worker). Se houver mais de um processo, cada um inicia o seu scheduler e a
+# coordenação por leases (ALERTS_COORDINATION) evita checagens em dobro.
+from app import create_app
+
+app = create_app({'START_SCHEDULER': True, 'START_OUTBOX_WORKERS': True})